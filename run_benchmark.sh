@@ -0,0 +1,4 @@
+#!/bin/sh
+
+# Time the process and thread executors over surface sizes and worker counts.
+python3 ./src/solar_benchmark.py -s ./tests/data/Patch_DEM.tif -o ./tests/results/ --scales 1 2 4 --workers 1 2 4 8
@@ -5,14 +5,11 @@
 import argparse
 from datetime import date
 import logging
+import math
 import os
 import sys
 import warnings
 
-# Solar defined code.
-import solar_utility as su
-import solar_angle_processor as sa
-
 logging.basicConfig(filename='solar.log',
                     format ='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
                     datefmt = "%Y-%m-%d %H:%M:%S", filemode='w', level=logging.INFO)
@@ -36,8 +33,48 @@ def arg_parse():
     parser.add_argument('-f', '--tiff', dest='tiff', action='store_true')
     parser.add_argument('-w', '--workers', type=int, default=4)
     parser.add_argument('-c', '--cmap', type=str, default='jet')
+    parser.add_argument('-k', '--checkpoint', dest='checkpoint', action='store_true')
+    parser.add_argument('-p', '--progressive', type=int, default=0)
+    parser.add_argument('-b', '--bounded', dest='bounded', action='store_true')
+    parser.add_argument('--pair_tolerance', type=float, default=0.0)
+    parser.add_argument('--shadow_cube', dest='shadow_cube', action='store_true')
+    parser.add_argument('-x', '--horizon', type=str, default=None)
+    parser.add_argument('--horizon_gsd', type=float, default=30.0)
+    # The --precision, -e and --render choices repeat su.PRECISIONS, sa.EXECUTORS and st.RENDERERS, whose
+    # modules are only loaded after parsing, solar_test.py keeps them the same.
+    parser.add_argument('--precision', type=str, default='compact', choices=['compact', 'double'])
+    parser.add_argument('-q', '--query', type=str, default=None)
+    parser.add_argument('-z', '--zones', type=str, default=None)
+    parser.add_argument('-u', '--update', type=str, default=None)
+    parser.add_argument('--cache', type=str, default=None)
+    parser.add_argument('--cache_size', type=float, default=None)
+    parser.add_argument('--blocks', type=int, default=0)
+    parser.add_argument('--native', dest='native', action='store_true')
+    parser.add_argument('-e', '--executor', type=str, default='process', choices=['process', 'thread', 'queue'])
+    parser.add_argument('--queue', type=str, default=None)
+    parser.add_argument('--render', type=str, default='figure', choices=['figure', 'lut'])
+    parser.add_argument('--tiles', type=int, nargs=2, default=None, metavar=('MIN_ZOOM', 'MAX_ZOOM'))
+    parser.add_argument('--tms', dest='tms', action='store_true')
+    parser.add_argument('--aggregate', type=date.fromisoformat, default=None, metavar='END_DATE')
+    parser.add_argument('--aggregate_step', type=int, default=1)
+    parser.add_argument('--histogram', type=int, default=0)
+    parser.add_argument('--bounds', type=float, nargs=4, default=None, metavar=('MIN_X', 'MIN_Y', 'MAX_X', 'MAX_Y'))
+    parser.add_argument('--sky_sectors', type=int, default=0)
+    parser.add_argument('--irradiance', dest='irradiance', action='store_true')
+    parser.add_argument('--panels', type=float, nargs='+', default=None, metavar='TILT AZIMUTH')
+    parser.add_argument('--dry_run', dest='dry_run', action='store_true')
+    parser.add_argument('--memory_limit', type=float, default=None)
+    parser.add_argument('--cost_model', type=str, default=None)
+    parser.add_argument('-a', '--resampling', type=str, default='near', choices=['near', 'max', 'med', 'q1', 'q3'])
     parser.set_defaults(radiation=False)
     parser.set_defaults(tiff=False)
+    parser.set_defaults(checkpoint=False)
+    parser.set_defaults(bounded=False)
+    parser.set_defaults(shadow_cube=False)
+    parser.set_defaults(native=False)
+    parser.set_defaults(tms=False)
+    parser.set_defaults(dry_run=False)
+    parser.set_defaults(irradiance=False)
     args = parser.parse_args()
     logging.info(args)
     return args
@@ -53,10 +90,93 @@ def main():
     # Parse the arguments.
     args = arg_parse()
 
+    # The panels are pairs of tilt and azimuth.
+    panels = None
+    if args.panels is not None:
+        if len(args.panels) % 2 != 0:
+            print('The panels are pairs of tilt and azimuth: ', args.panels)
+            sys.exit(1)
+        panels = list(zip(args.panels[0::2], args.panels[1::2]))
+
+    # The progressive levels are not checkpointed, only the full resolution pass is.
+    if args.checkpoint and args.progressive > 0:
+        print('The checkpoint (-k) and progressive (-p) options can not be combined.')
+        sys.exit(1)
+
+    # The solar code and its dependencies are only loaded once the arguments are good, so --help
+    # and a bad argument return at once.
+    import solar_utility as su
+    import solar_angle_processor as sa
+    import solar_aggregate as sd
+    import solar_cache as sk
+    import solar_estimate as se
+    import solar_horizon as sh
+    import solar_query as sq
+    import solar_rasterio as sr
+    import solar_remote as sm
+    import solar_update as sp
+
     print('Processing surface: ', args.surface)
 
+    # Set the dtypes of the intermediates and outputs.
+    su.set_precision(args.precision)
+
+    # Estimate the memory and runtime from the surface metadata alone, refusing a run past the memory limit.
+    if args.dry_run or args.memory_limit is not None:
+        (success, size) = se.get_surface_size(args.surface, args.gsd, args.native, args.bounds)
+        if not success:
+            sys.exit(1)
+        (height, width, lat, lon) = size
+        (sunrise, sunset) = su.get_sun_rise_set(args.year, args.month, args.day, args.time_zone, lat, lon)
+        time_count = len(su.get_processing_times(sunrise, sunset, args.increments))
+        days = 1
+        if args.aggregate is not None:
+            days = len(sd.get_days(date(args.year, args.month, args.day), args.aggregate, args.aggregate_step))
+        cost_model = se.load_cost_model(args.cost_model)
+        panel_count = len(panels) if panels else 0
+        rows = se.estimate_run(height, width, time_count, args.workers, args.executor, cost_model, args.irradiance,
+                               panel_count)
+        print('Surface of %d by %d points, %d times, %d days' % (height, width, time_count, days))
+        se.report_estimate(rows, days)
+        if args.memory_limit is not None and se.get_peak(rows) > args.memory_limit * 1048576:
+            tiles = se.get_tile_count(height, width, time_count, args.workers, args.memory_limit * 1048576,
+                                      args.executor, cost_model, args.irradiance, panel_count)
+            if tiles is None:
+                su.log('error', 'The run needs more than %.0f MB however it is tiled' % (args.memory_limit), stdout=True)
+            else:
+                su.log('error', 'The run needs more than %.0f MB, split the surface into %d by %d tiles with --bounds' %
+                       (args.memory_limit, tiles, tiles), stdout=True)
+            sys.exit(1)
+        if args.dry_run:
+            print('Done!')
+            return
+
+    # Open the stage cache.
+    cache = None
+    if args.cache is not None:
+        cache = sk.StageCache()
+        if args.cache_size is None:
+            args.cache_size = sk.CACHE_SIZE
+        cache.open_cache(args.cache, args.cache_size)
+
+    # Read only the window and overview needed from a remote surface, its blocks are kept in the stage cache
+    # or a block cache in the output path.
+    block_cache = cache
+    remote = [name for name in [args.surface, args.horizon, args.update] if name is not None and sm.is_remote(name)]
+    if block_cache is None and remote:
+        block_cache = sk.StageCache()
+        block_cache.open_cache(os.path.join(args.output_path, 'block_cache'), sk.CACHE_SIZE)
+    fetched = False
+    input_filename = args.surface
+    if sm.is_remote(args.surface) or args.bounds is not None:
+        (fetched, input_filename) = sm.fetch_surface(args.surface, args.output_path, args.bounds,
+                                                     None if args.native else args.gsd, block_cache)
+        if not fetched:
+            sys.exit(1)
+
     # Get the surface's GSD.
-    (resampled, surface_filename) = sa.preprocess_surface(args.surface, args.output_path, args.gsd)
+    (resampled, surface_filename) = sa.preprocess_surface(input_filename, args.output_path, args.gsd, args.resampling,
+                                                          cache, args.native)
 
     # Open the surface.
     (success, surface, metadata) = sa.load_surface(surface_filename)
@@ -75,20 +195,107 @@ def main():
 
     print('Processing date: ', local_date.isoformat())
 
+    # Report how far the max or quantile resampling changed the shadows, not only the elevations.
+    if resampled and args.resampling != 'near':
+        times = su.get_processing_times(sunrise, sunset, args.increments)
+        sa.report_resampling_shadows(input_filename, surface_filename, times, local_date, args.time_zone)
+
     # Append to the metadata.
     metadata.append(args.time_zone)
     metadata.append(args.increments)
     metadata.append(args.output_path)
     metadata.append(args.surface)
 
-    # Process the surface.
-    sa.process_surface(surface, metadata, local_date, sunrise, sunset, args.radiation, args.tiff, args.cmap, args.workers)
+    # Open the regional surface for the far field horizon.
+    horizon = None
+    if args.horizon is not None:
+        print('Processing horizon: ', args.horizon)
+        horizon_input = args.horizon
+        if sm.is_remote(args.horizon):
+            (success, horizon_input) = sm.fetch_surface(args.horizon, args.output_path, gsd=args.horizon_gsd,
+                                                        cache=block_cache)
+            if not success:
+                sys.exit(1)
+        (horizon_resampled, horizon_filename) = sa.preprocess_surface(horizon_input, args.output_path, args.horizon_gsd,
+                                                                      cache=cache)
+        horizon = sh.FarFieldHorizon()
+        pixel_size = metadata[6]
+        if isinstance(pixel_size, tuple):
+            pixel_size = max(pixel_size)
+        start_distance = math.hypot(metadata[2], metadata[3]) * pixel_size / 2.0
+        if not horizon.open_horizon(horizon_filename, lat, lon, start_distance):
+            sys.exit(1)
+        if horizon_resampled and os.path.exists(horizon_filename):
+            logging.info('Deleting (%s)' % (horizon_filename))
+            os.remove(horizon_filename)
+        if horizon_input != args.horizon and os.path.exists(horizon_input):
+            logging.info('Deleting (%s)' % (horizon_input))
+            os.remove(horizon_input)
+
+    # The sky view factor of the surface for the diffuse radiation, the same for every date.
+    sky_view = None
+    if (args.radiation or args.irradiance or panels) and args.sky_sectors > 0:
+        print('Processing sky view: ', args.sky_sectors)
+        sky_view = sa.get_sky_view(surface, metadata, args.sky_sectors, args.workers, args.executor, cache, args.queue)
+        (base, _) = os.path.splitext(os.path.basename(args.surface))
+        name = os.path.join(args.output_path, base + '_sky_view.tif')
+        logging.info('Saving sky view data (%s)' % (name))
+        sr.write_output(name, sky_view, metadata[8])
+
+    # Process the query points and polygons, the days to aggregate, the update of a previous run or the whole surface.
+    if args.query is not None:
+        print('Processing query: ', args.query)
+        sq.process_query(surface, metadata, local_date, sunrise, sunset, args.query, args.workers, horizon=horizon,
+                         radiation=args.radiation, sky_view=sky_view)
+    elif args.aggregate is not None:
+        print('Processing days until: ', args.aggregate.isoformat())
+        sd.process_days(surface, metadata, local_date, args.aggregate, args.radiation, args.cmap, args.workers,
+                        args.aggregate_step, args.histogram, horizon=horizon, bounded=args.bounded,
+                        pair_tolerance=args.pair_tolerance, cache=cache, blocks=args.blocks, executor=args.executor,
+                        queue_path=args.queue, sky_view=sky_view, irradiance=args.irradiance, panels=panels)
+    elif args.update is not None:
+        print('Processing update of: ', args.update)
+        previous_input = args.update
+        if sm.is_remote(args.update) or args.bounds is not None:
+            (success, previous_input) = sm.fetch_surface(args.update, args.output_path, args.bounds,
+                                                         None if args.native else args.gsd, block_cache)
+            if not success:
+                sys.exit(1)
+        (previous_resampled, previous_filename) = sa.preprocess_surface(previous_input, args.output_path, args.gsd,
+                                                                        args.resampling, cache, args.native)
+        if previous_input != args.update and os.path.exists(previous_input):
+            logging.info('Deleting (%s)' % (previous_input))
+            os.remove(previous_input)
+        (success, previous, _) = sa.load_surface(previous_filename)
+        if previous_resampled and os.path.exists(previous_filename):
+            logging.info('Deleting (%s)' % (previous_filename))
+            os.remove(previous_filename)
+        if not success:
+            sys.exit(1)
+        sp.process_update(surface, previous, metadata, local_date, sunrise, sunset, args.cmap, args.workers,
+                          args.update, horizon=horizon, bounded=args.bounded)
+    else:
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, args.radiation, args.tiff, args.cmap,
+                           args.workers, checkpoint=args.checkpoint, progressive=args.progressive, horizon=horizon,
+                           bounded=args.bounded, pair_tolerance=args.pair_tolerance,
+                           shadow_cube=args.shadow_cube, zones=args.zones, cache=cache,
+                           blocks=args.blocks, executor=args.executor, render=args.render, tiles=args.tiles,
+                           tms=args.tms, queue_path=args.queue, sky_view=sky_view,
+                           irradiance=args.irradiance, panels=panels)
+
+    # The workers on other nodes served every pool of the run, they stop now.
+    if args.executor == 'queue' and args.queue is not None:
+        import solar_queue as sw
+        sw.close_queue(args.queue)
 
-    # Clean up the temporary file.
+    # Clean up the temporary files.
     if resampled:
         if os.path.exists(surface_filename):
             logging.info('Deleting (%s)' % (surface_filename))
             os.remove(surface_filename)
+    if fetched and os.path.exists(input_filename):
+        logging.info('Deleting (%s)' % (input_filename))
+        os.remove(input_filename)
 
     logging.info('Terminated...')
     print('Done!')
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+"""Multi-day aggregation code."""
+
+from datetime import timedelta
+import logging
+import numpy as np
+import os
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_rasterio as sr
+import solar_utility as su
+
+# The daily products that are aggregated.
+PRODUCTS = ['light_secs', 'light_perc', 'radiation', 'irradiance']
+
+# The statistics written of each product.
+STATISTICS = ['sum', 'mean', 'min', 'max', 'variance']
+
+# The value range the histogram bins of a product cover, products without one have no histogram.
+HISTOGRAM_RANGES = {'light_secs': (0.0, 86400.0), 'light_perc': (0.0, 100.0)}
+
+class RunningStatistics:
+    """
+    Running statistics class, each day is folded into per point accumulators and dropped.
+    The mean and variance are updated with Welford's method so a season of days stays stable.
+    """
+
+    def __init__(self):
+        self.no_data = None
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.histogram = None
+        self.value_range = None
+
+    def open_statistics(self, shape, no_data, bins=0, value_range=None):
+        """Start the accumulators, with a histogram of fixed bins over the value range."""
+        self.no_data = no_data
+        self.count = np.zeros(shape, dtype=np.int32)
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.m2 = np.zeros(shape, dtype=np.float64)
+        self.min = np.full(shape, np.inf, dtype=su.get_dtype('aggregate'))
+        self.max = np.full(shape, -np.inf, dtype=su.get_dtype('aggregate'))
+        if bins > 0 and value_range is not None:
+            self.histogram = np.zeros((bins,) + tuple(shape), dtype=np.uint16)
+            self.value_range = value_range
+
+    def add(self, data, valid=None):
+        """Fold in a day, by default the points that are not no data."""
+        if valid is None:
+            valid = data != self.no_data
+        values = data[valid].astype(np.float64)
+        self.count[valid] += 1
+        delta = values - self.mean[valid]
+        mean = self.mean[valid] + delta / self.count[valid]
+        self.m2[valid] += delta * (values - mean)
+        self.mean[valid] = mean
+        self.min[valid] = np.minimum(self.min[valid], values)
+        self.max[valid] = np.maximum(self.max[valid], values)
+
+        if self.histogram is not None:
+            (low, high) = self.value_range
+            bins = self.histogram.shape[0]
+            index = np.clip(((values - low) * bins / (high - low)).astype(np.int64), 0, bins - 1)
+            points = np.flatnonzero(valid)
+            self.histogram.reshape(bins, -1)[index, points] += 1
+
+    def get_statistics(self):
+        """Get the sum, mean, min, max and population variance, no data where there were no days."""
+        has_data = self.count > 0
+        dtype = su.get_dtype('aggregate')
+        stats = {}
+        for name in STATISTICS:
+            stats[name] = su.create_image(self.count.shape, self.no_data, dtype)
+        stats['sum'][has_data] = self.mean[has_data] * self.count[has_data]
+        stats['mean'][has_data] = self.mean[has_data]
+        stats['min'][has_data] = self.min[has_data]
+        stats['max'][has_data] = self.max[has_data]
+        stats['variance'][has_data] = self.m2[has_data] / self.count[has_data]
+        return stats
+
+class DailyAggregate:
+    """
+    Daily aggregate class, the running statistics of the light in seconds, percentage, radiation and irradiance,
+    and of the panels a band each.
+    """
+
+    def __init__(self):
+        self.days = 0
+        self.no_data = None
+        self.statistics = {}
+
+    def open_aggregate(self, shape, no_data, bins=0, products=None):
+        """Start the statistics of each product of the run, by default all of them."""
+        self.no_data = no_data
+        if products is None:
+            products = PRODUCTS
+        for product in products:
+            self.statistics[product] = RunningStatistics()
+            self.statistics[product].open_statistics(shape, no_data, bins, HISTOGRAM_RANGES.get(product))
+
+    def add_day(self, light_in_seconds, percentage_light, radiation=None, irradiance=None, panels=None):
+        """
+        Fold in the products of a day, the no data of the percentage follows the light in seconds.
+        The statistics of the panels start with their first day.
+        """
+        valid = light_in_seconds != self.statistics['light_secs'].no_data
+        self.statistics['light_secs'].add(light_in_seconds, valid)
+        self.statistics['light_perc'].add(percentage_light, valid)
+        if radiation is not None and 'radiation' in self.statistics:
+            self.statistics['radiation'].add(radiation)
+        if irradiance is not None and 'irradiance' in self.statistics:
+            self.statistics['irradiance'].add(irradiance)
+        if panels is not None:
+            if 'panels' not in self.statistics:
+                self.statistics['panels'] = RunningStatistics()
+                self.statistics['panels'].open_statistics(panels.shape, self.no_data)
+            self.statistics['panels'].add(panels)
+        self.days += 1
+
+    def write_aggregate(self, output_path, base, profile):
+        """
+        Write the statistics of each product with days, and the histograms as a band per bin.
+        The statistics of the panels have a band per panel.
+        """
+        for product in self.statistics:
+            statistics = self.statistics[product]
+            if not statistics.count.any():
+                continue
+            stats = statistics.get_statistics()
+            for name in STATISTICS:
+                file_name = os.path.join(output_path, '%s_%s_%s.tif' % (base, product, name))
+                logging.info('Saving aggregate data (%s)' % (file_name))
+                if stats[name].ndim == 3:
+                    sr.write_bands(file_name, stats[name], profile)
+                else:
+                    sr.write_output(file_name, stats[name], profile)
+            if statistics.histogram is not None:
+                # A count of days has no no data value.
+                file_name = os.path.join(output_path, '%s_%s_histogram.tif' % (base, product))
+                logging.info('Saving aggregate histogram (%s)' % (file_name))
+                sr.write_bands(file_name, statistics.histogram, dict(profile, nodata=None))
+
+def get_days(start_date, end_date, step=1):
+    """Get the days from the start to the end date inclusive."""
+    days = []
+    local_date = start_date
+    while local_date <= end_date:
+        days.append(local_date)
+        local_date += timedelta(days=step)
+    return days
+
+def process_days(surface, metadata, start_date, end_date, radiation, cmap, workers, step=1, bins=0, **kwargs):
+    """
+    Process each day from the start to the end date and aggregate the daily products.
+    Only the aggregate is kept, the memory does not grow with the number of days.
+    """
+    height = metadata[2]
+    width = metadata[3]
+    lat = metadata[4]
+    lon = metadata[5]
+    no_data = metadata[7]
+    profile = metadata[8]
+    time_zone = metadata[10]
+    output_path = metadata[12]
+    surface_filename = metadata[13]
+
+    days = get_days(start_date, end_date, step)
+    logging.info('Processing %d days from %s to %s...' % (len(days), start_date.isoformat(), end_date.isoformat()))
+    # Only the products the run makes are aggregated.
+    products = ['light_secs', 'light_perc']
+    if radiation:
+        products.append('radiation')
+    if kwargs.get('irradiance'):
+        products.append('irradiance')
+    aggregate = DailyAggregate()
+    aggregate.open_aggregate((height, width), no_data, bins, products)
+    for local_date in days:
+        su.log('info', 'Processing date: %s' % (local_date.isoformat()), stdout=True)
+        (sunrise, sunset) = su.get_sun_rise_set(local_date.year, local_date.month, local_date.day, time_zone, lat,
+                                                lon)
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, radiation, False, cmap, workers,
+                           aggregate=aggregate, **kwargs)
+
+    # The base name of the outputs.
+    (_, tail) = os.path.split(surface_filename)
+    (base, _) = os.path.splitext(tail)
+    base += '_' + start_date.isoformat() + '_' + end_date.isoformat()
+    aggregate.write_aggregate(output_path, base, profile)
+
+    return aggregate
@@ -2,105 +2,117 @@
 
 """Angle processing."""
 
-import matplotlib
-matplotlib.use('Agg')
-
 import concurrent.futures
 import logging
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import os
 import tempfile
 import queue
 import warnings
 
-# Solar installed.
-from pysolar.solar import get_azimuth, get_altitude, radiation
-from tqdm import tqdm
-
 # Solar defined code.
+import solar_cache as sk
+import solar_checkpoint as sc
 import solar_geospatial as sg
+import solar_horizon as sh
 import solar_rasterio as sr
+import solar_shadow_cube as ss
+import solar_tiles as st
 import solar_utility as su
+import solar_zonal as sz
 
 warnings.filterwarnings("ignore")
 
 # Required to sort by the first value, e.g. tmp[0]
 q = queue.PriorityQueue()
 
-def process_column(col_data, no_data):
-    """Process a column returning an array of angles."""
-
-    # Get the length of the array.
-    length = len(col_data)
-
-    # Create a bucket for the results array.
-    result = su.create_image((length), no_data)
-
-    # Filter the no data values and record the position.
-    elevation = []
-    position = []
-    for indx in range(length):
-        if col_data[indx] != no_data:
-            elevation.append(col_data[indx])
-            position.append(float(indx))
- 
-    # We have nothing to do!
-    if len(elevation) <= 1:
-        logging.debug('Not enough elevations for comparison (%d)', len(elevation))
-        return result
-
-    # Change the values to arrays.
-    elevation = np.array(elevation)
-    position = np.array(position)
-
-    # Create the array of ratios.
-    ratios = su.create_image((length), 0.0)
-
-    # Work out the maximum angle.
-    for indx in range(len(elevation) - 1):
-        # Reset the angles to zeros.
-        ratios *= 0.0
-
-        # Difference from the reference point, i.
-        delta_ele = elevation[indx+1:] - elevation[indx]
-        delta_len = position[indx+1:] - position[indx]
-        delta_pos = position[indx]
-        delta_ratio = delta_ele / delta_len
-
-        # Get the angle between the reference and the next.
-        # Does this to the end.
-        for j in range(len(delta_ele)):
-            ratios[j] = delta_ratio[j]
-
-        # Find the max angle position.
-        pos = int(delta_pos)
-        max_ratio = np.amax(ratios)
-        max_angle = math.atan(max_ratio)
-        result[pos] = math.degrees(max_angle)
-
-    return result
-
-def process_angles(elevation, no_data):
-    """Process the angles column wise."""
-    (_, width) = elevation.shape
-    angles = su.create_image(elevation.shape, no_data)
-
-    for indx in range(width):
-        logging.debug('Processing column: %d', indx)
-        col_data = elevation[:, indx]
-        angles[:, indx] = process_column(col_data.flatten(), no_data)
-
-    return angles.copy()
+# The executors the times and blocks can run on.
+EXECUTORS = ['process', 'thread', 'queue']
+
+def process_angles(elevation, no_data, pixel_size=1.0, mask=None, max_elevation=None, altitude=None):
+    """
+    Process the angles column wise, optionally only where the mask is set, for all the columns at once.
+    Given the max elevation and the sun altitude the search stops where nothing can cast a shadow,
+    beyond it the angle is below the altitude but not exact.
+    Each step compares every point with the point that many rows further on, so the work is
+    in a few large NumPy operations that release the GIL.
+    """
+    angles = su.create_image(elevation.shape, no_data, su.get_dtype('angle'))
+
+    # Only the columns with a requested point are computed.
+    if mask is not None:
+        columns = np.nonzero(mask.any(axis=0))[0]
+        if len(columns) < elevation.shape[1]:
+            if len(columns) > 0:
+                angles[:, columns] = process_angles(elevation[:, columns], no_data, pixel_size, mask[:, columns],
+                                                    max_elevation, altitude)
+            return angles
+
+    (height, _) = elevation.shape
+    valid = elevation != no_data
+
+    # A point needs a later point to compare with.
+    later = np.cumsum(valid[::-1], axis=0)[::-1] > valid
+
+    # The search is bounded by the relief when the sun is up.
+    last_step = height - 1
+    reach = None
+    if max_elevation is not None and altitude is not None and altitude > 0:
+        reach = (max_elevation - elevation.astype(np.float64)) / math.tan(math.radians(altitude)) / pixel_size
+        if valid.any():
+            last_step = min(last_step, int(math.floor(np.amax(reach[valid]))))
+
+    # The largest ratio from each point to the points further on.
+    max_ratio = np.zeros(elevation.shape)
+    for step in range(1, last_step + 1):
+        pair = valid[:-step] & valid[step:]
+        if reach is not None:
+            pair &= reach[:-step] >= step
+        ratio = (elevation[step:] - elevation[:-step]).astype(np.float64) / (step * pixel_size)
+        np.maximum(max_ratio[:-step], np.where(pair, ratio, 0.0), out=max_ratio[:-step])
+
+    computed = valid & later
+    if mask is not None:
+        computed &= mask
+    angles[computed] = np.degrees(np.arctan(max_ratio[computed]))
+    return angles
+
+def process_angles_pair(elevation, no_data, pixel_size=1.0):
+    """
+    Process the angles column wise in both directions returning the forward and backward angles.
+    Each step of process_angles serves both, the ratio forward from the first point and negated backward
+    from the second.
+    """
+    forward = su.create_image(elevation.shape, no_data, su.get_dtype('angle'))
+    backward = su.create_image(elevation.shape, no_data, su.get_dtype('angle'))
+
+    (height, _) = elevation.shape
+    valid = elevation != no_data
+
+    # A point needs a later point forward and an earlier one backward to compare with.
+    later = np.cumsum(valid[::-1], axis=0)[::-1] > valid
+    earlier = np.cumsum(valid, axis=0) > valid
+
+    # The largest ratio from each point to the points further on in each direction.
+    forward_ratio = np.zeros(elevation.shape)
+    backward_ratio = np.zeros(elevation.shape)
+    for step in range(1, height):
+        pair = valid[:-step] & valid[step:]
+        ratio = (elevation[step:] - elevation[:-step]).astype(np.float64) / (step * pixel_size)
+        np.maximum(forward_ratio[:-step], np.where(pair, ratio, 0.0), out=forward_ratio[:-step])
+        np.maximum(backward_ratio[step:], np.where(pair, -ratio, 0.0), out=backward_ratio[step:])
+
+    computed = valid & later
+    forward[computed] = np.degrees(np.arctan(forward_ratio[computed]))
+    computed = valid & earlier
+    backward[computed] = np.degrees(np.arctan(backward_ratio[computed]))
+    return forward, backward
 
 def subtract_altitude(angles, altitude, no_data):
     """Subtract the altitude."""
-    (height, width) = angles.shape
-    for row in range(height):
-        for col in range(width):
-            if angles[row][col] != no_data:
-                angles[row][col] = altitude - angles[row][col]
+    valid = angles != no_data
+    angles[valid] = altitude - angles[valid]
 
     return angles.copy()
 
@@ -156,7 +168,7 @@ def fill_sun_void(pad_rows, pad_cols, height, width, no_data, time, data):
 def compute_light_in_seconds(sunrise, sunset, no_data):
     """Difference the values between sun rise and set."""
     (height, width) = sunrise.shape
-    light_secs = su.create_image((height, width), no_data)
+    light_secs = su.create_image((height, width), no_data, su.get_dtype('seconds', no_data))
     for row in range(height):
         for col in range(width):
             if sunrise[row][col] != no_data and sunset[row][col] != no_data:
@@ -178,25 +190,181 @@ def clean_given_surface(surface, data, no_data):
     return data.copy()
 
 def get_percentage_light(light_in_seconds, no_data, seconds_of_light):
-    """Comput the percentage of light."""
+    """Comput the percentage of light, no data is the percentage no data value (e.g. 255 for uint8 and -9999)."""
     logging.info('Computing the percentage of light...')
     (height, width) = light_in_seconds.shape
-    percentage = su.create_image(light_in_seconds.shape, 0, dtype=np.int16)
+    percentage = su.create_image(light_in_seconds.shape, su.get_no_data('percentage', no_data),
+                                 su.get_dtype('percentage'))
     for row in range(height):
         for col in range(width):
             if light_in_seconds[row][col] != no_data:
-                percentage[row][col] = int(100.0 * light_in_seconds[row][col] / seconds_of_light)
+                value = int(100.0 * light_in_seconds[row][col] / seconds_of_light)
+                percentage[row][col] = min(max(value, 0), 100)
 
     return percentage
 
-def preprocess_surface(surface_file, output_path, gsd):
-    """Optionally resample the surface to 1.0m GSD."""
+def fold_deltas(deltas, no_data):
+    """Fold the time ordered deltas into the sunrise and sunset."""
+    first = True
+    previous_delta = None
+    previous_time = None
+    sunrise = None
+    sunset = None
+    for tmp in deltas:
+        if not first:
+            logging.info('Processing times! %d to %d' % (previous_time, tmp[0]))
+            sunrise = compute_sunrise(previous_delta, tmp[1], previous_time, tmp[0], no_data, sunrise, sunset)
+            sunset = compute_sunset(previous_delta, tmp[1], previous_time, tmp[0], no_data, sunset)
+        else:
+            logging.info('Reference ' + str(tmp[0]))
+            sunset = su.create_image(tmp[1].shape, no_data, su.get_dtype('seconds', no_data))
+            sunrise = su.create_image(tmp[1].shape, no_data, su.get_dtype('seconds', no_data))
+
+        # Copy the delta to the previous.
+        first = False
+        previous_delta = tmp[1].copy()
+        previous_time = tmp[0]
+
+    return sunrise, sunset
+
+def get_shadow_boundary(delta, no_data, radius=1, tolerance=5.0):
+    """
+    Get the pixels within a radius of a change between light and shadow,
+    or within a tolerance in degrees of the sun altitude.
+    """
+    from scipy.ndimage import binary_dilation
+
+    valid = delta != no_data
+    shadow = valid & (delta < 0)
+    light = valid & (delta >= 0)
+    boundary = binary_dilation(shadow, iterations=radius) & binary_dilation(light, iterations=radius)
+    boundary |= valid & (np.abs(delta) < tolerance)
+    return boundary
+
+def process_progressive(surface, metadata, times, local_date, sunrise_time, sunset_time, tiff, cmap, workers, levels, base,
+                        far_fields=None, bounded=False, executor='process', queue_path=None):
+    """
+    Process the surface coarse to fine writing a preview at each coarse level.
+    Returns the time ordered deltas of the full resolution level.
+    """
+    # Tqdm is only loaded by the stages that report their progress.
+    from tqdm import tqdm
+
+    logging.info('Processing progressive surface with %d levels...' % (levels))
+    pad_rows = metadata[0]
+    pad_cols = metadata[1]
+    height = metadata[2]
+    width = metadata[3]
+    lat = metadata[4]
+    lon = metadata[5]
+    gsd = metadata[6]
+    no_data = metadata[7]
+    profile = metadata[8]
+    affine = metadata[9]
+    time_zone = metadata[10]
+    output_path = metadata[12]
+
+    if far_fields is None:
+        far_fields = {}
+
+    previous = None
+    pool = get_pool(workers, executor, queue_path)
+    for level in range(levels, -1, -1):
+        factor = 2 ** level
+        logging.info('Pyramid level %d, factor %d' % (level, factor))
+        level_surface = surface
+        if factor > 1:
+            level_surface = sr.downsample_image(surface, factor, no_data)
+
+        # The coarser level picks out the pixels worth computing.
+        masks = {}
+        upsampled = {}
+        if previous is not None:
+            for time in times:
+                up = sr.upsample_image(previous[time], 2, level_surface.shape, no_data)
+                mask = get_shadow_boundary(up, no_data, radius=2)
+                mask |= (up == no_data) & (level_surface != no_data)
+                masks[time] = mask
+                upsampled[time] = up
+                logging.info('Time %d refining %d pixels' % (time, np.count_nonzero(mask)))
+
+        # Compute the deltas of the level.
+        current = {}
+        with tqdm(total=len(times), desc="Processing level %d" % (level)) as bar1:
+            futures = []
+            for time in times:
+                futures.append(pool.submit(process_time, time, local_date, time_zone, lat, lon, level_surface,
+                                           no_data, scale_pixel_size(gsd, factor), masks.get(time), far_fields.get(time),
+                                           bounded))
+
+            for x in concurrent.futures.as_completed(futures):
+                tmp = x.result()
+                delta = tmp[1]
+                if tmp[0] in masks:
+                    # Keep the coarse value where the refinement has nothing.
+                    refined = masks[tmp[0]] & (tmp[1] != no_data)
+                    delta = upsampled[tmp[0]]
+                    delta[refined] = tmp[1][refined]
+                current[tmp[0]] = delta
+                bar1.update(1)
+        previous = current
+
+        # Write the preview of the coarse level.
+        if factor > 1:
+            deltas = [[time, current[time]] for time in times]
+            (sunrise, sunset) = fold_deltas(deltas, no_data)
+            sunrise = sr.upsample_image(sunrise, factor, surface.shape, no_data)
+            sunset = sr.upsample_image(sunset, factor, surface.shape, no_data)
+            (_, _, _, percentage_light) = get_light_products(sunrise, sunset, surface, times, pad_rows, pad_cols,
+                                                             height, width, no_data)
+            preview_base = base + '_preview_%d' % (factor)
+            if tiff:
+                name = os.path.join(output_path, preview_base + '_light_perc.tif')
+                logging.info('Saving preview percentage light data (%s)' % (name))
+                sr.write_output(name, percentage_light, dict(profile, nodata=su.get_no_data('percentage', no_data)))
+            get_colormap(output_path, preview_base, local_date.isoformat(), sunrise_time, sunset_time,
+                         percentage_light, affine, cmap)
+    pool.shutdown()
+
+    return [[time, previous[time]] for time in times]
+
+def get_light_products(sunrise, sunset, surface, times, pad_rows, pad_cols, height, width, no_data):
+    """Get the clipped sunrise, sunset, light in seconds and percentage of light."""
+    # Fill the voids and clip the padding.
+    end_time = len(times) - 1
+    sunrise = fill_sun_void(pad_rows, pad_cols, height, width, no_data, times[0], sunrise)
+    sunrise = sr.clip_padded_image(sunrise, pad_rows, pad_cols, no_data)
+    sunset = fill_sun_void(pad_rows, pad_cols, height, width, no_data, times[end_time], sunset)
+    sunset = sr.clip_padded_image(sunset, pad_rows, pad_cols, no_data)
+    surface = sr.clip_padded_image(surface, pad_rows, pad_cols, no_data)
+
+    # Get the light in seconds per point.
+    light_in_seconds = compute_light_in_seconds(sunrise, sunset, no_data)
+
+    # Clean the data up, i.e. no surface point no output.
+    sunset = clean_given_surface(surface, sunset, no_data)
+    sunrise = clean_given_surface(surface, sunrise, no_data)
+    light_in_seconds = clean_given_surface(surface, light_in_seconds, no_data)
+
+    # Get the percentage of light.
+    seconds_of_light = times[end_time] - times[0]
+    percentage_light = get_percentage_light(light_in_seconds, no_data, seconds_of_light)
+
+    return sunrise, sunset, light_in_seconds, percentage_light
+
+def preprocess_surface(surface_file, output_path, gsd, resampling='near', cache=None, native=False):
+    """
+    Optionally resample the surface to 1.0m GSD, a cached resampled surface is used as is.
+    Native, a geographic surface is used as is rather than warped to UTM.
+    """
     logging.info('Surface preprocess...')
     resampled = False
     surface_tmpname = surface_file
     (srcEpsg, ground_x, ground_y, no_data) = sr.get_epsg(surface_tmpname)
     force_resample = False
-    if srcEpsg != None:
+    if native and srcEpsg != None and sg.is_geographic_epsg(srcEpsg):
+        logging.info('Processing the geographic surface %s natively' % (surface_file))
+    elif srcEpsg != None:
         dstEpsg = 0
         if not sg.is_valid_utm_epsg(srcEpsg):
             dstEpsg = sg.get_utm_epsg_from_epsg(srcEpsg, ground_x, ground_y)
@@ -205,14 +373,95 @@ def preprocess_surface(surface_file, output_path, gsd):
             dstEpsg = srcEpsg
 
         if force_resample or sr.get_gsd(surface_tmpname) < gsd:
+            # The resampled surface is keyed by the surface bytes and the resampling.
+            if cache is not None:
+                key = cache.get_file_key(surface_file, gsd, dstEpsg, resampling)
+                cached = cache.get_file(key, '.tif')
+                if cached is not None:
+                    return resampled, cached
+
             logging.info('Reampling %s to %f...' % (surface_file, gsd))
             temp_name = next(tempfile._get_candidate_names())
             surface_tmpname = os.path.join(output_path, temp_name + '.tif')
-            sr.resample_image(surface_file, surface_tmpname, srcEpsg, dstEpsg, gsd, no_data)
+            sr.resample_image(surface_file, surface_tmpname, srcEpsg, dstEpsg, gsd, no_data, resampling)
             resampled = True
 
+            # Report how far the resampled surface is from the full resolution.
+            if resampling != 'near':
+                report_resampling(surface_file, surface_tmpname, no_data)
+
+            if cache is not None:
+                cache.put_file(key, surface_tmpname)
+
     return resampled, surface_tmpname
 
+def report_resampling(surface_file, resampled_file, no_data):
+    """Report the difference between the resampled and the full resolution surface."""
+    if no_data is None:
+        no_data = -9999
+    stats = sr.compare_surfaces(surface_file, resampled_file, no_data)
+    if stats is not None:
+        su.log('info', 'Resampled minus full resolution elevation: min %.3f max %.3f mean %.3f rms %.3f' %
+               (stats['min'], stats['max'], stats['mean'], stats['rms']), stdout=True)
+        su.log('info', 'Full resolution pixels above the resampled surface: %.3f%%' % (stats['lost']), stdout=True)
+    else:
+        su.log('warn', 'Could not compare %s with %s' % (resampled_file, surface_file))
+
+    return stats
+
+def compare_shadows(full_file, resampled_file, time, local_date, time_zone):
+    """
+    Compare the shadows of a time on the resampled surface with those on the full resolution surface.
+    Returns the percentages of full resolution points whose shadow differs, lit on the resampled surface but
+    shadowed at full resolution (lost) and the reverse (added), None when a surface can not be processed.
+    """
+    shadows = []
+    for name in [full_file, resampled_file]:
+        (success, surface, metadata) = load_surface(name)
+        if not success or metadata[4] is None:
+            return None
+        (pad_rows, pad_cols, _, _, lat, lon, gsd, no_data, profile) = metadata[0:9]
+        (_, delta) = process_time(time, local_date, time_zone, lat, lon, surface, no_data, gsd)
+        delta = sr.clip_padded_image(delta, pad_rows, pad_cols, no_data)
+        shadow = np.where(delta == no_data, -1, delta < 0).astype(np.int8)
+        shadows.append((shadow, profile))
+
+    # Place the resampled shadows on the full resolution grid, only the points of both are compared.
+    (full, full_profile) = shadows[0]
+    (resampled, resampled_profile) = shadows[1]
+    resampled = sr.place_on_grid(resampled, resampled_profile, full.shape, full_profile, -1)
+    valid = (full != -1) & (resampled != -1)
+    if not valid.any():
+        return None
+    full = full[valid] == 1
+    resampled = resampled[valid] == 1
+    return {'differ': float(100.0 * np.count_nonzero(full != resampled) / full.size),
+            'lost': float(100.0 * np.count_nonzero(full & ~resampled) / full.size),
+            'added': float(100.0 * np.count_nonzero(~full & resampled) / full.size)}
+
+def report_resampling_shadows(full_file, resampled_file, times, local_date, time_zone):
+    """
+    Report how far the resampling changed the shadows, at a quarter of the day when they are long.
+    The surface is processed once more at full resolution for the time.
+    """
+    time = (3.0 * times[0] + times[-1]) / 4.0
+    (h, m, s) = su.get_time_from_seconds(time)
+    stats = compare_shadows(full_file, resampled_file, time, local_date, time_zone)
+    if stats is not None:
+        su.log('info', 'Shadows at %02d:%02d:%02d differing from the full resolution surface: %.3f%% (lost %.3f%% '
+               'added %.3f%%)' % (h, m, s, stats['differ'], stats['lost'], stats['added']), stdout=True)
+    else:
+        su.log('warn', 'Could not compare the shadows of %s with %s' % (resampled_file, full_file))
+
+    return stats
+
+def get_padding(height, width):
+    """Get the rows and columns padding the surface to its diagonal, so it can rotate freely."""
+    max_length = int(math.hypot(height, width) + 1)
+    pad_cols = int((max_length - width) / 2.0)
+    pad_rows = int((max_length - height) / 2.0)
+    return pad_rows, pad_cols
+
 def load_surface(surface_file):
     """Load the surface."""
 
@@ -234,15 +483,11 @@ def load_surface(surface_file):
         # Get the size of the image.
         (height, width) = dem.shape()
 
-        # Max length in the image so we can rotate freely.
-        max_length = int(math.hypot(height, width) + 1)
-
         # Get the DEM data.
         hgt = dem.get_bands(1)
 
         # Get the padding to place the DEM in the center.
-        pad_cols = int((max_length - width) / 2.0)
-        pad_rows = int((max_length - height) / 2.0)
+        (pad_rows, pad_cols) = get_padding(height, width)
 
         # Place the dem in the center.
         padded = sr.padded_image(hgt, pad_rows, pad_cols)
@@ -259,8 +504,11 @@ def load_surface(surface_file):
 
         logging.info('Centroid %d (Lat: %.8f, Lon: %.8f)' % (epsg_code, lat, lon))
 
-        # Get the average GSD.
+        # Get the average GSD, a geographic pixel is a width and height in meters.
         gsd = dem.get_avg_gsd()
+        if sg.is_geographic_epsg(epsg_code):
+            gsd = sg.get_metric_pixel_size(dem.get_affine(), lat)
+            logging.info('Geographic pixel of %.3fm by %.3fm' % gsd)
 
         # Get the no data value.
         no_data = dem.no_data()
@@ -281,6 +529,11 @@ def load_surface(surface_file):
 
 def get_colormap(output_path, base, title, sunrise_time, sunset_time, percentage_light, affine, color_scheme):
     """Write colormap."""
+    # Matplotlib is only loaded when a figure is drawn.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
     name = os.path.join(output_path, base + '_light_perc.png')
     logging.info('Saving color map data (%s)' % (name))
 
@@ -293,7 +546,8 @@ def get_colormap(output_path, base, title, sunrise_time, sunset_time, percentage
     fig = plt.figure()
     fig.set_size_inches(width_inches + 1, height_inches)
     ax = plt.subplot(111)
-    im = ax.imshow(percentage_light, cmap = color_scheme)
+    # The no data value of the percentage is outside 0 to 100.
+    im = ax.imshow(np.ma.masked_outside(percentage_light, 0, 100), cmap = color_scheme)
     plt.title(title)
     fig.suptitle('Percentage of daylight', fontsize=12)
     plt.xlabel(sr_ss_text)
@@ -304,8 +558,12 @@ def get_colormap(output_path, base, title, sunrise_time, sunset_time, percentage
     name = os.path.join(output_path, base + '_light_perc.pngw')
     sr.write_affine(name, affine)
 
-def get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date, time_zone, lat, lon, no_data):
-    """Get the radiation product."""
+def get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date, time_zone, lat, lon, no_data,
+                          sky_view=None):
+    """
+    Get the radiation product, the direct beam between the sunrise and sunset of each point.
+    Given the sky view factor the diffuse radiation of the visible sky is added.
+    """
     (x_sec, y_rad) = precompute_radiation(sunrise_time, sunset_time, local_date, time_zone, lat, lon)
 
     # Iterate across the image.
@@ -313,7 +571,7 @@ def get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date
     radiation = None
     if sunrise.shape == sunset.shape: 
         (height, width) = sunrise.shape
-        radiation = su.create_image((height, width), no_data)
+        radiation = su.create_image((height, width), no_data, su.get_dtype('radiation'))
         for row in range(height):
             for col in range(width):
                 sunrise_secs = sunrise[row][col]
@@ -321,6 +579,12 @@ def get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date
                 if sunrise_secs != no_data and sunset_secs != no_data:
                     radiation[row][col] = get_radiation(sunrise_secs, sunset_secs, x_sec, y_rad) 
         success = True      
+
+        # The diffuse radiation of the whole sky over the day, the points see the part of it their horizon leaves.
+        if sky_view is not None and sky_view.shape == radiation.shape:
+            diffuse = get_diffuse_radiation(x_sec, y_rad, local_date)
+            seen = sky_view != no_data
+            radiation[seen] = np.where(radiation[seen] != no_data, radiation[seen], 0.0) + sky_view[seen] * diffuse
         # name = os.path.join(output_path, base + '_radiation.tif')
         # logging.info('Saving radiation data (%s)' % (name))
         # io.imsave(name, radiation)
@@ -332,6 +596,9 @@ def get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date
 
 def precompute_radiation(sunrise_time, sunset_time, local_date, time_zone, lat, lon):
     """Precompute the radiation."""
+    # Pysolar is only loaded by the stages that place the Sun.
+    from pysolar.solar import get_altitude, radiation
+
     logging.info('Precomputing the radiation...')
     sunrise_secs = su.get_seconds_from_datetime(sunrise_time)
     sunset_secs = su.get_seconds_from_datetime(sunset_time)
@@ -352,6 +619,67 @@ def precompute_radiation(sunrise_time, sunset_time, local_date, time_zone, lat,
 
     return x_sec, y_rad
 
+def get_sky_diffuse_factor(day):
+    """Get the clear sky ratio of the diffuse horizontal to the direct beam radiation of the day of the year."""
+    # from Masters, p. 416, as the direct beam of pysolar.
+    return 0.095 + 0.04 * math.sin(2.0 * math.pi / 365.0 * (day - 100))
+
+def get_diffuse_radiation(x_sec, y_rad, local_date):
+    """Get the clear sky diffuse radiation of the whole sky over the day, from the precomputed direct beam."""
+    if len(x_sec) < 2:
+        return 0.0
+    factor = get_sky_diffuse_factor(local_date.timetuple().tm_yday)
+    return factor * np.trapz(y_rad, x_sec) / 3600
+
+def process_sky_sector(azimuth, surface, no_data, pixel_size=1.0):
+    """
+    Get the sine of the horizon angle toward an azimuth of every point, the horizon of the time steps without the sun.
+    A point with nothing further on, the edge of the surface, has an open horizon.
+    """
+    (rotation_angle, pixel_size) = get_pixel_rotation(azimuth, pixel_size)
+    rotated_surface = sr.rotate_image(surface, rotation_angle)
+    angles = process_angles(rotated_surface, no_data, pixel_size)
+    horizon = sr.rotate_image(angles, -rotation_angle)
+    return np.where(horizon != no_data, np.sin(np.radians(horizon, dtype=np.float64)), 0.0)
+
+def get_sky_view(surface, metadata, sectors, workers, executor='process', cache=None, queue_path=None):
+    """
+    Get the sky view factor of the clipped surface from the horizon angles of the sectors, one minus the mean of
+    their sines. It depends on the surface alone, so a run computes it once for all its dates.
+    """
+    from tqdm import tqdm
+
+    pad_rows = metadata[0]
+    pad_cols = metadata[1]
+    gsd = metadata[6]
+    no_data = metadata[7]
+
+    key = None
+    if cache is not None:
+        key = cache.get_key('sky_view', surface, no_data, gsd, sectors)
+        stored = cache.get(key)
+        if stored is not None:
+            return stored['sky_view']
+
+    logging.info('Processing the sky view of %d sectors...' % (sectors))
+    sines = np.zeros(surface.shape)
+    pool = get_pool(workers, executor, queue_path)
+    futures = [pool.submit(process_sky_sector, 360.0 * indx / sectors, surface, no_data, gsd)
+               for indx in range(sectors)]
+    with tqdm(total=sectors, desc="Processing sky view") as bar:
+        for x in concurrent.futures.as_completed(futures):
+            sines += x.result()
+            bar.update(1)
+    pool.shutdown()
+
+    sky_view = (1.0 - sines / sectors).astype(su.get_dtype('radiation'))
+    sky_view[surface == no_data] = no_data
+    sky_view = sr.clip_padded_image(sky_view, pad_rows, pad_cols, no_data)
+    if key is not None:
+        cache.put(key, sky_view=sky_view)
+
+    return sky_view
+
 def get_radiation(sunrise_secs, sunset_secs, x_sec, y_rad):
     """Get the solar radiation given the sunrise and sunset in seconds."""
     x_sec_local = []
@@ -371,42 +699,336 @@ def get_radiation(sunrise_secs, sunset_secs, x_sec, y_rad):
     # Return what we have, zero is an error.
     return area
 
-def process_time(time, local_date, time_zone, lat, lon, surface, no_data):
+def get_sun_position(time, local_date, time_zone, lat, lon):
+    """Get the Sun azimuth and altitude in degrees for the time in seconds."""
+    from pysolar.solar import get_azimuth, get_altitude
+
+    (h, m, s) = su.get_time_from_seconds(time)
+    local_datetime = su.combine_datetime(local_date, h, m, int(s), time_zone)
+    return get_azimuth(lat, lon, local_datetime), get_altitude(lat, lon, local_datetime)
+
+def get_rotation_angle(sun_azimuth):
+    """
+    Get the counter-clockwise rotation placing the sun at the bottom of the image.
+    The azimuth is clockwise from north, so north at the top turns to the south.
+    """
+    return sun_azimuth - 180.0
+
+def get_pixel_rotation(sun_azimuth, pixel_size):
+    """
+    Get the rotation angle and the ground distance of a step toward the sun.
+    The pixel size is the GSD, or for a geographic surface the width and height of a pixel in meters,
+    when the sun direction is skewed into the pixel grid.
+    """
+    if not isinstance(pixel_size, tuple):
+        return get_rotation_angle(sun_azimuth), pixel_size
+
+    # The pixels moved per meter toward the sun.
+    radians = math.radians(sun_azimuth)
+    col_step = math.sin(radians) / pixel_size[0]
+    row_step = math.cos(radians) / pixel_size[1]
+    pixel_azimuth = math.degrees(math.atan2(col_step, row_step))
+    return get_rotation_angle(pixel_azimuth), 1.0 / math.hypot(col_step, row_step)
+
+def scale_pixel_size(pixel_size, factor):
+    """Scale the GSD, or the width and height, of a pixel."""
+    if isinstance(pixel_size, tuple):
+        return (pixel_size[0] * factor, pixel_size[1] * factor)
+    return pixel_size * factor
+
+def process_time(time, local_date, time_zone, lat, lon, surface, no_data, pixel_size=1.0, mask=None, far_field=None,
+                 bounded=False):
     logging.info('Process time %d' % (time))
     (h, m, s) = su.get_time_from_seconds(time)
     logging.info('Time: %.3f (%02d:%02d:%7.5f)', time, h, m, s)
 
-    # Combine the date and time.
-    local_datetime = su.combine_datetime(local_date, h, m, int(s), time_zone)
-
-    # Get the Sun azimuth for the time.
-    sun_azimuth = get_azimuth(lat, lon, local_datetime)
+    # Get the Sun azimuth and altitude for the time.
+    (sun_azimuth, sun_altitude) = get_sun_position(time, local_date, time_zone, lat, lon)
     logging.info('Sun azimuth: %.5f', sun_azimuth)
+    logging.info('Sun altitude: %.5f', sun_altitude)
 
     # Rotate the DEM to make the sun be at the bottom.
-    rotation_angle = sun_azimuth
+    (rotation_angle, pixel_size) = get_pixel_rotation(sun_azimuth, pixel_size)
     rotated_surface = sr.rotate_image(surface, rotation_angle)
 
+    # Rotate the mask of the points to compute.
+    rotated_mask = None
+    if mask is not None:
+        rotated_mask = sr.rotate_image(mask.astype(su.get_dtype('mask')), rotation_angle, no_data=False)
+
+    # Bound the search by the relief of the surface.
+    max_elevation = None
+    if bounded:
+        max_elevation = np.amax(surface[surface != no_data])
+
     # Work out the max angle from a point to the surface.
-    angles = process_angles(rotated_surface, no_data)
+    angles = process_angles(rotated_surface, no_data, pixel_size, rotated_mask, max_elevation, sun_altitude)
 
-    # Get the sun altitude.
-    sun_altitude = get_altitude(lat, lon, local_datetime)
-    logging.info('Sun altitude: %.5f', sun_altitude)
+    # Work out the angle difference from the sun and rotate it back.
+    rotated_delta = rotate_delta(angles, sun_altitude, rotation_angle, surface, no_data, far_field)
+ 
+    logging.info('Adding to the queue')
+    tmp = [time, rotated_delta.copy()]
+    return tmp
 
-    # Work out the angle difference from the sun., no_data
+def rotate_delta(angles, sun_altitude, rotation_angle, surface, no_data, far_field=None):
+    """Get the delta from the sun of the rotated angles, rotated back to the surface."""
     # Negative values imply the point is in the shadow.
     delta = subtract_altitude(angles, sun_altitude, no_data)
 
     # Rotate back the angle.
     rotated_delta = sr.rotate_image(delta, -rotation_angle)
- 
-    logging.info('Adding to the queue')
-    tmp = [time, rotated_delta.copy()]
-    return tmp
 
-def process_surface(surface, metadata, local_date, sunrise_time, sunset_time, radiation, tiff, cmap, workers):
-    """Process the surface data."""
+    # A distant horizon can hide the sun too.
+    if far_field is not None:
+        rotated_delta = sh.apply_far_field(rotated_delta, surface, sun_altitude, far_field, no_data)
+
+    return rotated_delta
+
+def process_time_block(time, local_date, time_zone, lat, lon, surface, no_data, pixel_size, columns, bounded=False):
+    """Process a block of the columns of the rotated surface for a time, returning the time, first column and angles."""
+    logging.info('Process time %d columns %d to %d' % (time, columns[0], columns[1]))
+    (sun_azimuth, sun_altitude) = get_sun_position(time, local_date, time_zone, lat, lon)
+    (rotation_angle, pixel_size) = get_pixel_rotation(sun_azimuth, pixel_size)
+    rotated_surface = sr.rotate_image(surface, rotation_angle)
+
+    max_elevation = None
+    if bounded:
+        max_elevation = np.amax(surface[surface != no_data])
+
+    angles = process_angles(rotated_surface[:, columns[0]:columns[1]], no_data, pixel_size, None, max_elevation,
+                            sun_altitude)
+    return [time, columns[0], angles]
+
+def get_column_costs(surface, no_data, rotation_angle, sun_altitude, pixel_size=1.0, max_elevation=None):
+    """
+    Estimate the cost of each column of the rotated surface.
+    Each valid point searches the rest of its column, or as far as the relief bound reaches.
+    """
+    valid = sr.rotate_image((surface != no_data).astype(su.get_dtype('mask')), rotation_angle, no_data=False)
+    counts = np.count_nonzero(valid, axis=0).astype(np.float64)
+    search = counts / 2.0
+    if max_elevation is not None and sun_altitude > 0:
+        relief = max_elevation - np.amin(surface[surface != no_data])
+        search = np.minimum(search, relief / math.tan(math.radians(sun_altitude)) / pixel_size)
+
+    return counts * (search + 1.0)
+
+def split_columns(costs, blocks):
+    """Split the columns into blocks of about equal cost, the blocks with nothing to do are dropped."""
+    cumulative = np.cumsum(costs)
+    targets = cumulative[-1] * np.arange(1, blocks) / float(blocks)
+    edges = np.unique(np.concatenate([[0], np.searchsorted(cumulative, targets, side='right'), [len(costs)]]))
+    columns = []
+    for (start, end) in zip(edges[:-1], edges[1:]):
+        cost = np.sum(costs[start:end])
+        if cost > 0:
+            columns.append((int(start), int(end), cost))
+
+    return columns
+
+def get_pool(workers, executor='process', queue_path=None):
+    """
+    Get the pool the times and blocks run on.
+    Threads share the surface and the rotation cache, the kernels spend their time in NumPy with the GIL released.
+    The queue runs them as tasks of a work queue directory, on the local workers and any started on other nodes,
+    without a directory it is a temporary one only the local workers know of.
+    The processes are given the precision policy, however they are started.
+    """
+    if executor == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    if executor == 'queue':
+        import solar_queue as sw
+        if queue_path is None:
+            queue_path = tempfile.mkdtemp(prefix='solar_queue_')
+            return sw.QueueExecutor(queue_path, workers, temporary=True)
+        return sw.QueueExecutor(queue_path, workers)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=su.set_precision,
+                                                  initargs=(su.get_precision(),))
+
+def get_block_count(tasks, workers, blocks=0):
+    """Get the number of column blocks per time, by default enough for two tasks per worker."""
+    if blocks > 0:
+        return blocks
+    return max(1, int(math.ceil(2.0 * workers / max(tasks, 1))))
+
+def process_time_pair(times, local_date, time_zone, lat, lon, surface, no_data, pixel_size=1.0, far_fields=(None, None)):
+    """
+    Process two times with opposite sun azimuths from a single rotation and scan.
+    The second time is served by the backward angles, looking away from the first sun.
+    """
+    logging.info('Process time pair %d and %d' % (times[0], times[1]))
+
+    # Rotate the DEM to make the first sun be at the bottom.
+    (sun_azimuth, _) = get_sun_position(times[0], local_date, time_zone, lat, lon)
+    (rotation_angle, pixel_size) = get_pixel_rotation(sun_azimuth, pixel_size)
+    rotated_surface = sr.rotate_image(surface, rotation_angle)
+
+    # Work out the max angle in both directions.
+    angles = process_angles_pair(rotated_surface, no_data, pixel_size)
+
+    results = []
+    for indx in range(2):
+        (sun_azimuth, sun_altitude) = get_sun_position(times[indx], local_date, time_zone, lat, lon)
+        logging.info('Time %d sun azimuth: %.5f altitude: %.5f', times[indx], sun_azimuth, sun_altitude)
+        rotated_delta = rotate_delta(angles[indx], sun_altitude, rotation_angle, surface, no_data, far_fields[indx])
+        results.append([times[indx], rotated_delta.copy()])
+
+    return results
+
+def pair_times(times, azimuths, tolerance):
+    """Pair the times whose sun azimuths are opposite within a tolerance in degrees."""
+    tasks = []
+    paired = set()
+    for indx in range(len(times)):
+        if indx in paired:
+            continue
+        paired.add(indx)
+        task = [times[indx]]
+
+        # Find the most opposite time not yet paired.
+        best = None
+        for other in range(indx + 1, len(times)):
+            if other in paired:
+                continue
+            difference = abs((azimuths[other] - azimuths[indx]) % 360.0 - 180.0)
+            if difference <= tolerance and (best is None or difference < best[0]):
+                best = (difference, other)
+
+        if best is not None:
+            logging.info('Pairing times %d and %d (%.3f degrees)' % (times[indx], times[best[1]], best[0]))
+            paired.add(best[1])
+            task.append(times[best[1]])
+        tasks.append(task)
+
+    return tasks
+
+def write_shadow_cube(name, deltas, surface, pad_rows, pad_cols, no_data):
+    """Write the bit packed in shadow mask of every time, clipped to the surface."""
+    surface = sr.clip_padded_image(surface, pad_rows, pad_cols, no_data)
+    valid = surface != no_data
+    cube = ss.ShadowCube()
+    cube.create_cube(name, [tmp[0] for tmp in deltas], valid)
+    for tmp in deltas:
+        delta = sr.clip_padded_image(tmp[1], pad_rows, pad_cols, no_data)
+        cube.put_shadow(tmp[0], valid & (delta != no_data) & (delta < 0))
+
+    return cube
+
+def get_far_fields(horizon, surface, times, local_date, time_zone, lat, lon, no_data):
+    """Get the far field horizon of every time."""
+    logging.info('Computing the far field horizon...')
+    valid = surface[surface != no_data]
+    far_fields = {}
+    for time in times:
+        (sun_azimuth, _) = get_sun_position(time, local_date, time_zone, lat, lon)
+        far_fields[time] = horizon.get_far_field(sun_azimuth, np.amin(valid), np.amax(valid))
+
+    return far_fields
+
+def get_panel_name(panel):
+    """Get the name of the product of a panel tilt and azimuth."""
+    return 'panel_%g_%g' % tuple(panel)
+
+def put_delta(tmp, accumulators=()):
+    """Queue the delta of a time for the fold, adding its energy to the irradiance accumulators as it arrives."""
+    for accumulator in accumulators:
+        accumulator.add_time(tmp[0], tmp[1])
+    q.put(tmp)
+
+def process_times(times, local_date, time_zone, lat, lon, surface, no_data, gsd, workers, far_fields=None,
+                  bounded=False, pair_tolerance=0.0, blocks=0, executor='process', queue_path=None):
+    """
+    Process the times on a pool, yielding the delta of each time as it completes.
+    Times whose sun azimuths are opposite within the pair tolerance share a scan, and the times are split into
+    column blocks (by default when there are fewer times than two per worker).
+    """
+    if far_fields is None:
+        far_fields = {}
+
+    # Pair the times with opposite sun azimuths, the bounded search is one way only.
+    tasks = [[time] for time in times]
+    assembled = {}
+    if pair_tolerance > 0 and not bounded:
+        azimuths = [get_sun_position(time, local_date, time_zone, lat, lon)[0] for time in times]
+        tasks = pair_times(times, azimuths, pair_tolerance)
+
+    # Split the times into column blocks so every worker has something to do.
+    max_elevation = None
+    if bounded:
+        max_elevation = np.amax(surface[surface != no_data])
+    block_count = get_block_count(len(tasks), workers, blocks)
+    jobs = []
+    for task in tasks:
+        (sun_azimuth, sun_altitude) = get_sun_position(task[0], local_date, time_zone, lat, lon)
+        (rotation_angle, step) = get_pixel_rotation(sun_azimuth, gsd)
+        costs = get_column_costs(surface, no_data, rotation_angle, sun_altitude, step, max_elevation)
+        columns = []
+        if len(task) == 1 and block_count > 1:
+            columns = split_columns(costs, block_count)
+        if len(columns) > 1:
+            for (start, end, cost) in columns:
+                jobs.append((cost, task, (start, end)))
+            assembled[task[0]] = [su.create_image(surface.shape, no_data, su.get_dtype('angle')), len(columns)]
+        else:
+            jobs.append((np.sum(costs), task, None))
+
+    # The most costly jobs go first, so the pool finishes together.
+    jobs.sort(key=lambda job: -job[0])
+    pool = get_pool(workers, executor, queue_path)
+
+    # The kind of job of each future, a block, a pair of times or a time.
+    futures = {}
+    for (_, task, columns) in jobs:
+        if columns is not None:
+            futures[pool.submit(process_time_block, task[0], local_date, time_zone, lat, lon, surface, no_data,
+                                gsd, columns, bounded)] = 'block'
+        elif len(task) == 2:
+            futures[pool.submit(process_time_pair, task, local_date, time_zone, lat, lon, surface, no_data, gsd,
+                                (far_fields.get(task[0]), far_fields.get(task[1])))] = 'pair'
+        else:
+            futures[pool.submit(process_time, task[0], local_date, time_zone, lat, lon, surface, no_data, gsd,
+                                None, far_fields.get(task[0]), bounded)] = 'time'
+
+    for x in concurrent.futures.as_completed(futures):
+        results = x.result()
+        kind = futures[x]
+        if kind == 'block':
+            # Place the block, the time is done with its last block.
+            (time, start, angles) = results
+            assembled[time][0][:, start:start + angles.shape[1]] = angles
+            assembled[time][1] -= 1
+            if assembled[time][1] > 0:
+                continue
+            (sun_azimuth, sun_altitude) = get_sun_position(time, local_date, time_zone, lat, lon)
+            (rotation_angle, _) = get_pixel_rotation(sun_azimuth, gsd)
+            results = [time, rotate_delta(assembled.pop(time)[0], sun_altitude, rotation_angle, surface, no_data,
+                                          far_fields.get(time))]
+        if kind != 'pair':
+            results = [results]
+        for tmp in results:
+            yield tmp
+    pool.shutdown()
+
+def process_surface(surface, metadata, local_date, sunrise_time, sunset_time, radiation, tiff, cmap, workers, checkpoint=False,
+                    progressive=0, horizon=None, bounded=False, pair_tolerance=0.0, shadow_cube=False, zones=None,
+                    cache=None, blocks=0, executor='process', render='figure', tiles=None, tms=False,
+                    aggregate=None, queue_path=None, sky_view=None, irradiance=False, panels=None):
+    """
+    Process the surface data, optionally with the statistics of the zones of a GeoJSON file.
+    Given a stage cache the deltas and the sunrise and sunset are reused when their inputs are unchanged.
+    Each time can be split into column blocks (by default when there are fewer times than two per worker),
+    run on a pool of processes or threads, or as the tasks of a work queue directory (queue_path) shared with
+    workers on other nodes.
+    The percentage of light is colored as a figure or through the color lookup table (render lut), optionally
+    with a web tile pyramid of the min and max zoom of tiles.
+    Given a daily aggregate the products of the day are folded into it instead of written.
+    Given the sky view factor the radiation includes the diffuse radiation.
+    With irradiance the energy on the sloped surface of each time step is added up as the step completes,
+    given panels (tilt, azimuth) the plane of array energy of every panel in the same pass.
+    """
+    from tqdm import tqdm
+
     logging.info('Processing surface...')
 
     # Some metadata.
@@ -416,6 +1038,7 @@ def process_surface(surface, metadata, local_date, sunrise_time, sunset_time, ra
     width = metadata[3]
     lat = metadata[4]
     lon = metadata[5]
+    gsd = metadata[6]
     no_data = metadata[7]
     profile = metadata[8]
     affine = metadata[9]
@@ -427,66 +1050,126 @@ def process_surface(surface, metadata, local_date, sunrise_time, sunset_time, ra
     # Get the time array.
     times = su.get_processing_times(sunrise_time, sunset_time, increments)
 
+    # The base name of the outputs.
+    (_, tail) = os.path.split(surface_filename)
+    (base, _) = os.path.splitext(tail)
+    base += '_' + local_date.isoformat()
+
+    # The far field horizon from the regional surface.
+    far_fields = {}
+    if horizon is not None:
+        far_fields = get_far_fields(horizon, surface, times, local_date, time_zone, lat, lon, no_data)
+
+    # The energy of the time steps on the sloped surface, summed as they complete.
+    solar_irradiance = None
+    panel_irradiance = None
+    if irradiance or panels:
+        import solar_irradiance as si
+        if irradiance:
+            solar_irradiance = si.SolarIrradiance()
+            solar_irradiance.open_irradiance(surface, no_data, gsd, times, local_date, time_zone, lat, lon)
+        if panels:
+            panel_irradiance = si.SolarIrradiance()
+            panel_irradiance.open_irradiance(surface, no_data, gsd, times, local_date, time_zone, lat, lon, panels)
+    accumulators = [accumulator for accumulator in [solar_irradiance, panel_irradiance] if accumulator is not None]
+
+    # The deltas are keyed by their inputs and every option that changes them, the sunrise and sunset by
+    # the deltas. The progressive levels upsample coarse deltas away from the shadow boundaries and are not kept.
+    pairing = pair_tolerance if pair_tolerance > 0 and not bounded else 0.0
+    deltas_inputs = ['deltas', surface, no_data, times, local_date.isoformat(), time_zone, lat, lon, gsd, bounded,
+                     pairing, su.get_precision(), [far_fields.get(time) for time in times]]
+    deltas_key = None
+    folded = None
+    deltas_cached = False
+    if cache is not None and progressive == 0:
+        deltas_key = cache.get_key(*deltas_inputs)
+        folded = cache.get(cache.get_key('fold', deltas_key))
+        if folded is None or shadow_cube or accumulators:
+            stored = cache.get(deltas_key)
+            if stored is not None:
+                for indx, time in enumerate(times):
+                    put_delta([time, stored['deltas'][indx]], accumulators)
+                deltas_cached = True
+
+    # Resume from the checkpoint, only the missing times are processed.
+    solar_checkpoint = None
+    pending = times
+    if deltas_cached or folded is not None and not shadow_cube and not accumulators:
+        # Nothing to process, the stages are in the cache.
+        pending = []
+    elif progressive > 0:
+        # The progressive levels replace the single full resolution pass.
+        for tmp in process_progressive(surface, metadata, times, local_date, sunrise_time, sunset_time, tiff, cmap,
+                                       workers, progressive, base, far_fields, bounded, executor, queue_path):
+            put_delta(tmp, accumulators)
+        pending = []
+    elif checkpoint:
+        # A checkpoint of other inputs, e.g. a changed surface or -x, is started again.
+        solar_checkpoint = sc.SolarCheckpoint()
+        if solar_checkpoint.open_checkpoint(output_path, base, times, surface.shape, su.get_dtype('angle'),
+                                            sk.StageCache().get_key(*deltas_inputs)):
+            for time in solar_checkpoint.completed_times():
+                put_delta([time, solar_checkpoint.get_delta(time)], accumulators)
+            pending = [time for time in times if not solar_checkpoint.is_completed(time)]
+
     # For every time.
     with tqdm(total=len(times), desc="Processing time") as bar1:
-        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
-        futures = []
-        for time in times:
-            futures.append(pool.submit(process_time, time, local_date, time_zone, lat, lon, surface, no_data))
- 
-        for x in concurrent.futures.as_completed(futures):
-            q.put(x.result())
+        bar1.update(len(times) - len(pending))
+        for tmp in process_times(pending, local_date, time_zone, lat, lon, surface, no_data, gsd, workers, far_fields,
+                                 bounded, pair_tolerance, blocks, executor, queue_path):
+            if solar_checkpoint is not None:
+                solar_checkpoint.put_delta(tmp[0], tmp[1])
+            put_delta(tmp, accumulators)
             bar1.update(1)
 
-    first = True
-    previous_delta = None
-    previous_time = None
-    sunrise = None
-    sunset = None
+    # Fold the deltas in time order.
+    deltas = []
     while not q.empty():
-        tmp = q.get()
+        deltas.append(q.get())
+    if folded is not None:
+        (sunrise, sunset) = (folded['sunrise'], folded['sunset'])
+    else:
+        (sunrise, sunset) = fold_deltas(deltas, no_data)
 
-        if not first:
-            logging.info('Processing times! %d to %d' % (previous_time, tmp[0]))
-            sunrise = compute_sunrise(previous_delta, tmp[1], previous_time, tmp[0], no_data, sunrise, sunset)
-            sunset = compute_sunset(previous_delta, tmp[1], previous_time, tmp[0], no_data, sunset)
-        else:
-            logging.info('Reference ' + str(tmp[0]))
-            sunset = su.create_image(tmp[1].shape, no_data)
-            sunrise = su.create_image(tmp[1].shape, no_data)
+    # Keep the stages for the next run.
+    if deltas_key is not None:
+        if len(deltas) > 0 and not deltas_cached:
+            cache.put(deltas_key, deltas=np.stack([tmp[1] for tmp in deltas]))
+        if folded is None:
+            cache.put(cache.get_key('fold', deltas_key), sunrise=sunrise, sunset=sunset)
 
-        # Copy the delta to the previous.
-        first = False
-        previous_delta = tmp[1].copy()
-        previous_time = tmp[0]
-        bar1.update(1)
+    # Keep the shadow of every time for interval queries.
+    if shadow_cube:
+        write_shadow_cube(os.path.join(output_path, base + '_shadow'), deltas, surface, pad_rows, pad_cols, no_data)
 
-    with tqdm(total=7, desc="Creating output") as bar:
+    with tqdm(total=6, desc="Creating output") as bar:
         logging.info('Creating the output...')
 
-        # Fill the voids and clip the padding.
-        end_time = len(times) - 1
-        sunrise = fill_sun_void(pad_rows, pad_cols, height, width, no_data, times[0], sunrise)
-        sunrise = sr.clip_padded_image(sunrise, pad_rows, pad_cols, no_data)
-        sunset = fill_sun_void(pad_rows, pad_cols, height, width, no_data, times[end_time], sunset)
-        sunset = sr.clip_padded_image(sunset, pad_rows, pad_cols, no_data)
-        surface = sr.clip_padded_image(surface, pad_rows, pad_cols, no_data)
+        # Get the light products clipped to the surface.
+        (sunrise, sunset, light_in_seconds, percentage_light) = get_light_products(sunrise, sunset, surface, times,
+                                                                                   pad_rows, pad_cols, height, width,
+                                                                                   no_data)
         bar.update(1)
 
-        # Get the light in seconds per point.
-        light_in_seconds = compute_light_in_seconds(sunrise, sunset, no_data)
-        bar.update(1)
-        
-        # Clean the data up, i.e. no surface point no output.
-        sunset = clean_given_surface(surface, sunset, no_data)
-        sunrise = clean_given_surface(surface, sunrise, no_data)
-        light_in_seconds = clean_given_surface(surface, light_in_seconds, no_data)
-        bar.update(1)
+        # Fold the day into the aggregate, nothing of the day is written.
+        if aggregate is not None:
+            radiation_data = None
+            if radiation:
+                (success, radiation_data) = get_radiation_product(sunrise, sunset, sunrise_time, sunset_time,
+                                                                  local_date, time_zone, lat, lon, no_data, sky_view)
+            irradiance_data = None
+            if solar_irradiance is not None:
+                irradiance_data = solar_irradiance.get_irradiance(pad_rows, pad_cols, sky_view)
+            panel_data = None
+            if panel_irradiance is not None:
+                panel_data = panel_irradiance.get_irradiance(pad_rows, pad_cols, sky_view)
+            aggregate.add_day(light_in_seconds, percentage_light, radiation_data, irradiance_data, panel_data)
+            if solar_checkpoint is not None:
+                solar_checkpoint.remove()
+            bar.update(5)
+            return light_in_seconds
 
         # Write the outputs.
-        (_, tail) = os.path.split(surface_filename)
-        (base, _) = os.path.splitext(tail)
-        base += '_' + local_date.isoformat()
         if tiff:
             name = os.path.join(output_path, base + '_sunset.tif')
             logging.info('Saving sunset data (%s)' % (name))
@@ -499,29 +1182,72 @@ def process_surface(surface, metadata, local_date, sunrise_time, sunset_time, ra
             sr.write_output(name, light_in_seconds, profile)
         bar.update(1)
 
-        # Get the percentage of light.
-        seconds_of_light = times[end_time] - times[0]
-        percentage_light = get_percentage_light(light_in_seconds, no_data, seconds_of_light)
         if tiff:
             name = os.path.join(output_path, base + '_light_perc.tif')
             logging.info('Saving percentage light data (%s)' % (name))
-            sr.write_output(name, percentage_light, profile, dn_type=np.int16)
+            sr.write_output(name, percentage_light, dict(profile, nodata=su.get_no_data('percentage', no_data)))
         bar.update(1)
 
-        # Colored image.
-        get_colormap(output_path, base, local_date.isoformat(), sunrise_time, sunset_time, percentage_light, affine, cmap)
+        # Colored image, a figure or straight through the color lookup table, and the web tiles.
+        valid = light_in_seconds != no_data
+        if render == 'lut':
+            st.write_color_image(output_path, base, percentage_light, valid, affine, profile, cmap)
+        else:
+            get_colormap(output_path, base, local_date.isoformat(), sunrise_time, sunset_time, percentage_light, affine,
+                         cmap)
+        if tiles is not None:
+            st.write_tiles(os.path.join(output_path, base + '_tiles'), percentage_light, valid, affine, profile['crs'],
+                           cmap, tiles[0], tiles[1], workers, tms)
         bar.update(1)
 
         # Radiation.
         if radiation:
-            (success, radiation_data) = get_radiation_product(sunrise, sunset,     sunrise_time, sunset_time, local_date, time_zone, lat, lon, no_data)
+            (success, radiation_data) = get_radiation_product(sunrise, sunset,     sunrise_time, sunset_time, local_date, time_zone, lat, lon, no_data, sky_view)
             if success:
                 name = os.path.join(output_path, base + '_radiation.tif')
                 logging.info('Saving radiation data (%s)' % (name))
                 sr.write_output(name, radiation_data, profile)
+
+        # Irradiance on the sloped surface of the time steps.
+        irradiance_data = None
+        if solar_irradiance is not None:
+            irradiance_data = solar_irradiance.get_irradiance(pad_rows, pad_cols, sky_view)
+            name = os.path.join(output_path, base + '_irradiance.tif')
+            logging.info('Saving irradiance data (%s)' % (name))
+            sr.write_output(name, irradiance_data, profile)
+
+        # Plane of array irradiance of the panels, a band each.
+        panel_data = None
+        if panel_irradiance is not None:
+            panel_data = panel_irradiance.get_irradiance(pad_rows, pad_cols, sky_view)
+            name = os.path.join(output_path, base + '_panels.tif')
+            logging.info('Saving panel data (%s)' % (name))
+            sr.write_bands(name, panel_data, profile)
                 
         bar.update(1)
 
+        # Statistics of the zones straight from the products.
+        if zones is not None:
+            (ids, labels) = sz.get_zone_labels(zones, light_in_seconds.shape, affine)
+            # The percentage has no no data value, it follows the light in seconds.
+            light_perc = np.where(light_in_seconds != no_data, percentage_light, no_data)
+            products = [('light_secs', sz.zonal_statistics(labels, light_in_seconds, len(ids), no_data)),
+                        ('light_perc', sz.zonal_statistics(labels, light_perc, len(ids), no_data))]
+            if radiation and success:
+                products.append(('radiation', sz.zonal_statistics(labels, radiation_data, len(ids), no_data)))
+            if irradiance_data is not None:
+                products.append(('irradiance', sz.zonal_statistics(labels, irradiance_data, len(ids), no_data)))
+            if panel_data is not None:
+                for (indx, panel) in enumerate(panels):
+                    products.append((get_panel_name(panel), sz.zonal_statistics(labels, panel_data[indx], len(ids),
+                                                                                 no_data)))
+            sz.write_zonal_statistics(os.path.join(output_path, base + '_zonal.csv'), ids, products)
+        bar.update(1)
+
+        # The outputs are written, the checkpoint is no longer needed.
+        if solar_checkpoint is not None:
+            solar_checkpoint.remove()
+
         logging.info('The end...')
 
     return light_in_seconds
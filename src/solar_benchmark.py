@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the process and thread executors."""
+
+import argparse
+from datetime import date
+import logging
+import numpy as np
+import os
+import time
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_rasterio as sr
+import solar_utility as su
+
+logging.basicConfig(filename='solar_benchmark.log',
+                    format ='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                    datefmt = "%Y-%m-%d %H:%M:%S", filemode='w', level=logging.INFO)
+
+def arg_parse():
+    """Parse the arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark the solar executors.")
+    parser.add_argument('-s', '--surface', type=str, required=True)
+    parser.add_argument('-o', '--output_path', type=str, required=True)
+    parser.add_argument('-i', '--increments', type=int, default=1)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    logging.info(args)
+    return args
+
+def get_scaled_surface(surface, metadata, scale):
+    """Tile the surface scale by scale times, padded for rotation with its metadata."""
+    no_data = metadata[7]
+    hgt = sr.clip_padded_image(surface, metadata[0], metadata[1], no_data)
+    hgt = np.tile(hgt, (scale, scale))
+    (height, width) = hgt.shape
+    (pad_rows, pad_cols) = sa.get_padding(height, width)
+    scaled_metadata = [pad_rows, pad_cols, height, width] + list(metadata[4:])
+    return sr.padded_image(hgt, pad_rows, pad_cols, no_data), scaled_metadata
+
+def run_benchmark(surface_file, output_path, scales, worker_counts, increments=1, local_date=date(2017, 6, 21),
+                  time_zone='US/Pacific'):
+    """
+    Time the times of the surface at each scale on each executor and worker count, returning the rows of the
+    table. Only the times are timed, as solar_estimate.calibrate times process_time, not the fold or the outputs.
+    """
+    (success, surface, metadata) = sa.load_surface(surface_file)
+    if not success:
+        return []
+    (sunrise, sunset) = su.get_sun_rise_set(local_date.year, local_date.month, local_date.day, time_zone,
+                                            metadata[4], metadata[5])
+    times = su.get_processing_times(sunrise, sunset, increments)
+    (lat, lon, gsd, no_data) = metadata[4:8]
+
+    rows = []
+    for scale in scales:
+        (scaled, scaled_metadata) = get_scaled_surface(surface, metadata, scale)
+        for workers in worker_counts:
+            for executor in sa.EXECUTORS:
+                # The rotation is computed in every run rather than cached from the last.
+                sr.rotation_cache.clear()
+                start = time.time()
+                list(sa.process_times(times, local_date, time_zone, lat, lon, scaled, no_data, gsd, workers,
+                                      executor=executor))
+                seconds = time.time() - start
+                su.log('info', 'Scale %d (%d points) %s workers %d: %.2f seconds' %
+                       (scale, scaled_metadata[2] * scaled_metadata[3], executor, workers, seconds), stdout=True)
+                rows.append([scale, scaled_metadata[2] * scaled_metadata[3], executor, workers, seconds])
+
+    return rows
+
+def write_benchmark(name, rows):
+    """Write the table and the faster executor of each size and worker count."""
+    with open(name, 'w') as benchmark_file:
+        benchmark_file.write('scale,points,executor,workers,seconds\n')
+        for row in rows:
+            benchmark_file.write('%d,%d,%s,%d,%.3f\n' % tuple(row))
+
+    # The crossover is where the faster executor changes.
+    timings = {}
+    for (scale, points, executor, workers, seconds) in rows:
+        timings.setdefault((points, workers), {})[executor] = seconds
+    for (points, workers) in sorted(timings):
+        fastest = min(timings[(points, workers)], key=timings[(points, workers)].get)
+        su.log('info', '%d points with %d workers: %s is faster' % (points, workers, fastest), stdout=True)
+
+def main():
+    """Main function."""
+    args = arg_parse()
+    rows = run_benchmark(args.surface, args.output_path, args.scales, args.workers, args.increments)
+    write_benchmark(os.path.join(args.output_path, 'benchmark.csv'), rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Stage cache code."""
+
+import hashlib
+import logging
+import numpy as np
+import os
+import shutil
+
+# Default size bound of the cache in MB.
+CACHE_SIZE = 2048
+
+class StageCache:
+    """
+    Stage cache class, the results of each stage are stored under a hash of its inputs.
+    Least recently used entries are evicted past the size bound.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.max_bytes = None
+
+    def open_cache(self, path, max_size=CACHE_SIZE):
+        """Open or create the cache directory, the size bound is in MB."""
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_bytes = int(max_size * 1024 * 1024)
+        logging.info('Stage cache (%s) of %d MB' % (path, max_size))
+
+    def get_key(self, *parts):
+        """Get the key of the inputs, arrays by their dtype, shape and bytes."""
+        digest = hashlib.sha256()
+        self.update_digest(digest, parts)
+        return digest.hexdigest()
+
+    def update_digest(self, digest, part):
+        """Add an input to the digest."""
+        if isinstance(part, np.ndarray):
+            digest.update(str((part.dtype.str, part.shape)).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (list, tuple)):
+            digest.update(('%s%d' % (type(part).__name__, len(part))).encode())
+            for item in part:
+                self.update_digest(digest, item)
+        else:
+            # Length prefixed, so (1, 10) and (11, 0) differ.
+            text = repr(part)
+            digest.update(('%d:%s' % (len(text), text)).encode())
+
+    def get_file_key(self, file_name, *parts):
+        """Get the key of a file's bytes and some other inputs."""
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as src:
+            for chunk in iter(lambda: src.read(1 << 20), b''):
+                digest.update(chunk)
+        return self.get_key(digest.hexdigest(), *parts)
+
+    def get(self, key):
+        """Get the arrays of a key, None on a miss."""
+        name = os.path.join(self.path, key + '.npz')
+        if not os.path.exists(name):
+            logging.info('Stage cache miss (%s)' % (key))
+            return None
+        logging.info('Stage cache hit (%s)' % (key))
+        os.utime(name)
+        with np.load(name) as stored:
+            return {item: stored[item] for item in stored.files}
+
+    def put(self, key, **arrays):
+        """Store the arrays of a key."""
+        name = os.path.join(self.path, key + '.npz')
+        temp_name = os.path.join(self.path, key + '.tmp.npz')
+        np.savez(temp_name, **arrays)
+        os.replace(temp_name, name)
+        self.evict()
+
+    def get_file(self, key, extension):
+        """Get the cached file of a key, None on a miss."""
+        name = os.path.join(self.path, key + extension)
+        if not os.path.exists(name):
+            logging.info('Stage cache miss (%s)' % (key))
+            return None
+        logging.info('Stage cache hit (%s)' % (key))
+        os.utime(name)
+        return name
+
+    def put_file(self, key, file_name):
+        """Store a copy of a file under a key, returns the cached name."""
+        (_, extension) = os.path.splitext(file_name)
+        name = os.path.join(self.path, key + extension)
+        temp_name = name + '.tmp'
+        shutil.copyfile(file_name, temp_name)
+        os.replace(temp_name, name)
+        self.evict()
+        return name
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is inside the size bound."""
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and '.tmp' not in entry.name:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for (_, size, _) in entries)
+        for (_, size, name) in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            logging.info('Stage cache evicting (%s)' % (name))
+            os.remove(name)
+            total -= size
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Checkpoint code."""
+
+import json
+import logging
+import numpy as np
+import os
+
+class SolarCheckpoint:
+    """Solar checkpoint class, a memory mapped cube of deltas and a manifest."""
+
+    def __init__(self):
+        self.cube = None
+        self.manifest = None
+        self.cube_name = None
+        self.manifest_name = None
+
+    def open_checkpoint(self, output_path, base, times, shape, dtype=np.float64, key=None):
+        """
+        Open an existing checkpoint or create a new one, returns True on a resume.
+        The key identifies the inputs of the deltas, e.g. the surface and the options changing them.
+        """
+        self.cube_name = os.path.join(output_path, base + '_checkpoint.npy')
+        self.manifest_name = os.path.join(output_path, base + '_checkpoint.json')
+
+        # The manifest describes the run, only a matching run can resume.
+        manifest = {'times': [float(time) for time in times],
+                    'shape': [int(size) for size in shape],
+                    'dtype': np.dtype(dtype).str,
+                    'key': key,
+                    'completed': []}
+
+        resume = False
+        if os.path.exists(self.manifest_name) and os.path.exists(self.cube_name):
+            try:
+                with open(self.manifest_name, 'r') as manifest_file:
+                    previous = json.load(manifest_file)
+                if all(previous.get(name) == manifest[name] for name in ['times', 'shape', 'dtype', 'key']):
+                    manifest = previous
+                    resume = True
+                else:
+                    logging.info('Checkpoint (%s) is for a different run, starting again' % (self.manifest_name))
+            except (OSError, ValueError, KeyError):
+                logging.error('Could not read the checkpoint manifest (%s)' % (self.manifest_name))
+
+        self.manifest = manifest
+        if resume:
+            logging.info('Resuming from checkpoint (%s) with %d completed times' % (self.cube_name, len(manifest['completed'])))
+            self.cube = np.load(self.cube_name, mmap_mode='r+')
+        else:
+            logging.info('Creating checkpoint (%s)' % (self.cube_name))
+            cube_shape = (len(times),) + tuple(shape)
+            self.cube = np.lib.format.open_memmap(self.cube_name, mode='w+', dtype=dtype, shape=cube_shape)
+            self.write_manifest()
+
+        return resume
+
+    def completed_times(self):
+        """Get the times already in the checkpoint."""
+        return list(self.manifest['completed'])
+
+    def is_completed(self, time):
+        """Is the time already in the checkpoint."""
+        return float(time) in self.manifest['completed']
+
+    def get_delta(self, time):
+        """Get the delta for a completed time."""
+        indx = self.manifest['times'].index(float(time))
+        return np.array(self.cube[indx])
+
+    def put_delta(self, time, delta):
+        """Store the delta for a time, the data is flushed before the manifest."""
+        indx = self.manifest['times'].index(float(time))
+        self.cube[indx] = delta
+        self.cube.flush()
+        if not self.is_completed(time):
+            self.manifest['completed'].append(float(time))
+        self.write_manifest()
+
+    def write_manifest(self):
+        """Write the manifest, replacing the old one in a single step."""
+        temp_name = self.manifest_name + '.tmp'
+        with open(temp_name, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(temp_name, self.manifest_name)
+
+    def remove(self):
+        """Remove the checkpoint files."""
+        self.cube = None
+        for name in [self.cube_name, self.manifest_name]:
+            if name is not None and os.path.exists(name):
+                logging.info('Deleting (%s)' % (name))
+                os.remove(name)
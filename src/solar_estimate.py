@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""Runtime and memory estimate of a run from the surface metadata, with the micro-benchmark calibrating it."""
+
+import argparse
+from datetime import date
+import json
+import logging
+import math
+import numpy as np
+import os
+import rasterio
+import time
+import tracemalloc
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_geospatial as sg
+import solar_rasterio as sr
+import solar_remote as sm
+import solar_utility as su
+
+# The cost model the micro-benchmark measured on one core at compact precision, recalibrate a machine with
+# python3 ./src/solar_estimate.py -o cost_model.json. A time step costs the seconds of its padded side squared
+# and cubed (every point searches its column) and the bytes of a padded point, folding and the outputs cost
+# per padded and surface point.
+DEFAULT_COST_MODEL = {'time_seconds': [1.9e-07, 2.0e-09], 'time_bytes': 55.0, 'fold_seconds': 1.5e-06,
+                      'fold_bytes': 24.0, 'output_seconds': 6.7e-06, 'output_bytes': 20.0}
+
+# The sides of the surfaces the micro-benchmark times.
+CALIBRATION_SIDES = [64, 128, 256]
+
+def load_cost_model(file_name=None):
+    """Load a calibrated cost model, the bundled one without."""
+    cost_model = dict(DEFAULT_COST_MODEL)
+    if file_name is not None:
+        try:
+            with open(file_name, 'r') as cost_file:
+                cost_model.update(json.load(cost_file))
+        except (IOError, ValueError):
+            logging.error('Could not read the cost model (%s), using the bundled one.' % (file_name))
+    return cost_model
+
+def get_calibration_surface(side, no_data=-9999):
+    """Get a padded surface of random relief."""
+    rng = np.random.default_rng(side)
+    hgt = (100.0 + rng.uniform(0.0, 10.0, (side, side))).astype(su.get_dtype('elevation'))
+    (pad_rows, pad_cols) = sa.get_padding(side, side)
+    return sr.padded_image(hgt, pad_rows, pad_cols, no_data), pad_rows, pad_cols
+
+def measure(function, *args, trace=False):
+    """
+    Run a function, returning its result, seconds and the peak of the bytes it allocated when traced.
+    Tracing slows the allocations down, the seconds of a traced run are not kept.
+    """
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace:
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak
+
+def calibrate(sides=CALIBRATION_SIDES, local_date=date(2017, 6, 21), time_zone='US/Pacific', lat=47.6, lon=-122.3):
+    """
+    Time a time step, the fold and the outputs over the sides, fitting the cost model.
+    The bytes per point are traced on the smallest side.
+    """
+    no_data = -9999
+    times = [30000, 45000, 60000]
+    lengths = []
+    steps = []
+    cost_model = {}
+    for side in sides:
+        (surface, pad_rows, pad_cols) = get_calibration_surface(side, no_data)
+        points = surface.size
+        trace = side == sides[0]
+
+        # A time step, with the rotation computed rather than cached.
+        deltas = []
+        for time_secs in times:
+            sr.rotation_cache.clear()
+            (delta, seconds, _) = measure(sa.process_time, time_secs, local_date, time_zone, lat, lon, surface,
+                                          no_data)
+            deltas.append(delta)
+            lengths.append(surface.shape[0])
+            steps.append(seconds)
+            if trace:
+                sr.rotation_cache.clear()
+                (_, _, peak) = measure(sa.process_time, time_secs, local_date, time_zone, lat, lon, surface, no_data,
+                                       trace=True)
+                cost_model['time_bytes'] = max(cost_model.get('time_bytes', 0.0), peak / float(points))
+
+        # The per point costs of the largest side are the least swamped by the fixed costs.
+        ((sunrise, sunset), seconds, _) = measure(sa.fold_deltas, deltas, no_data)
+        cost_model['fold_seconds'] = seconds / float(points * len(times))
+        (_, seconds, _) = measure(sa.get_light_products, sunrise, sunset, surface, times, pad_rows, pad_cols, side,
+                                  side, no_data)
+        cost_model['output_seconds'] = seconds / float(side * side)
+        if trace:
+            (_, _, peak) = measure(sa.fold_deltas, deltas, no_data, trace=True)
+            cost_model['fold_bytes'] = peak / float(points)
+            (_, _, peak) = measure(sa.get_light_products, sunrise, sunset, surface, times, pad_rows, pad_cols, side,
+                                   side, no_data, trace=True)
+            cost_model['output_bytes'] = peak / float(side * side)
+
+    # Seconds of a time step by least squares on the padded side squared and cubed.
+    sizes = np.array(lengths, dtype=np.float64)
+    (coefficients, _, _, _) = np.linalg.lstsq(np.stack([sizes ** 2, sizes ** 3], axis=1), np.array(steps),
+                                              rcond=None)
+    cost_model['time_seconds'] = [float(max(value, 0.0)) for value in coefficients]
+    logging.info('Cost model %s' % (cost_model))
+
+    return cost_model
+
+def get_surface_size(surface_file, gsd, native=False, bounds=None):
+    """
+    Read only the metadata of the surface, getting its height and width once resampled to the GSD and
+    the latitude and longitude of its center, the same resample decision as sa.preprocess_surface. The size
+    of a reprojected surface is approximate.
+    """
+    logging.info('Reading the metadata of (%s)' % (surface_file))
+    with rasterio.Env(**sm.GDAL_OPTIONS):
+        dem = sr.SolarImage()
+        if not dem.open_image(sm.get_gdal_path(surface_file)):
+            logging.error('Could not open the DEM (%s).' % (surface_file))
+            return False, None
+        affine = dem.get_affine()
+        window = sm.get_bounds_window(affine, dem.shape(), bounds)
+        if window is None:
+            logging.error('The bounds %s are outside the surface (%s).' % (bounds, surface_file))
+            dem.close_image()
+            return False, None
+        epsg_code = dem.get_epsg_code()
+        native_gsd = dem.get_avg_gsd()
+        factor = dem.get_unit_factor()
+        dem.close_image()
+
+    ((row_start, row_stop), (col_start, col_stop)) = window
+    height = row_stop - row_start
+    width = col_stop - col_start
+    e = affine[2] + affine[0] * (col_start + col_stop) / 2.0
+    n = affine[5] + affine[4] * (row_start + row_stop) / 2.0
+    (lat, lon) = sg.get_lat_lon(epsg_code, e, n)
+
+    # Scale to the GSD the surface is resampled to, a surface that is not UTM is always warped to it (even a
+    # finer one) and its units may not be meters.
+    if sg.is_geographic_epsg(epsg_code):
+        if not native:
+            (pixel_width, pixel_height) = sg.get_metric_pixel_size(affine, lat)
+            height = int(math.ceil(height * pixel_height / gsd))
+            width = int(math.ceil(width * pixel_width / gsd))
+    elif not sg.is_valid_utm_epsg(epsg_code):
+        if factor is None:
+            logging.warning('The units of (%s) are not known, taking them as meters.' % (surface_file))
+            factor = 1.0
+        height = int(math.ceil(height * native_gsd * factor / gsd))
+        width = int(math.ceil(width * native_gsd * factor / gsd))
+    elif native_gsd < gsd:
+        height = int(math.ceil(height * native_gsd / gsd))
+        width = int(math.ceil(width * native_gsd / gsd))
+
+    return True, [height, width, lat, lon]
+
+def estimate_run(height, width, time_count, workers, executor='process', cost_model=None, irradiance=False,
+                 panel_count=0):
+    """
+    Estimate the peak memory in bytes and the seconds of each stage of a run of the surface size, returning
+    the rows of the stage, its peak and its seconds. The irradiance and the panels hold running sums.
+    """
+    if cost_model is None:
+        cost_model = DEFAULT_COST_MODEL
+    (pad_rows, pad_cols) = sa.get_padding(height, width)
+    padded_height = height + 2 * pad_rows
+    padded_width = width + 2 * pad_cols
+    padded = padded_height * padded_width
+    points = height * width
+    length = float(max(padded_height, padded_width))
+    elevation_bytes = np.dtype(su.get_dtype('elevation')).itemsize
+    angle_bytes = np.dtype(su.get_dtype('angle')).itemsize
+    index_bytes = 4 if padded < np.iinfo(np.int32).max else 8
+
+    # Loading reads the surface and pads it.
+    surface = padded * elevation_bytes
+    rows = [['load', points * elevation_bytes + surface, 0.0]]
+
+    # The deltas of every time are held until the fold. A worker builds a time step and keeps its rotations,
+    # a process has its own copy of the surface and of the rotation cache.
+    busy = min(workers, max(time_count, 1) * sa.get_block_count(time_count, workers))
+    rotations = min(sr.ROTATION_CACHE_BYTES, 2 * padded * index_bytes * int(math.ceil(time_count / float(workers))))
+    worker = cost_model['time_bytes'] * padded
+    if executor == 'thread':
+        workers_bytes = busy * worker + rotations
+    else:
+        workers_bytes = busy * (worker + surface + rotations)
+    deltas = time_count * padded * angle_bytes
+
+    # The normals and sum of the irradiance, and a sum per panel.
+    sums = (4 if irradiance else 0) + panel_count
+    surface += sums * padded * 8
+    step_seconds = cost_model['time_seconds'][0] * length ** 2 + cost_model['time_seconds'][1] * length ** 3
+    parallel = min(busy, os.cpu_count() or 1)
+    rows.append(['times', surface + deltas + workers_bytes, time_count * step_seconds / float(parallel)])
+
+    # The fold of the deltas and the outputs of the clipped surface.
+    rows.append(['fold', surface + deltas + cost_model['fold_bytes'] * padded,
+                 cost_model['fold_seconds'] * padded * time_count])
+    rows.append(['output', surface + cost_model['fold_bytes'] * padded + cost_model['output_bytes'] * points,
+                 cost_model['output_seconds'] * points])
+
+    return rows
+
+def get_peak(rows):
+    """Get the peak memory of the stages."""
+    return max(row[1] for row in rows)
+
+def get_tile_count(height, width, time_count, workers, memory_limit, executor='process', cost_model=None,
+                   irradiance=False, panel_count=0):
+    """Get the tiles per side the surface splits into so a tile fits the memory limit in bytes, None if none fits."""
+    for tiles in range(1, max(height, width) + 1):
+        rows = estimate_run(int(math.ceil(height / float(tiles))), int(math.ceil(width / float(tiles))), time_count,
+                            workers, executor, cost_model, irradiance, panel_count)
+        if get_peak(rows) <= memory_limit:
+            return tiles
+    return None
+
+def report_estimate(rows, days=1):
+    """Log and print the estimate of each stage, the time stages are for every day."""
+    for (stage, peak, seconds) in rows:
+        su.log('info', 'Stage %-6s peak %10.1f MB %10.1f seconds' % (stage, peak / 1048576.0,
+                                                                      seconds * (days if stage != 'load' else 1)),
+               stdout=True)
+    su.log('info', 'Peak %.1f MB, %.1f seconds' % (get_peak(rows) / 1048576.0,
+                                                   rows[0][2] + days * sum(row[2] for row in rows[1:])), stdout=True)
+
+def arg_parse():
+    """Parse the arguments."""
+    parser = argparse.ArgumentParser(description="Calibrate the solar cost model.")
+    parser.add_argument('-o', '--output', type=str, required=True)
+    parser.add_argument('--sides', type=int, nargs='+', default=CALIBRATION_SIDES)
+    args = parser.parse_args()
+    logging.info(args)
+    return args
+
+def main():
+    """Main function."""
+    logging.basicConfig(filename='solar_estimate.log',
+                        format ='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt = "%Y-%m-%d %H:%M:%S", filemode='w', level=logging.INFO)
+    args = arg_parse()
+    cost_model = calibrate(args.sides)
+    with open(args.output, 'w') as cost_file:
+        json.dump(cost_model, cost_file, indent=2)
+    print('Cost model: ', cost_model)
+
+if __name__ == '__main__':
+    main()
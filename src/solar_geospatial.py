@@ -2,12 +2,22 @@
 
 """Geospatial code."""
 
+import json
 import logging
-import osgeo.osr as osr
+import math
 import utm
 
+# Geographic latitude and longitude CRSs processed natively.
+GEOGRAPHIC_EPSGS = [4326, 4269]
+
+# WGS84 ellipsoid.
+SEMI_MAJOR_AXIS = 6378137.0
+ECCENTRICITY_SQUARED = 0.00669437999014
+
 def get_utm_epsg_from_epsg(epsg_code, ground_x, ground_y):
     """Get the UTM epsg code from a code and a point."""
+    import osgeo.osr as osr
+
     src = osr.SpatialReference()
     src.ImportFromEPSG(epsg_code)
     dst = osr.SpatialReference()
@@ -55,14 +65,33 @@ def get_utm_zone_and_hemisphere(epsg_code):
 
     return zone_number, northern
 
+def is_geographic_epsg(epsg_code):
+    """Is the epsg code a geographic latitude and longitude."""
+    return epsg_code in GEOGRAPHIC_EPSGS
+
+def get_metric_pixel_size(affine, lat):
+    """Get the width and height in meters of a geographic pixel at a latitude, from the ellipsoid radii."""
+    radians = math.radians(lat)
+    denominator = 1.0 - ECCENTRICITY_SQUARED * math.sin(radians) ** 2
+    meridional = SEMI_MAJOR_AXIS * (1.0 - ECCENTRICITY_SQUARED) / denominator ** 1.5
+    prime_vertical = SEMI_MAJOR_AXIS / math.sqrt(denominator)
+    width = abs(affine[0]) * math.radians(1.0) * prime_vertical * math.cos(radians)
+    height = abs(affine[4]) * math.radians(1.0) * meridional
+    return width, height
+
 def get_lat_lon(epsg_code, easting, northing):
-    """Get the latitude and longitude from UTM coordinates."""
+    """Get the latitude and longitude from UTM or geographic coordinates."""
 
     lat = None
     lon = None
 
+    # Geographic coordinates are already the longitude and latitude.
+    if is_geographic_epsg(epsg_code):
+        lat = northing
+        lon = easting
+
     # Validate the epsg code.
-    if is_valid_utm_epsg(epsg_code):
+    elif is_valid_utm_epsg(epsg_code):
 
         # Get the zone and hemispehere
         (zone_number, northern) = get_utm_zone_and_hemisphere(epsg_code)
@@ -72,3 +101,45 @@ def get_lat_lon(epsg_code, easting, northing):
             lat, lon = utm.to_latlon(easting, northing, zone_number, northern=northern)
 
     return lat, lon
+
+def get_utm_from_lat_lon(epsg_code, lat, lon):
+    """Get the UTM coordinates of a latitude and longitude in the zone of the epsg code."""
+
+    easting = None
+    northing = None
+
+    # Validate the epsg code.
+    if is_valid_utm_epsg(epsg_code):
+
+        # Get the zone and hemispehere
+        (zone_number, northern) = get_utm_zone_and_hemisphere(epsg_code)
+
+        # Get the eastings and northings forced into the zone.
+        if zone_number != None and northern != None:
+            (easting, northing, _, _) = utm.from_latlon(lat, lon, force_zone_number=zone_number,
+                                                        force_northern=northern)
+
+    return easting, northing
+
+def read_features(file_name):
+    """Read the features of a GeoJSON file, returning a list of the id and geometry."""
+    features = []
+    try:
+        with open(file_name, 'r') as geojson_file:
+            collection = json.load(geojson_file)
+    except (OSError, ValueError):
+        logging.error('Could not read the features (%s)' % (file_name))
+        return features
+
+    for indx, feature in enumerate(collection.get('features', [])):
+        geometry = feature.get('geometry')
+        if geometry is None:
+            continue
+
+        # Use the id property when there is one.
+        properties = feature.get('properties') or {}
+        feature_id = properties.get('id', feature.get('id', indx + 1))
+        features.append((feature_id, geometry))
+
+    logging.info('Read %d features from (%s)' % (len(features), file_name))
+    return features
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Far field horizon code."""
+
+import logging
+import math
+import numpy as np
+
+# Solar defined code.
+import solar_geospatial as sg
+import solar_rasterio as sr
+
+# Earth radius and the refraction coefficient for the curvature drop.
+EARTH_RADIUS = 6371000.0
+REFRACTION = 0.13
+
+class FarFieldHorizon:
+    """Far field horizon class, the horizon of a coarse regional surface beyond the processed surface."""
+
+    def __init__(self):
+        self.elevation = None
+        self.affine = None
+        self.no_data = None
+        self.row = None
+        self.col = None
+        self.gsd = None
+        self.start_distance = None
+        self.profiles = {}
+
+    def open_horizon(self, horizon_file, lat, lon, start_distance):
+        """Open a UTM regional surface and locate the site, the horizon starts at the start distance."""
+        img = sr.SolarImage()
+        if not img.open_image(horizon_file):
+            logging.error('Could not open the horizon surface (%s).' % (horizon_file))
+            return False
+
+        # Locate the site in the regional surface.
+        epsg_code = img.get_epsg_code()
+        (easting, northing) = sg.get_utm_from_lat_lon(epsg_code, lat, lon)
+        if easting is None:
+            logging.error('Horizon surface is not UTM (%d).' % (epsg_code))
+            img.close_image()
+            return False
+
+        self.affine = img.get_affine()
+        self.col = (easting - self.affine[2]) / self.affine[0]
+        self.row = (northing - self.affine[5]) / self.affine[4]
+        self.gsd = img.get_avg_gsd()
+        self.elevation = img.get_bands(1)
+        self.no_data = img.no_data()
+        if self.no_data is None:
+            self.no_data = -9999
+        self.start_distance = start_distance
+        img.close_image()
+
+        logging.info('Horizon site at row %.1f col %.1f, start distance %.1f' % (self.row, self.col, start_distance))
+        return True
+
+    def get_profile(self, azimuth):
+        """
+        Get the distances and curvature corrected elevations toward the azimuth.
+        The azimuth is clockwise from north, profiles are cached to a tenth of a degree.
+        """
+        key = round(azimuth % 360.0, 1)
+        if key in self.profiles:
+            return self.profiles[key]
+
+        # March away from the site in the direction of the sun.
+        (height, width) = self.elevation.shape
+        radians = math.radians(key)
+        step_col = math.sin(radians)
+        step_row = -math.cos(radians)
+        max_steps = int(math.hypot(height, width))
+        first = int(math.ceil(self.start_distance / self.gsd))
+        steps = np.arange(first, max_steps, dtype=float)
+        rows = np.round(self.row + steps * step_row).astype(int)
+        cols = np.round(self.col + steps * step_col).astype(int)
+
+        # Keep the samples inside the surface with data.
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        distances = steps[inside] * self.gsd
+        elevations = self.elevation[rows[inside], cols[inside]].astype(float)
+        valid = elevations != self.no_data
+        distances = distances[valid]
+        elevations = elevations[valid] - (1.0 - REFRACTION) * distances ** 2 / (2.0 * EARTH_RADIUS)
+
+        self.profiles[key] = (distances, elevations)
+        return distances, elevations
+
+    def get_far_field(self, azimuth, min_elevation, max_elevation, levels=64):
+        """Get the far field horizon angle in degrees for a range of observer elevations."""
+        elevation_levels = np.linspace(min_elevation, max_elevation, levels)
+        angles = np.zeros(levels)
+        (distances, elevations) = self.get_profile(azimuth)
+        if len(distances) > 0:
+            # The largest elevation angle from each level to the profile.
+            ratios = (elevations[np.newaxis, :] - elevation_levels[:, np.newaxis]) / distances[np.newaxis, :]
+            angles = np.degrees(np.arctan(np.maximum(np.amax(ratios, axis=1), 0.0)))
+
+        return elevation_levels, angles
+
+def apply_far_field(delta, surface, altitude, far_field, no_data):
+    """Limit the delta by the far field horizon, the larger horizon angle wins."""
+    (elevation_levels, angles) = far_field
+    valid = (delta != no_data) & (surface != no_data)
+    far_angles = np.interp(surface[valid], elevation_levels, angles)
+    delta[valid] = np.minimum(delta[valid], altitude - far_angles)
+    return delta
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""Irradiance code, the energy on the sloped surface accumulated one time step at a time."""
+
+import logging
+import math
+import numpy as np
+
+# Solar installed.
+from pysolar.solar import radiation
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_rasterio as sr
+import solar_utility as su
+
+def get_time_weights(times):
+    """Get the trapezoid weights in seconds of the times, so a sum of weighted steps is the integral."""
+    times = np.asarray(times, dtype=np.float64)
+    weights = np.zeros(len(times))
+    if len(times) >= 2:
+        steps = np.diff(times)
+        weights[:-1] += steps / 2.0
+        weights[1:] += steps / 2.0
+    return weights
+
+def get_surface_normals(surface, no_data, pixel_size=1.0):
+    """
+    Get the east, north and up components of the unit normal of every point from its neighbours.
+    The pixel size is the GSD, or for a geographic surface the width and height of a pixel in meters.
+    Points beside no data are taken as flat.
+    """
+    if isinstance(pixel_size, tuple):
+        (pixel_width, pixel_height) = pixel_size
+    else:
+        (pixel_width, pixel_height) = (pixel_size, pixel_size)
+    elevation = np.where(surface != no_data, surface, np.nan).astype(np.float64)
+
+    # The rows run to the south.
+    (row_slope, col_slope) = np.gradient(elevation, pixel_height, pixel_width)
+    east_slope = np.nan_to_num(col_slope)
+    north_slope = np.nan_to_num(-row_slope)
+    length = np.sqrt(east_slope ** 2 + north_slope ** 2 + 1.0)
+    return -east_slope / length, -north_slope / length, 1.0 / length
+
+def get_panel_normals(panels):
+    """Get the east, north and up unit normals of the panels, each a tilt from the horizontal and azimuth in degrees."""
+    tilts = np.radians([tilt for (tilt, _) in panels])
+    azimuths = np.radians([azimuth for (_, azimuth) in panels])
+    return np.stack([np.sin(tilts) * np.sin(azimuths), np.sin(tilts) * np.cos(azimuths), np.cos(tilts)], axis=1)
+
+class SolarIrradiance:
+    """
+    Irradiance class, the direct beam on the sloped surface of each time step is added to a running
+    energy sum as the step completes, lit where the step's delta from the sun is not negative.
+    Nothing of a step is kept once it is added.
+    Given panels the plane of array irradiance of every panel tilt and azimuth is summed instead,
+    the panels are a first axis of the sum.
+    """
+
+    def __init__(self):
+        self.no_data = None
+        self.local_date = None
+        self.time_zone = None
+        self.lat = None
+        self.lon = None
+        self.valid = None
+        self.normals = None
+        self.panels = None
+        self.weights = {}
+        self.energy = None
+        self.diffuse = 0.0
+        self.steps = 0
+
+    def open_irradiance(self, surface, no_data, pixel_size, times, local_date, time_zone, lat, lon, panels=None):
+        """Start the running sum of the padded surface, or of each of the panels, and the weights of the times."""
+        self.no_data = no_data
+        self.local_date = local_date
+        self.time_zone = time_zone
+        self.lat = lat
+        self.lon = lon
+        self.valid = surface != no_data
+        self.weights = dict(zip(times, get_time_weights(times)))
+        if panels is None:
+            self.panels = None
+            self.normals = get_surface_normals(surface, no_data, pixel_size)
+            self.energy = np.zeros(surface.shape)
+        else:
+            self.panels = list(panels)
+            self.normals = get_panel_normals(self.panels)
+            self.energy = np.zeros((len(self.panels),) + surface.shape)
+        self.diffuse = 0.0
+        self.steps = 0
+
+    def get_sun(self, time):
+        """Get the sun altitude in degrees, its unit vector and the direct beam radiation of the time in seconds."""
+        (sun_azimuth, sun_altitude) = sa.get_sun_position(time, self.local_date, self.time_zone, self.lat, self.lon)
+        direct = 0.0
+        if sun_altitude > 0:
+            (h, m, s) = su.get_time_from_seconds(time)
+            direct = radiation.get_radiation_direct(su.combine_datetime(self.local_date, h, m, int(s),
+                                                                        self.time_zone), sun_altitude)
+        (azimuth, altitude) = (math.radians(sun_azimuth), math.radians(sun_altitude))
+        vector = (math.sin(azimuth) * math.cos(altitude), math.cos(azimuth) * math.cos(altitude), math.sin(altitude))
+        return sun_altitude, vector, direct
+
+    def add_time(self, time, delta):
+        """Add the energy of a time step, the direct beam times the cosine of incidence where the point is lit."""
+        weight = self.weights.get(time, 0.0)
+        (sun_altitude, vector, direct) = self.get_sun(time)
+        self.steps += 1
+        if weight <= 0.0 or direct <= 0.0:
+            return
+
+        # A point with nothing further toward the sun is lit.
+        lit = self.valid & ((delta >= 0) | (delta == self.no_data))
+        if self.panels is None:
+            incidence = self.normals[0] * vector[0] + self.normals[1] * vector[1] + self.normals[2] * vector[2]
+            self.energy += np.where(lit, np.maximum(incidence, 0.0), 0.0) * (direct * weight / 3600.0)
+        else:
+            # A panel faces the sun at the same angle at every point, only the shadow is per point.
+            incidence = np.maximum(np.dot(self.normals, vector), 0.0) * (direct * weight / 3600.0)
+            self.energy += incidence[:, np.newaxis, np.newaxis] * lit
+
+        # The diffuse radiation of the whole sky, the sky view factor scales it per point.
+        self.diffuse += sa.get_sky_diffuse_factor(self.local_date.timetuple().tm_yday) * direct * weight / 3600.0
+
+    def get_irradiance(self, pad_rows, pad_cols, sky_view=None):
+        """
+        Get the energy in Wh/m2 of the clipped surface, with the diffuse radiation given the sky view factor.
+        The panels are a band each, and always have the diffuse radiation of the sky they face, an open sky
+        without the sky view factor.
+        """
+        logging.info('Irradiance of %d time steps' % (self.steps))
+        valid = sr.clip_padded_image(self.valid, pad_rows, pad_cols)
+        if self.panels is not None:
+            return self.get_panel_irradiance(pad_rows, pad_cols, valid, sky_view)
+        energy = sr.clip_padded_image(self.energy, pad_rows, pad_cols)
+        if sky_view is not None and sky_view.shape == energy.shape:
+            seen = sky_view != self.no_data
+            energy[seen] += sky_view[seen] * self.diffuse
+        irradiance = su.create_image(energy.shape, self.no_data, su.get_dtype('radiation'))
+        irradiance[valid] = energy[valid]
+        return irradiance
+
+    def get_panel_irradiance(self, pad_rows, pad_cols, valid, sky_view=None):
+        """Get the plane of array energy in Wh/m2 of each panel, a band each of the clipped surface."""
+        (_, height, width) = self.energy.shape
+        energy = self.energy[:, pad_rows:height - pad_rows, pad_cols:width - pad_cols]
+        sky = np.ones(valid.shape)
+        if sky_view is not None and sky_view.shape == valid.shape:
+            sky = np.where(sky_view != self.no_data, sky_view, 0.0)
+
+        # The isotropic sky a panel faces is half of it and its tilt's share of the other half.
+        facing = (1.0 + self.normals[:, 2]) / 2.0
+        irradiance = su.create_image(energy.shape, self.no_data, su.get_dtype('radiation'))
+        for indx in range(len(self.panels)):
+            band = energy[indx] + facing[indx] * self.diffuse * sky
+            irradiance[indx][valid] = band[valid]
+        return irradiance
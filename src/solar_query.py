@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""Point and polygon query code."""
+
+import concurrent.futures
+import logging
+import math
+import numpy as np
+import os
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_geospatial as sg
+import solar_horizon as sh
+import solar_rasterio as sr
+import solar_utility as su
+
+def get_query_pixels(features, metadata):
+    """Get the padded pixels of each feature, a point is a single pixel and a polygon is rasterized."""
+    pad_rows = metadata[0]
+    pad_cols = metadata[1]
+    height = metadata[2]
+    width = metadata[3]
+    affine = metadata[9]
+
+    queries = []
+    for (feature_id, geometry) in features:
+        if geometry['type'] == 'Point':
+            (ground_x, ground_y) = geometry['coordinates'][:2]
+            col = int(math.floor((ground_x - affine[2]) / affine[0]))
+            row = int(math.floor((ground_y - affine[5]) / affine[4]))
+            rows = np.array([row])
+            cols = np.array([col])
+            if row < 0 or row >= height or col < 0 or col >= width:
+                rows = np.array([], dtype=int)
+                cols = np.array([], dtype=int)
+        else:
+            (rows, cols) = np.nonzero(sr.rasterize_features([geometry], (height, width), affine))
+
+        if len(rows) == 0:
+            logging.warning('Feature %s is outside the surface' % (str(feature_id)))
+            continue
+
+        queries.append((feature_id, geometry['type'], rows + pad_rows, cols + pad_cols))
+
+    return queries
+
+def get_elevations(surface, indices, no_data):
+    """Get the elevations at the flat indices, the index one past the end is no data."""
+    elevations = su.create_image(indices.shape, no_data, surface.dtype)
+    inside = indices < surface.size
+    elevations[inside] = surface.ravel()[indices[inside]]
+    return elevations
+
+def march_point(surface, rotation_angle, row, col, no_data, pixel_size):
+    """
+    Get the max angle toward the sun from a rotated point.
+    Only the column below the point is rotated, and is scanned exactly as process_angles scans it.
+    """
+    (height, _) = surface.shape
+    rows = np.arange(row, height)
+    column = get_elevations(surface, sr.get_rotation_sources(surface.shape, rotation_angle, rows, col), no_data)
+    elevation = column[0]
+    if elevation == no_data:
+        return no_data
+
+    column = column[1:]
+    valid = column != no_data
+    if not valid.any():
+        return no_data
+
+    delta_len = (np.nonzero(valid)[0] + 1.0) * pixel_size
+    max_ratio = max(np.amax((column[valid] - elevation) / delta_len), 0.0)
+    return math.degrees(math.atan(max_ratio))
+
+def query_time(time, local_date, time_zone, lat, lon, surface, no_data, rows, cols, pixel_size=1.0, far_field=None):
+    """
+    Get the delta of the padded pixels for a time by marching toward the sun.
+    Only the query pixels and the columns they march along are rotated, not the whole surface.
+    """
+    (sun_azimuth, sun_altitude) = sa.get_sun_position(time, local_date, time_zone, lat, lon)
+    logging.info('Query time %d sun azimuth: %.5f altitude: %.5f' % (time, sun_azimuth, sun_altitude))
+
+    # The rotation that puts the sun at the bottom and the one that brings the point back, quantized as the
+    # rotation of the whole surface is.
+    (rotation_angle, pixel_size) = sa.get_pixel_rotation(sun_azimuth, pixel_size)
+    quantized = int(round(rotation_angle / sr.ROTATION_QUANTUM))
+    inverse = sr.get_rotation_sources(surface.shape, -quantized * sr.ROTATION_QUANTUM, rows, cols)
+    (_, width) = surface.shape
+
+    # Each pixel takes its delta from the rotated point it was rotated back from.
+    angle_dtype = su.get_dtype('angle')
+    delta = su.create_image((len(rows)), no_data, angle_dtype)
+    for indx in range(len(rows)):
+        rotated = inverse[indx]
+        if rotated == surface.size:
+            continue
+        angle = march_point(surface, quantized * sr.ROTATION_QUANTUM, rotated // width, rotated % width, no_data,
+                            pixel_size)
+        if angle != no_data:
+            delta[indx] = sun_altitude - angle_dtype(angle)
+
+    # A distant horizon can hide the sun too.
+    if far_field is not None:
+        delta = sh.apply_far_field(delta, surface[rows, cols], sun_altitude, far_field, no_data)
+
+    return [time, delta]
+
+def process_query(surface, metadata, local_date, sunrise_time, sunset_time, query_file, workers, horizon=None,
+                  radiation=False, sky_view=None):
+    """
+    Process the light of the query points and polygons, writing a table of the results.
+    With radiation the table has the radiation of each, with the diffuse radiation given the sky view factor.
+    """
+    logging.info('Processing query (%s)...' % (query_file))
+    pad_rows = metadata[0]
+    pad_cols = metadata[1]
+    lat = metadata[4]
+    lon = metadata[5]
+    gsd = metadata[6]
+    no_data = metadata[7]
+    time_zone = metadata[10]
+    increments = metadata[11]
+    output_path = metadata[12]
+    surface_filename = metadata[13]
+
+    # Get the pixels of every query.
+    queries = get_query_pixels(sg.read_features(query_file), metadata)
+    if len(queries) == 0:
+        logging.error('Nothing to query in (%s)' % (query_file))
+        return None
+    rows = np.concatenate([query[2] for query in queries])
+    cols = np.concatenate([query[3] for query in queries])
+
+    # Get the time array.
+    times = su.get_processing_times(sunrise_time, sunset_time, increments)
+
+    # The far field horizon from the regional surface.
+    far_fields = {}
+    if horizon is not None:
+        far_fields = sa.get_far_fields(horizon, surface, times, local_date, time_zone, lat, lon, no_data)
+
+    # March from the pixels for every time.
+    deltas = []
+    pool = sa.get_pool(workers)
+    futures = []
+    for time in times:
+        futures.append(pool.submit(query_time, time, local_date, time_zone, lat, lon, surface, no_data, rows, cols,
+                                   gsd, far_fields.get(time)))
+    for x in concurrent.futures.as_completed(futures):
+        deltas.append(x.result())
+    deltas.sort(key=lambda tmp: tmp[0])
+
+    # Fold the deltas as a single row image.
+    deltas = [[tmp[0], tmp[1].reshape((1, -1))] for tmp in deltas]
+    (sunrise, sunset) = sa.fold_deltas(deltas, no_data)
+    sunrise[sunrise == no_data] = times[0]
+    sunset[sunset == no_data] = times[-1]
+    light_in_seconds = sa.compute_light_in_seconds(sunrise, sunset, no_data)
+    values = surface[rows, cols].reshape((1, -1))
+    sunrise = sa.clean_given_surface(values, sunrise, no_data)
+    sunset = sa.clean_given_surface(values, sunset, no_data)
+    light_in_seconds = sa.clean_given_surface(values, light_in_seconds, no_data)
+    percentage_light = sa.get_percentage_light(light_in_seconds, no_data, times[-1] - times[0])[0]
+    light_in_seconds = light_in_seconds[0]
+
+    # The radiation of the pixels as of the whole surface, the sky view factor is of the clipped surface.
+    radiation_data = None
+    if radiation:
+        pixels_view = None
+        if sky_view is not None:
+            pixels_view = sky_view[rows - pad_rows, cols - pad_cols].reshape((1, -1))
+        (success, radiation_data) = sa.get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date,
+                                                             time_zone, lat, lon, no_data, pixels_view)
+        radiation_data = radiation_data[0] if success else None
+    sunrise = sunrise[0]
+    sunset = sunset[0]
+
+    # Write the table, polygons are the mean of their valid pixels.
+    (_, tail) = os.path.split(surface_filename)
+    (base, _) = os.path.splitext(tail)
+    name = os.path.join(output_path, base + '_' + local_date.isoformat() + '_query.csv')
+    logging.info('Saving query data (%s)' % (name))
+    results = []
+    start = 0
+    with open(name, 'w') as query_file:
+        query_file.write('id,type,pixels,sunrise,sunset,light_secs,light_perc%s\n' %
+                         (',radiation' if radiation_data is not None else ''))
+        for (feature_id, geometry_type, query_rows, _) in queries:
+            end = start + len(query_rows)
+            valid = light_in_seconds[start:end] != no_data
+            result = [feature_id, geometry_type, int(np.count_nonzero(valid)), no_data, no_data, no_data, no_data]
+            if valid.any():
+                result[3:] = [float(np.mean(sunrise[start:end][valid])), float(np.mean(sunset[start:end][valid])),
+                              float(np.mean(light_in_seconds[start:end][valid])),
+                              float(np.mean(percentage_light[start:end][valid]))]
+            line = '%s,%s,%d,%.1f,%.1f,%.1f,%.2f' % tuple(result)
+            if radiation_data is not None:
+                result.append(float(np.mean(radiation_data[start:end][valid])) if valid.any() else no_data)
+                line += ',%.2f' % (result[-1])
+            query_file.write(line + '\n')
+            results.append(result)
+            start = end
+
+    return results
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""Work queue code, a SQLite queue in a shared directory that workers on any node claim tasks from."""
+
+import argparse
+import concurrent.futures
+import logging
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Solar defined code.
+import solar_utility as su
+
+# Seconds a claimed task is held, a worker that stops renewing it is taken as dead and the task is claimed again.
+LEASE_SECONDS = 120.0
+
+# Seconds between looks at the queue.
+POLL_SECONDS = 0.2
+
+# Claims of a task before it is failed.
+MAX_ATTEMPTS = 3
+
+QUEUE_FILE = 'queue.db'
+ARRAYS_DIR = 'arrays'
+RESULTS_DIR = 'results'
+
+class ArrayRef:
+    """Reference to an array stored as a .npy file in the queue directory."""
+
+    def __init__(self, name):
+        self.name = name
+
+def open_queue(queue_path):
+    """Open the queue database of the directory, creating its tables."""
+    connection = sqlite3.connect(os.path.join(queue_path, QUEUE_FILE), timeout=60.0, isolation_level=None)
+    connection.execute('CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, session TEXT, call BLOB, '
+                       'state TEXT, worker TEXT, lease REAL, attempts INTEGER, result BLOB)')
+    connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    return connection
+
+def get_meta(connection, key):
+    """Get a value of the queue, None when it is not set."""
+    row = connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return None if row is None else row[0]
+
+def set_meta(connection, key, value):
+    """Set a value of the queue."""
+    connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+def put_task(connection, call, session=None):
+    """Add a pickled call of a session to the queue, returning its id."""
+    cursor = connection.execute("INSERT INTO tasks (session, call, state, attempts) VALUES (?, ?, 'pending', 0)",
+                                (session, call))
+    return cursor.lastrowid
+
+def claim_task(connection, worker, lease=LEASE_SECONDS, session=None):
+    """
+    Claim the oldest pending task, or a running one whose lease has run out, returning its id and call.
+    Given a session only its tasks are claimed.
+    A task already claimed the most times is failed instead. Returns None when there is nothing to claim.
+    """
+    while True:
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute("SELECT id, call, attempts FROM tasks WHERE (state = 'pending' OR "
+                                     "(state = 'running' AND lease < ?)) AND (? IS NULL OR session = ?) "
+                                     "ORDER BY id LIMIT 1", (now, session, session)).fetchone()
+            if row is None:
+                return None
+            (task_id, call, attempts) = row
+            if attempts >= MAX_ATTEMPTS:
+                logging.error('Task %d failed after %d claims' % (task_id, attempts))
+                error = RuntimeError('Task %d was not completed in %d claims' % (task_id, attempts))
+                connection.execute("UPDATE tasks SET state = 'failed', result = ? WHERE id = ?",
+                                   (pickle.dumps(error), task_id))
+                continue
+            connection.execute("UPDATE tasks SET state = 'running', worker = ?, lease = ?, attempts = attempts + 1 "
+                               "WHERE id = ?", (worker, now + lease, task_id))
+            return task_id, call
+        finally:
+            connection.execute('COMMIT')
+
+def renew_lease(connection, task_id, worker, lease=LEASE_SECONDS):
+    """Extend the lease of a task, False when the worker no longer holds it."""
+    cursor = connection.execute("UPDATE tasks SET lease = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                                (time.time() + lease, task_id, worker))
+    return cursor.rowcount == 1
+
+def complete_task(connection, task_id, worker, result, failed=False):
+    """Store the pickled result (or exception) of a task, False when the worker no longer holds it."""
+    state = 'failed' if failed else 'done'
+    cursor = connection.execute("UPDATE tasks SET state = ?, result = ? WHERE id = ? AND worker = ? AND "
+                                "state = 'running'", (state, result, task_id, worker))
+    return cursor.rowcount == 1
+
+def store_arrays(value, path, prefix, names):
+    """
+    Replace the arrays in a value (or its lists and tuples) by references, writing each as a memory mapped .npy.
+    The names are keyed by the array id, so each array object is only written once.
+    """
+    if isinstance(value, np.ndarray):
+        if id(value) in names:
+            return ArrayRef(names[id(value)][0])
+        name = '%s_%d.npy' % (prefix, len(names))
+        chunk = np.lib.format.open_memmap(os.path.join(path, name + '.tmp'), mode='w+', dtype=value.dtype,
+                                          shape=value.shape)
+        chunk[...] = value
+        chunk.flush()
+        del chunk
+        os.replace(os.path.join(path, name + '.tmp'), os.path.join(path, name))
+        # Keep the array so its id is not reused.
+        names[id(value)] = (name, value)
+        return ArrayRef(name)
+    if isinstance(value, (list, tuple)):
+        return type(value)(store_arrays(item, path, prefix, names) for item in value)
+    return value
+
+def load_arrays(value, path, mmap_mode=None):
+    """Replace the references in a value by their arrays."""
+    if isinstance(value, ArrayRef):
+        return np.load(os.path.join(path, value.name), mmap_mode=mmap_mode)
+    if isinstance(value, (list, tuple)):
+        return type(value)(load_arrays(item, path, mmap_mode) for item in value)
+    return value
+
+def get_array_names(value):
+    """Get the names of the arrays a value references."""
+    if isinstance(value, ArrayRef):
+        return [value.name]
+    if isinstance(value, (list, tuple)):
+        return [name for item in value for name in get_array_names(item)]
+    return []
+
+def run_task(queue_path, task_id, call):
+    """
+    Run a call under the precision policy of its session, the inputs are memory mapped and the arrays of
+    the result are written as chunks.
+    """
+    (fn, args, kwargs, precision) = pickle.loads(call)
+    if precision is not None:
+        su.set_precision(precision)
+    args = load_arrays(args, os.path.join(queue_path, ARRAYS_DIR), 'r')
+    kwargs = {key: load_arrays(kwargs[key], os.path.join(queue_path, ARRAYS_DIR), 'r') for key in kwargs}
+    result = fn(*args, **kwargs)
+    return store_arrays(result, os.path.join(queue_path, RESULTS_DIR), 'task_%d' % (task_id), {})
+
+def get_session_key(session):
+    """Get the meta key of a session, set once it is closed."""
+    return 'session_%s' % (session)
+
+def close_queue(queue_path):
+    """Close the queue of a run, the workers not bound to a session stop once it is empty."""
+    connection = open_queue(queue_path)
+    set_meta(connection, 'closed', uuid.uuid4().hex)
+    connection.close()
+    logging.info('Closed queue (%s)' % (queue_path))
+
+def run_worker(queue_path, worker=None, lease=LEASE_SECONDS, poll=POLL_SECONDS, session=None):
+    """
+    Claim and run the tasks of a queue, renewing the lease of the running task. Returns the number of tasks run.
+    Any number of workers on any node can share the queue directory. They serve the sessions (pools) of the
+    run one after another and stop when the run closes the queue. Given a session, the worker only runs its
+    tasks and stops when the session is closed.
+    """
+    if worker is None:
+        worker = '%s-%d' % (socket.gethostname(), os.getpid())
+    while not os.path.exists(os.path.join(queue_path, QUEUE_FILE)):
+        time.sleep(poll)
+    connection = open_queue(queue_path)
+    logging.info('Worker %s on queue (%s)' % (worker, queue_path))
+
+    # A close of the queue before the worker started is of an earlier run.
+    closed = get_meta(connection, 'closed')
+    count = 0
+    while True:
+        claimed = claim_task(connection, worker, lease, session)
+        if claimed is None:
+            if session is not None and get_meta(connection, get_session_key(session)) == 'closed':
+                break
+            if session is None and get_meta(connection, 'closed') != closed:
+                break
+            time.sleep(poll)
+            continue
+        (task_id, call) = claimed
+
+        # Renew the lease while the task runs.
+        done = threading.Event()
+
+        def renew():
+            renew_connection = open_queue(queue_path)
+            while not done.wait(lease / 3.0):
+                if not renew_lease(renew_connection, task_id, worker, lease):
+                    break
+            renew_connection.close()
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            result = pickle.dumps(run_task(queue_path, task_id, call))
+            failed = False
+        except Exception as error:
+            logging.exception('Task %d failed' % (task_id))
+            result = pickle.dumps(error)
+            failed = True
+        done.set()
+        renewer.join()
+        if not complete_task(connection, task_id, worker, result, failed):
+            logging.warning('Task %d was claimed by another worker' % (task_id))
+        count += 1
+
+    connection.close()
+    logging.info('Worker %s ran %d tasks' % (worker, count))
+    return count
+
+class QueueExecutor(concurrent.futures.Executor):
+    """
+    Queue executor class, the calls are tasks of a session of a SQLite queue in a shared directory.
+    The arrays of the calls are written once and memory mapped by the workers, which can be local
+    processes started here or run on other nodes (solar_queue.py -q) pointed at the same directory.
+    Each executor is a session of its own, so the pools of a run, or of several runs, share the queue and
+    the workers on other nodes. Shutting down waits for every task of the session and removes its files,
+    so without local workers some must be running elsewhere. A temporary queue directory is removed.
+    """
+
+    def __init__(self, queue_path, workers=0, lease=LEASE_SECONDS, poll=POLL_SECONDS, temporary=False):
+        self.queue_path = queue_path
+        self.temporary = temporary
+        self.poll = poll
+        self.session = uuid.uuid4().hex
+        for directory in [ARRAYS_DIR, RESULTS_DIR]:
+            os.makedirs(os.path.join(queue_path, directory), exist_ok=True)
+        self.connection = open_queue(queue_path)
+        self.precision = su.get_precision()
+        self.names = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        logging.info('Queue (%s) session %s with %d local workers' % (queue_path, self.session, workers))
+
+        # The local workers start before the collector thread.
+        self.workers = []
+        for _ in range(workers):
+            process = multiprocessing.Process(target=run_worker, args=(queue_path, None, lease, poll, self.session))
+            process.start()
+            self.workers.append(process)
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue a call of a module level function."""
+        path = os.path.join(self.queue_path, ARRAYS_DIR)
+        with self.lock:
+            prefix = 'array_%s' % (self.session)
+            args = store_arrays(args, path, prefix, self.names)
+            kwargs = {key: store_arrays(kwargs[key], path, prefix, self.names) for key in kwargs}
+            future = concurrent.futures.Future()
+            task_id = put_task(self.connection, pickle.dumps((fn, args, kwargs, self.precision)), self.session)
+            self.futures[task_id] = future
+        return future
+
+    def collect(self):
+        """Resolve the futures of the finished tasks of the session, their chunks are read and removed."""
+        connection = open_queue(self.queue_path)
+        results = os.path.join(self.queue_path, RESULTS_DIR)
+        while not (self.closed.is_set() and len(self.futures) == 0):
+            rows = connection.execute("SELECT id, state, result FROM tasks WHERE session = ? AND "
+                                      "state IN ('done', 'failed')", (self.session,)).fetchall()
+            for (task_id, state, result) in rows:
+                with self.lock:
+                    future = self.futures.pop(task_id, None)
+                connection.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+                if future is None:
+                    continue
+                result = pickle.loads(result)
+                if state == 'failed':
+                    future.set_exception(result)
+                    continue
+                value = load_arrays(result, results)
+                for name in get_array_names(result):
+                    os.remove(os.path.join(results, name))
+                future.set_result(value)
+            if len(rows) == 0:
+                time.sleep(self.poll)
+        connection.close()
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """
+        Close the session, its local workers stop once its tasks are done and its arrays are removed.
+        The queue stays open for the other sessions and the workers on other nodes.
+        """
+        if cancel_futures:
+            with self.lock:
+                for task_id in list(self.futures):
+                    self.connection.execute("DELETE FROM tasks WHERE id = ? AND state = 'pending'", (task_id,))
+                    self.futures.pop(task_id).cancel()
+        set_meta(self.connection, get_session_key(self.session), 'closed')
+        self.closed.set()
+        if not wait:
+            return
+        self.collector.join()
+        for process in self.workers:
+            process.join()
+        self.connection.execute('DELETE FROM meta WHERE key = ?', (get_session_key(self.session),))
+        self.connection.close()
+        for (name, _) in self.names.values():
+            os.remove(os.path.join(self.queue_path, ARRAYS_DIR, name))
+        self.names = {}
+        if self.temporary:
+            shutil.rmtree(self.queue_path, ignore_errors=True)
+
+def arg_parse():
+    """Parse the arguments."""
+    parser = argparse.ArgumentParser(description="Run the tasks of a solar work queue.")
+    parser.add_argument('-q', '--queue', type=str, required=True)
+    parser.add_argument('--lease', type=float, default=LEASE_SECONDS)
+    args = parser.parse_args()
+    logging.info(args)
+    return args
+
+def main():
+    """Main function."""
+    logging.basicConfig(filename='solar_queue.log',
+                        format ='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
+                        datefmt = "%Y-%m-%d %H:%M:%S", filemode='w', level=logging.INFO)
+    args = arg_parse()
+
+    # Run from the module rather than the script, so the array references of the tasks are the same class.
+    import solar_queue
+    solar_queue.run_worker(args.queue, lease=args.lease)
+
+if __name__ == '__main__':
+    main()
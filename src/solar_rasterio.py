@@ -2,11 +2,22 @@
 
 """Raster code."""
 
+from collections import OrderedDict
 import logging
+import math
 import numpy as np
-import osgeo.gdal as gdal
-import rasterio
-from skimage.transform import rotate
+import threading
+
+# Solar defined code.
+import solar_utility as su
+
+# Rotation angles are quantized to a hundredth of a degree for the index cache.
+ROTATION_QUANTUM = 0.01
+
+# The rotation index cache is bounded in bytes, least recently used first out.
+ROTATION_CACHE_BYTES = 512 * 1024 * 1024
+rotation_cache = OrderedDict()
+rotation_lock = threading.Lock()
 
 class SolarImage:
     """Solar image class."""
@@ -14,10 +25,16 @@ class SolarImage:
     def __init__(self):
         self.img = None
 
-    def open_image(self, file_name, mode='r'):
-        """Open an image."""
+    def open_image(self, file_name, mode='r', overview_level=None):
+        """Open an image, optionally one of its overview levels."""
+        # Rasterio is only loaded when an image is opened or written.
+        import rasterio
+
         try:
-            self.img = rasterio.open(file_name, mode)
+            if overview_level is None:
+                self.img = rasterio.open(file_name, mode)
+            else:
+                self.img = rasterio.open(file_name, mode, overview_level=overview_level)
             if self.img != None:
                 return True
         except OSError:
@@ -58,6 +75,20 @@ class SolarImage:
         """Get the bands in an image."""
         return self.img.read(bands)
 
+    def get_window(self, row_slice, col_slice):
+        """Get a window of the first band, the slices are (start, stop)."""
+        from rasterio.windows import Window
+
+        return self.img.read(1, window=Window.from_slices(row_slice, col_slice))
+
+    def block_shape(self):
+        """Get the shape of the blocks of the first band."""
+        return self.img.block_shapes[0]
+
+    def overviews(self):
+        """Get the decimation factors of the overviews of the first band."""
+        return self.img.overviews(1)
+
     def get_affine(self):
         """Get the affine transformation."""
         return self.img.affine
@@ -69,6 +100,15 @@ class SolarImage:
         epsg_code = int(epsg[5:])
         return epsg_code
 
+    def get_unit_factor(self):
+        """Get the meters in a unit of a projected CRS, None for a geographic CRS."""
+        from rasterio.errors import CRSError
+
+        try:
+            return self.img.crs.linear_units_factor[1]
+        except (AttributeError, CRSError):
+            return None
+
     def get_centroid_ground(self):
         """Get the center of the image in ground coordinates."""
         half_width = self.img.width / 2.0
@@ -83,8 +123,8 @@ class SolarImage:
         affine = self.img.affine
         return (affine[0] - affine[4]) / 2.0
 
-def padded_image(image, pad_rows, pad_cols, no_data=-9999):
-    """Pad an image with cols and rows."""
+def padded_image(image, pad_rows, pad_cols, no_data=-9999, dtype=None):
+    """Pad an image with cols and rows, by default of the elevation dtype."""
     # Get the current size.
     (height, width) = image.shape
 
@@ -93,8 +133,7 @@ def padded_image(image, pad_rows, pad_cols, no_data=-9999):
     new_height = height + 2 * pad_rows
 
     # Get the padded image.
-    pad_image = np.ones((new_height, new_width))
-    pad_image *= no_data
+    pad_image = su.create_image((new_height, new_width), no_data, dtype)
 
     # Place the dem in the center.
     pad_image[pad_rows:pad_rows + height, pad_cols:pad_cols + width] = image
@@ -110,36 +149,184 @@ def clip_padded_image(image, pad_rows, pad_cols, no_data=-9999):
     new_width = width - 2 * pad_cols
     new_height = height - 2 * pad_rows
 
-    # Get the clipped image.
-    clipped_image = np.ones((new_height, new_width))
-    clipped_image *= no_data
-
     # Clip the image.
     clipped_image = image[pad_rows:pad_rows + new_height, pad_cols:pad_cols + new_width]
 
     return clipped_image.copy()
 
+def downsample_image(image, factor, no_data=-9999):
+    """Downsample an image by an integer factor, averaging the valid pixels in each block."""
+    # Get the current size.
+    (height, width) = image.shape
+
+    # Get the new size, a partial block at the edge is kept.
+    new_height = int(math.ceil(height / float(factor)))
+    new_width = int(math.ceil(width / float(factor)))
+
+    # Place the image in whole blocks.
+    blocks = np.ones((new_height * factor, new_width * factor))
+    blocks *= no_data
+    blocks[:height, :width] = image
+    blocks = blocks.reshape(new_height, factor, new_width, factor)
+
+    # Average the valid pixels, a block with none is no data.
+    valid = blocks != no_data
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    down_image = su.create_image((new_height, new_width), no_data, image.dtype)
+    down_image[count > 0] = total[count > 0] / count[count > 0]
+
+    return down_image
+
+def upsample_image(image, factor, shape, no_data=-9999):
+    """Upsample an image by an integer factor to a given shape by repeating pixels."""
+    (height, width) = shape
+    repeated = np.repeat(np.repeat(image, factor, axis=0), factor, axis=1)
+
+    # Clip or pad to the requested size.
+    up_image = su.create_image((height, width), no_data, repeated.dtype)
+    rows = min(height, repeated.shape[0])
+    cols = min(width, repeated.shape[1])
+    up_image[:rows, :cols] = repeated[:rows, :cols]
+
+    return up_image
+
+def get_rotation_sources(shape, rotation_angle, rows, cols):
+    """
+    Get the nearest neighbour gather indices of some output pixels of a rotation about the center.
+    Points from outside the image index one past the end, the no data value.
+    """
+    (height, width) = shape
+    center_x = width / 2.0 - 0.5
+    center_y = height / 2.0 - 0.5
+    radians = math.radians(rotation_angle)
+    cos_angle = math.cos(radians)
+    sin_angle = math.sin(radians)
+
+    # Map the output pixels back to the input.
+    rows = np.asarray(rows, dtype=float) - center_y
+    cols = np.asarray(cols, dtype=float) - center_x
+    src_cols = np.floor(cos_angle * cols - sin_angle * rows + center_x + 0.5).astype(np.int64)
+    src_rows = np.floor(sin_angle * cols + cos_angle * rows + center_y + 0.5).astype(np.int64)
+    valid = (src_cols >= 0) & (src_cols < width) & (src_rows >= 0) & (src_rows < height)
+
+    return np.where(valid, src_rows * width + src_cols, height * width)
+
+def compute_rotation_indices(shape, rotation_angle):
+    """Compute the nearest neighbour gather indices of a rotation about the center for every pixel."""
+    (height, width) = shape
+    (rows, cols) = np.mgrid[0:height, 0:width]
+    indices = get_rotation_sources(shape, rotation_angle, rows, cols)
+
+    # The smallest integer that can hold the indices.
+    size = height * width
+    dtype = np.int32 if size < np.iinfo(np.int32).max else np.int64
+
+    return indices.astype(dtype)
+
+def get_rotation_indices(shape, rotation_angle):
+    """
+    Get the rotation indices from the cache, computing the rotation and its inverse when missing.
+    The cache is shared by the threads of a thread pool.
+    """
+    quantized = int(round(rotation_angle / ROTATION_QUANTUM))
+    key = (tuple(shape), quantized)
+    with rotation_lock:
+        if key in rotation_cache:
+            rotation_cache.move_to_end(key)
+            return rotation_cache[key]
+
+        # The inverse is nearly always needed to rotate back.
+        for sign in [1, -1]:
+            indices = compute_rotation_indices(shape, sign * quantized * ROTATION_QUANTUM)
+            rotation_cache[(tuple(shape), sign * quantized)] = indices
+        indices = rotation_cache[key]
+
+        # Evict the least recently used.
+        while len(rotation_cache) > 2 and sum(value.nbytes for value in rotation_cache.values()) > ROTATION_CACHE_BYTES:
+            rotation_cache.popitem(last=False)
+
+    return indices
+
 def rotate_image(image, rotation_angle, no_data=-9999):
     """
     Rotate an image about an angle.
     Rotation angle in degrees in counter-clockwise direction.
     """
-    rotated_image = rotate(image, rotation_angle, order=0, cval=no_data,
-                           resize=False, preserve_range=True)
-    return rotated_image.copy()
+    indices = get_rotation_indices(image.shape, rotation_angle)
+    rotated_image = np.take(np.append(image.ravel(), no_data), indices)
+    return rotated_image
+
+def resample_image(src, dst, srcEpsg, dstEpsg, gsd, no_data, resampling='near'):
+    """
+    Resample the image using GDAL.
+    Resampling is a GDAL warp algorithm, max or a quantile (med, q1, q3) keep tall thin obstacles.
+    """
+    import osgeo.gdal as gdal
 
-def resample_image(src, dst, srcEpsg, dstEpsg, gsd, no_data):
-    """Resample the image using GDAL."""
     try:
-        logging.info('EPSG %d to %d' % (srcEpsg, dstEpsg))
+        logging.info('EPSG %d to %d (%s)' % (srcEpsg, dstEpsg, resampling))
         warp_opt = gdal.WarpOptions(xRes=gsd, yRes=gsd, srcNodata=no_data,
-            dstNodata=no_data, srcSRS='EPSG:' + str(srcEpsg), dstSRS='EPSG:' + str(dstEpsg))
+            dstNodata=no_data, srcSRS='EPSG:' + str(srcEpsg), dstSRS='EPSG:' + str(dstEpsg),
+            resampleAlg=resampling)
         gdal.Warp(destNameOrDestDS=dst, srcDSOrSrcDSTab=src, options=warp_opt)
     except IOError:
         logging.error('Problem resampling %s', src)
         return False
     return True
 
+def place_on_grid(image, profile, shape, grid_profile, no_data=-9999):
+    """Place an image on the grid of another of a shape, by the nearest neighbour."""
+    from rasterio.warp import reproject, Resampling
+
+    placed = su.create_image(shape, no_data, np.float64)
+    reproject(source=image, destination=placed, src_transform=profile['transform'], src_crs=profile['crs'],
+              src_nodata=no_data, dst_transform=grid_profile['transform'], dst_crs=grid_profile['crs'],
+              dst_nodata=no_data, resampling=Resampling.nearest)
+    return placed
+
+def compare_surfaces(full_file, coarse_file, no_data=-9999):
+    """
+    Compare a resampled surface with the full resolution surface.
+    Returns the coarse minus full elevation statistics and the percentage of
+    full resolution pixels above the coarse surface, i.e. obstacles lost.
+    """
+    stats = None
+    full = SolarImage()
+    coarse = SolarImage()
+    if full.open_image(full_file) and coarse.open_image(coarse_file):
+        full_band = full.get_bands(1)
+        coarse_band = coarse.get_bands(1)
+
+        # Place the coarse surface on the full resolution grid.
+        coarse_on_full = place_on_grid(coarse_band, coarse.profile(), full_band.shape, full.profile(), no_data)
+
+        # Only compare where both have data.
+        full_no_data = full.no_data()
+        if full_no_data is None:
+            full_no_data = no_data
+        valid = (full_band != full_no_data) & (coarse_on_full != no_data)
+        if valid.any():
+            difference = coarse_on_full[valid] - full_band[valid]
+            stats = {'min': float(np.amin(difference)),
+                     'max': float(np.amax(difference)),
+                     'mean': float(np.mean(difference)),
+                     'rms': float(np.sqrt(np.mean(difference ** 2))),
+                     'lost': float(100.0 * np.count_nonzero(difference < 0) / difference.size)}
+        full.close_image()
+        coarse.close_image()
+
+    return stats
+
+def rasterize_features(geometries, shape, affine):
+    """Rasterize GeoJSON geometries into a label image, zero is background and the first geometry is one."""
+    from rasterio import features
+
+    shapes = [(geometry, indx + 1) for indx, geometry in enumerate(geometries)]
+    if len(shapes) == 0:
+        return np.zeros(shape, dtype=np.int32)
+    return features.rasterize(shapes, out_shape=shape, transform=affine, fill=0, dtype=np.int32)
+
 def get_gsd(file_name):
     """Get the GSD from an image."""
     avg_gsd = 0.0
@@ -162,13 +349,54 @@ def get_epsg(file_name):
         img.close_image()
     return epsg, ground_x, ground_y, no_data
 
-def write_output(name, img, profile, dn_type=rasterio.float64):
-    """Write some output."""
+def write_output(name, img, profile, dn_type=None):
+    """Write some output, by default in the dtype of the image."""
+    import rasterio
+
+    if dn_type is None:
+        dn_type = img.dtype
     new_profile = profile
     new_profile.update(dtype=dn_type)
     with rasterio.open(name, 'w', **new_profile) as dst:
         dst.write(img, 1)
 
+def write_bands(name, bands, profile):
+    """Write a stack of bands, the first axis is the band."""
+    import rasterio
+
+    new_profile = profile.copy()
+    new_profile.update(dtype=bands.dtype, count=bands.shape[0])
+    with rasterio.open(name, 'w', **new_profile) as dst:
+        dst.write(bands)
+
+def write_color_output(name, rgba, profile):
+    """Write a RGBA image of bytes, the fourth band is the alpha."""
+    import rasterio
+    from rasterio.enums import ColorInterp
+
+    new_profile = profile.copy()
+    new_profile.update(dtype=np.uint8, count=4, nodata=None, photometric='RGB')
+    with rasterio.open(name, 'w', **new_profile) as dst:
+        dst.write(np.moveaxis(rgba, -1, 0))
+        dst.colorinterp = [ColorInterp.red, ColorInterp.green, ColorInterp.blue, ColorInterp.alpha]
+
+def patch_output(name, img, mask):
+    """Patch an existing output in place, only the window around the mask is read and written."""
+    import rasterio
+    from rasterio.windows import Window
+
+    (rows, cols) = np.nonzero(mask)
+    if len(rows) == 0:
+        return
+    row_slice = (int(np.amin(rows)), int(np.amax(rows)) + 1)
+    col_slice = (int(np.amin(cols)), int(np.amax(cols)) + 1)
+    window = Window.from_slices(row_slice, col_slice)
+    window_mask = mask[row_slice[0]:row_slice[1], col_slice[0]:col_slice[1]]
+    with rasterio.open(name, 'r+') as dst:
+        block = dst.read(1, window=window)
+        block[window_mask] = img[row_slice[0]:row_slice[1], col_slice[0]:col_slice[1]][window_mask]
+        dst.write(block, 1, window=window)
+
 def write_affine(name, affine):
     """Write a TIFF world file."""
     with open(name, 'w') as worldfile:
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""Remote surface code, windows of cloud optimized GeoTIFFs read block by block over HTTP ranges."""
+
+import logging
+import math
+import numpy as np
+import os
+import rasterio
+from rasterio.transform import Affine
+import tempfile
+import urllib.request
+
+# Solar defined code.
+import solar_geospatial as sg
+import solar_rasterio as sr
+
+# The remote schemes and their GDAL virtual file system.
+REMOTE_PREFIXES = {'http://': '', 'https://': '', 's3://': '/vsis3/', 'gs://': '/vsigs/'}
+
+# Only the header and the blocks of a window are requested, never a directory listing.
+GDAL_OPTIONS = {'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR', 'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif,.tiff',
+                'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES', 'GDAL_HTTP_MULTIPLEX': 'YES', 'VSI_CACHE': 'TRUE'}
+
+def is_remote(file_name):
+    """Is the surface a URL."""
+    return file_name.startswith(tuple(REMOTE_PREFIXES))
+
+def get_gdal_path(file_name):
+    """Get the path GDAL opens, object storage URLs go through their virtual file system."""
+    for prefix in REMOTE_PREFIXES:
+        if file_name.startswith(prefix) and REMOTE_PREFIXES[prefix]:
+            return REMOTE_PREFIXES[prefix] + file_name[len(prefix):]
+    return file_name
+
+def get_version(file_name):
+    """
+    Get the ETag or the Last-Modified of a remote surface from a one byte request, so a signed URL works too.
+    None for object storage URLs and when the server sends neither.
+    """
+    if not file_name.startswith(('http://', 'https://')):
+        return None
+    request = urllib.request.Request(file_name, headers={'Range': 'bytes=0-0'})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.headers.get('ETag') or response.headers.get('Last-Modified')
+    except (OSError, ValueError) as e:
+        logging.warning('Could not get the version of (%s): %s' % (file_name, e))
+        return None
+
+def get_metric_gsd(img):
+    """Get the average GSD of an open image in meters, None when the units of its CRS are not known."""
+    factor = img.get_unit_factor()
+    if factor is not None:
+        return img.get_avg_gsd() * factor
+    if sg.is_geographic_epsg(img.get_epsg_code()):
+        (_, lat) = img.get_centroid_ground()
+        (pixel_width, pixel_height) = sg.get_metric_pixel_size(img.get_affine(), lat)
+        return (pixel_width + pixel_height) / 2.0
+    return None
+
+def get_overview_level(overviews, native_gsd, gsd):
+    """Get the level of the coarsest overview still as fine as the GSD, None for the full resolution."""
+    level = None
+    for indx, factor in enumerate(overviews):
+        if native_gsd * factor <= gsd * (1.0 + 1e-6):
+            level = indx
+    return level
+
+def get_bounds_window(affine, shape, bounds=None):
+    """
+    Get the rows and columns (start, stop) of a north up image covering the bounds (min x, min y, max x, max y),
+    the whole image without. None when the bounds are outside the image.
+    """
+    (height, width) = shape
+    if bounds is None:
+        return (0, height), (0, width)
+    (min_x, min_y, max_x, max_y) = bounds
+    col_start = max(int(math.floor((min_x - affine[2]) / affine[0])), 0)
+    col_stop = min(int(math.ceil((max_x - affine[2]) / affine[0])), width)
+    row_start = max(int(math.floor((max_y - affine[5]) / affine[4])), 0)
+    row_stop = min(int(math.ceil((min_y - affine[5]) / affine[4])), height)
+    if row_start >= row_stop or col_start >= col_stop:
+        return None
+    return (row_start, row_stop), (col_start, col_stop)
+
+def read_blocks(img, window, cache=None, key_parts=()):
+    """
+    Read a window block by block, so only the blocks it touches are requested.
+    Given a stage cache the blocks are kept locally under the key parts and their position.
+    """
+    ((row_start, row_stop), (col_start, col_stop)) = window
+    (block_height, block_width) = img.block_shape()
+    (height, width) = img.shape()
+    data = None
+    for block_row in range(row_start // block_height, (row_stop - 1) // block_height + 1):
+        for block_col in range(col_start // block_width, (col_stop - 1) // block_width + 1):
+            rows = (block_row * block_height, min((block_row + 1) * block_height, height))
+            cols = (block_col * block_width, min((block_col + 1) * block_width, width))
+            block = None
+            if cache is not None:
+                key = cache.get_key('block', list(key_parts), block_row, block_col)
+                stored = cache.get(key)
+                if stored is not None:
+                    block = stored['block']
+            if block is None:
+                block = img.get_window(rows, cols)
+                if cache is not None:
+                    cache.put(key, block=block)
+            if data is None:
+                data = np.empty((row_stop - row_start, col_stop - col_start), dtype=block.dtype)
+
+            # The part of the block inside the window.
+            top = max(rows[0], row_start)
+            bottom = min(rows[1], row_stop)
+            left = max(cols[0], col_start)
+            right = min(cols[1], col_stop)
+            data[top - row_start:bottom - row_start, left - col_start:right - col_start] = \
+                block[top - rows[0]:bottom - rows[0], left - cols[0]:right - cols[0]]
+    return data
+
+def fetch_surface(file_name, output_path, bounds=None, gsd=None, cache=None):
+    """
+    Read the window of the bounds (in the surface CRS) into a local GeoTIFF, from the coarsest overview still
+    as fine as the GSD (in meters). A remote surface only transfers its header and the blocks of the window,
+    its blocks are cached under its ETag or Last-Modified and not at all without either.
+    Returns if it worked and the local file name.
+    """
+    logging.info('Fetching (%s) bounds %s...' % (file_name, bounds))
+    path = get_gdal_path(file_name)
+    version = None
+    if cache is not None and is_remote(file_name):
+        version = get_version(file_name)
+        if version is None:
+            logging.warning('No ETag or Last-Modified for (%s), its blocks are not cached.' % (file_name))
+    with rasterio.Env(**GDAL_OPTIONS):
+        img = sr.SolarImage()
+        if not img.open_image(path):
+            logging.error('Could not open the surface (%s).' % (file_name))
+            return False, None
+
+        # The overview closest to the GSD.
+        level = None
+        if gsd is not None:
+            native_gsd = get_metric_gsd(img)
+            if native_gsd is None:
+                logging.warning('The units of (%s) are not known, reading the full resolution.' % (file_name))
+            else:
+                level = get_overview_level(img.overviews(), native_gsd, gsd)
+        if level is not None:
+            logging.info('Reading overview level %d' % (level))
+            img.close_image()
+            if not img.open_image(path, overview_level=level):
+                logging.error('Could not open overview level %d of (%s).' % (level, file_name))
+                return False, None
+
+        affine = img.get_affine()
+        window = get_bounds_window(affine, img.shape(), bounds)
+        if window is None:
+            logging.error('The bounds %s are outside the surface (%s).' % (bounds, file_name))
+            img.close_image()
+            return False, None
+        profile = img.profile()
+        # Signed URLs change their query, the blocks of the object don't, until the object itself changes.
+        key_parts = [file_name.split('?')[0], version, level, img.shape(), profile['dtype']]
+        data = read_blocks(img, window, cache if version is not None else None, key_parts)
+        img.close_image()
+
+    ((row_start, row_stop), (col_start, col_stop)) = window
+    profile = dict(profile)
+    for option in ['blockxsize', 'blockysize', 'tiled', 'compress', 'interleave']:
+        profile.pop(option, None)
+    profile.update(driver='GTiff', width=col_stop - col_start, height=row_stop - row_start,
+                   transform=Affine(affine[0], affine[1], affine[2] + col_start * affine[0], affine[3], affine[4],
+                                    affine[5] + row_start * affine[4]))
+    name = os.path.join(output_path, next(tempfile._get_candidate_names()) + '.tif')
+    logging.info('Saving the window %s of (%s) to (%s)' % (window, file_name, name))
+    sr.write_output(name, data, profile)
+
+    return True, name
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""Shadow cube code."""
+
+import json
+import logging
+import numpy as np
+import os
+
+# The number of set bits of every byte.
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+class ShadowCube:
+    """
+    Shadow cube class, a bit packed in shadow mask per time.
+    Each time is a contiguous chunk of the memory mapped cube, the bits run along the rows.
+    """
+
+    def __init__(self):
+        self.cube = None
+        self.valid = None
+        self.times = None
+        self.shape = None
+
+    def create_cube(self, name, times, valid):
+        """Create a cube for the times, valid is the mask of the surface points."""
+        self.times = [float(time) for time in times]
+        self.shape = valid.shape
+        packed_valid = np.packbits(valid, axis=-1)
+        cube_shape = (len(times),) + packed_valid.shape
+        logging.info('Creating shadow cube (%s) of %d times' % (name, len(times)))
+        self.cube = np.lib.format.open_memmap(name + '.npy', mode='w+', dtype=np.uint8, shape=cube_shape)
+        self.valid = np.lib.format.open_memmap(name + '_valid.npy', mode='w+', dtype=np.uint8,
+                                               shape=packed_valid.shape)
+        self.valid[:] = packed_valid
+        self.valid.flush()
+        with open(name + '.json', 'w') as manifest_file:
+            json.dump({'times': self.times, 'shape': [int(size) for size in self.shape]}, manifest_file)
+
+    def open_cube(self, name):
+        """Open an existing cube read only."""
+        if not os.path.exists(name + '.json'):
+            logging.error('No shadow cube (%s)' % (name))
+            return False
+        with open(name + '.json', 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+        self.times = manifest['times']
+        self.shape = tuple(manifest['shape'])
+        self.cube = np.load(name + '.npy', mmap_mode='r')
+        self.valid = np.load(name + '_valid.npy', mmap_mode='r')
+        return True
+
+    def put_shadow(self, time, shadow):
+        """Store the in shadow mask of a time."""
+        indx = self.times.index(float(time))
+        self.cube[indx] = np.packbits(shadow, axis=-1)
+        self.cube.flush()
+
+    def get_shadow(self, indx):
+        """Get the in shadow mask of the time index."""
+        return np.unpackbits(self.cube[indx], axis=-1, count=self.shape[1]).astype(bool)
+
+    def get_weights(self, start, end):
+        """
+        Get the seconds each time stands for between the start and end seconds.
+        A time stands for the half intervals either side of it.
+        """
+        times = np.array(self.times)
+        edges = np.concatenate([[times[0]], (times[1:] + times[:-1]) / 2.0, [times[-1]]])
+        lower = np.clip(edges[:-1], start, end)
+        upper = np.clip(edges[1:], start, end)
+        return upper - lower
+
+    def sun_seconds(self, start, end, rows=slice(None), no_data=-9999):
+        """Get the seconds of direct sun per point between the start and end seconds, optionally for some rows."""
+        weights = self.get_weights(start, end)
+        valid = self.valid[rows]
+        seconds = np.zeros((valid.shape[0], self.shape[1]))
+        for indx in np.nonzero(weights)[0]:
+            sun = np.bitwise_and(np.invert(self.cube[indx][rows]), valid)
+            seconds += weights[indx] * np.unpackbits(sun, axis=-1, count=self.shape[1])
+
+        seconds[np.unpackbits(valid, axis=-1, count=self.shape[1]) == 0] = no_data
+        return seconds
+
+    def region_sun_seconds(self, start, end, region):
+        """Get the mean seconds of direct sun of the valid points in a region mask, by counting the bits."""
+        weights = self.get_weights(start, end)
+        packed_region = np.bitwise_and(np.packbits(region, axis=-1), self.valid)
+        count = int(np.sum(POPCOUNT[packed_region]))
+        if count == 0:
+            return 0.0
+
+        total = 0.0
+        for indx in np.nonzero(weights)[0]:
+            sun = np.bitwise_and(np.invert(self.cube[indx]), packed_region)
+            total += weights[indx] * int(np.sum(POPCOUNT[sun]))
+
+        return total / count
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""Color lookup rendering and web tile code."""
+
+import concurrent.futures
+import logging
+import math
+import numpy as np
+import os
+
+# Solar defined code.
+import solar_rasterio as sr
+
+# The ways the percentage of light can be colored.
+RENDERERS = ['figure', 'lut']
+
+# Entries of the color lookup table and points along a tile side.
+LUT_SIZE = 256
+TILE_SIZE = 256
+
+# The web mercator sphere radius and half the side of its square in meters, and the latitude it reaches.
+MERCATOR_RADIUS = 6378137.0
+MERCATOR_ORIGIN = math.pi * MERCATOR_RADIUS
+MERCATOR_LAT = 85.0511287798
+
+def get_color_lut(color_scheme):
+    """Get the RGBA lookup table of a Matplotlib colormap as bytes."""
+    import matplotlib
+
+    colors = matplotlib.colormaps[color_scheme](np.linspace(0.0, 1.0, LUT_SIZE))
+    return np.round(colors * 255).astype(np.uint8)
+
+def apply_color_lut(data, lut, valid=None, low=0.0, high=100.0):
+    """Color the data from low to high with the lookup table, the invalid points are transparent."""
+    scale = (len(lut) - 1) / float(high - low)
+    index = np.clip((data.astype(np.float32) - low) * scale + 0.5, 0, len(lut) - 1).astype(np.uint8)
+    rgba = lut[index]
+    if valid is not None:
+        rgba[~valid] = 0
+    return rgba
+
+def write_color_image(output_path, base, percentage_light, valid, affine, profile, color_scheme):
+    """Write the colored percentage of light as a PNG with its world file and a RGBA GeoTIFF."""
+    import matplotlib.image
+
+    rgba = apply_color_lut(percentage_light, get_color_lut(color_scheme), valid)
+
+    name = os.path.join(output_path, base + '_light_perc.png')
+    logging.info('Saving color map data (%s)' % (name))
+    matplotlib.image.imsave(name, rgba)
+    sr.write_affine(os.path.join(output_path, base + '_light_perc.pngw'), affine)
+
+    name = os.path.join(output_path, base + '_light_perc_rgba.tif')
+    logging.info('Saving color map data (%s)' % (name))
+    sr.write_color_output(name, rgba, profile)
+
+def get_surface_bounds(shape, affine, crs):
+    """Get the longitude and latitude bounds of a north up surface."""
+    from rasterio.warp import transform_bounds
+
+    (height, width) = shape
+    xs = [affine[2], affine[2] + width * affine[0]]
+    ys = [affine[5], affine[5] + height * affine[4]]
+    return transform_bounds(crs, 'EPSG:4326', min(xs), min(ys), max(xs), max(ys))
+
+def get_tile_range(bounds, zoom):
+    """Get the first and last XYZ tile columns and rows covering the longitude and latitude bounds."""
+    (west, south, east, north) = bounds
+    tiles = 2 ** zoom
+
+    def get_tile(lon, lat):
+        lat = math.radians(min(max(lat, -MERCATOR_LAT), MERCATOR_LAT))
+        x = int((lon + 180.0) / 360.0 * tiles)
+        y = int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * tiles)
+        return min(max(x, 0), tiles - 1), min(max(y, 0), tiles - 1)
+
+    (min_x, min_y) = get_tile(west, north)
+    (max_x, max_y) = get_tile(east, south)
+    return min_x, max_x, min_y, max_y
+
+def get_tile_bounds(x, y, zoom):
+    """Get the web mercator bounds (left, bottom, right, top) of an XYZ tile."""
+    size = 2.0 * MERCATOR_ORIGIN / 2 ** zoom
+    left = -MERCATOR_ORIGIN + x * size
+    top = MERCATOR_ORIGIN - y * size
+    return left, top - size, left + size, top
+
+def render_tile(data, valid, affine, crs, x, y, zoom, lut, tile_size=TILE_SIZE):
+    """
+    Color an XYZ tile from the data, None when it has no valid points.
+    Each tile point takes the nearest surface point, found by projecting its center back to the surface CRS.
+    """
+    from rasterio.warp import transform
+
+    (left, bottom, right, top) = get_tile_bounds(x, y, zoom)
+    step = (right - left) / tile_size
+    centers = (np.arange(tile_size) + 0.5) * step
+    (mx, my) = np.meshgrid(left + centers, top - centers)
+
+    # Web mercator to longitude and latitude, then to the surface.
+    lon = np.degrees(mx / MERCATOR_RADIUS)
+    lat = np.degrees(np.arctan(np.sinh(my / MERCATOR_RADIUS)))
+    (sx, sy) = transform('EPSG:4326', crs, lon.ravel(), lat.ravel())
+    sx = np.asarray(sx) - affine[2]
+    sy = np.asarray(sy) - affine[5]
+    det = affine[0] * affine[4] - affine[1] * affine[3]
+    cols = np.floor((affine[4] * sx - affine[1] * sy) / det).astype(np.int64)
+    rows = np.floor((affine[0] * sy - affine[3] * sx) / det).astype(np.int64)
+
+    (height, width) = data.shape
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    tile_valid = np.zeros(rows.shape, dtype=bool)
+    tile_valid[inside] = valid[rows[inside], cols[inside]]
+    if not tile_valid.any():
+        return None
+    tile_data = np.zeros(rows.shape, dtype=data.dtype)
+    tile_data[tile_valid] = data[rows[tile_valid], cols[tile_valid]]
+
+    shape = (tile_size, tile_size)
+    return apply_color_lut(tile_data.reshape(shape), lut, tile_valid.reshape(shape))
+
+def write_tile(tile_path, data, valid, affine, crs, x, y, zoom, lut, tms=False):
+    """Write a tile as <zoom>/<x>/<y>.png, the rows count up from the south with TMS. Returns if it was written."""
+    import matplotlib.image
+
+    rgba = render_tile(data, valid, affine, crs, x, y, zoom, lut)
+    if rgba is None:
+        return False
+    row = 2 ** zoom - 1 - y if tms else y
+    name = os.path.join(tile_path, str(zoom), str(x), '%d.png' % (row))
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    matplotlib.image.imsave(name, rgba)
+    return True
+
+def write_tiles(tile_path, data, valid, affine, crs, color_scheme, min_zoom, max_zoom, workers, tms=False):
+    """
+    Write the colored tile pyramid of the data from min to max zoom, the tiles are rendered on a pool of threads.
+    Tiles without valid points are skipped. Returns the number of tiles written.
+    """
+    lut = get_color_lut(color_scheme)
+    bounds = get_surface_bounds(data.shape, affine, crs)
+    logging.info('Writing tiles (%s) of zoom %d to %d' % (tile_path, min_zoom, max_zoom))
+
+    count = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for zoom in range(min_zoom, max_zoom + 1):
+            (min_x, max_x, min_y, max_y) = get_tile_range(bounds, zoom)
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    futures.append(pool.submit(write_tile, tile_path, data, valid, affine, crs, x, y, zoom, lut, tms))
+        for x in concurrent.futures.as_completed(futures):
+            count += int(x.result())
+
+    logging.info('Wrote %d tiles' % (count))
+    return count
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+"""Incremental update code."""
+
+import concurrent.futures
+import logging
+import math
+import numpy as np
+import os
+
+# Solar defined code.
+import solar_angle_processor as sa
+import solar_rasterio as sr
+import solar_utility as su
+
+# Elevation changes smaller than this in meters are ignored.
+CHANGE_TOLERANCE = 0.01
+
+# The outputs a previous run must have written (with -f) to be patched.
+OUTPUTS = ['sunrise', 'sunset', 'light_secs', 'light_perc']
+
+def get_changed_mask(surface, previous, no_data, tolerance=CHANGE_TOLERANCE):
+    """Get the points whose elevation or validity changed."""
+    valid = surface != no_data
+    previous_valid = previous != no_data
+    changed = valid != previous_valid
+    both = valid & previous_valid
+    changed[both] = np.abs(surface[both].astype(np.float64) - previous[both]) > tolerance
+    return changed
+
+def get_affected_mask(changed, surface, previous, sun_azimuth, sun_altitude, no_data, pixel_size=1.0, bounded=False):
+    """
+    Get the points a change can affect for a sun position, the changed points and those away from the sun.
+    Any of these can see a different horizon angle, which moves the interpolated crossings.
+    Bounded, only those within the longest shadow the change can cast (from the highest changed
+    elevation, before or after, to the lowest point) are kept, the shadows are exact but as with
+    the bounded search the angle of a lit point is not.
+    """
+    from scipy.ndimage import binary_dilation
+
+    (rotation_angle, pixel_size) = sa.get_pixel_rotation(sun_azimuth, pixel_size)
+    (height, width) = changed.shape
+    length = math.hypot(height, width)
+    if bounded and sun_altitude > 0:
+        top = max(np.amax(surface[changed & (surface != no_data)], initial=no_data),
+                  np.amax(previous[changed & (previous != no_data)], initial=no_data))
+        bottom = min(np.amin(surface[surface != no_data], initial=top),
+                     np.amin(previous[previous != no_data], initial=top))
+        length = min(length, max(top - bottom, 0.0) / math.tan(math.radians(sun_altitude)) / pixel_size)
+
+    # Grow the change by a point to cover the nearest neighbour rotation.
+    grown = binary_dilation(changed, iterations=1)
+
+    # Step away from the sun, the azimuth in the pixel grid is clockwise from up.
+    radians = math.radians(rotation_angle + 180.0)
+    steps = np.arange(0.0, length + 1.0, 0.5)
+    offsets = set(zip(np.round(steps * math.cos(radians)).astype(int),
+                      np.round(-steps * math.sin(radians)).astype(int)))
+
+    affected = grown.copy()
+    for (row_offset, col_offset) in offsets:
+        if abs(row_offset) >= height or abs(col_offset) >= width:
+            continue
+        dst_rows = slice(max(row_offset, 0), height + min(row_offset, 0))
+        src_rows = slice(max(-row_offset, 0), height + min(-row_offset, 0))
+        dst_cols = slice(max(col_offset, 0), width + min(col_offset, 0))
+        src_cols = slice(max(-col_offset, 0), width + min(-col_offset, 0))
+        affected[dst_rows, dst_cols] |= grown[src_rows, src_cols]
+
+    return affected
+
+def process_update(surface, previous, metadata, local_date, sunrise_time, sunset_time, cmap, workers, previous_filename,
+                   horizon=None, bounded=False):
+    """
+    Patch the outputs of a previous run of the previous surface in place.
+    Only the points a change can affect are recomputed, at every time so the crossings are folded as before.
+    """
+    from scipy.ndimage import binary_dilation
+
+    logging.info('Processing update of (%s)...' % (previous_filename))
+    pad_rows = metadata[0]
+    pad_cols = metadata[1]
+    height = metadata[2]
+    width = metadata[3]
+    lat = metadata[4]
+    lon = metadata[5]
+    gsd = metadata[6]
+    no_data = metadata[7]
+    affine = metadata[9]
+    time_zone = metadata[10]
+    increments = metadata[11]
+    output_path = metadata[12]
+
+    # The outputs of the previous run.
+    (_, tail) = os.path.split(previous_filename)
+    (base, _) = os.path.splitext(tail)
+    base += '_' + local_date.isoformat()
+    names = {}
+    for output in OUTPUTS + ['radiation']:
+        names[output] = os.path.join(output_path, base + '_' + output + '.tif')
+    for output in OUTPUTS:
+        if not os.path.exists(names[output]):
+            logging.error('No previous output (%s) to update, it needs a run with -f' % (names[output]))
+            return None
+
+    if surface.shape != previous.shape:
+        logging.error('Surface and previous surface are different sizes')
+        return None
+
+    changed = get_changed_mask(surface, previous, no_data)
+    if not changed.any():
+        su.log('info', 'Nothing changed from (%s)' % (previous_filename), stdout=True)
+        return changed
+
+    # The points any time can affect.
+    times = su.get_processing_times(sunrise_time, sunset_time, increments)
+    affected = np.zeros(surface.shape, dtype=su.get_dtype('mask'))
+    for time in times:
+        (sun_azimuth, sun_altitude) = sa.get_sun_position(time, local_date, time_zone, lat, lon)
+        affected |= get_affected_mask(changed, surface, previous, sun_azimuth, sun_altitude, no_data, gsd, bounded)
+    su.log('info', 'Updating %d changed and %d affected points' % (np.count_nonzero(changed), np.count_nonzero(affected)),
+           stdout=True)
+
+    # The far field horizon from the regional surface.
+    far_fields = {}
+    if horizon is not None:
+        far_fields = sa.get_far_fields(horizon, surface, times, local_date, time_zone, lat, lon, no_data)
+
+    # Only the scan lines through the affected points are computed, grown by a point as the
+    # rotation back takes each point from a neighbour of where it was rotated to.
+    computed = binary_dilation(affected, iterations=1)
+    deltas = []
+    pool = sa.get_pool(workers)
+    futures = []
+    for time in times:
+        futures.append(pool.submit(sa.process_time, time, local_date, time_zone, lat, lon, surface, no_data, gsd,
+                                   computed, far_fields.get(time), bounded))
+    for x in concurrent.futures.as_completed(futures):
+        deltas.append(x.result())
+    deltas.sort(key=lambda tmp: tmp[0])
+
+    (sunrise, sunset) = sa.fold_deltas(deltas, no_data)
+    (sunrise, sunset, light_in_seconds, percentage_light) = sa.get_light_products(sunrise, sunset, surface, times,
+                                                                                  pad_rows, pad_cols, height, width,
+                                                                                  no_data)
+
+    # Patch the affected points of the outputs.
+    mask = sr.clip_padded_image(affected, pad_rows, pad_cols, False)
+    products = {'sunrise': sunrise, 'sunset': sunset, 'light_secs': light_in_seconds, 'light_perc': percentage_light}
+    if os.path.exists(names['radiation']):
+        (success, radiation_data) = sa.get_radiation_product(np.where(mask, sunrise, no_data),
+                                                             np.where(mask, sunset, no_data), sunrise_time,
+                                                             sunset_time, local_date, time_zone, lat, lon, no_data)
+        if success:
+            products['radiation'] = radiation_data
+    for output in products:
+        logging.info('Patching (%s)' % (names[output]))
+        sr.patch_output(names[output], products[output], mask)
+
+    # Color the patched percentage of light.
+    img = sr.SolarImage()
+    if img.open_image(names['light_perc']):
+        sa.get_colormap(output_path, base, local_date.isoformat(), sunrise_time, sunset_time, img.get_bands(1), affine,
+                        cmap)
+        img.close_image()
+
+    return mask
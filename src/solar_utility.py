@@ -5,9 +5,17 @@
 from datetime import datetime, date, time
 import logging
 import numpy as np
-from pysolar.util import get_sunrise_sunset
 import pytz
 
+# The precision policies, the dtype for each kind of data.
+PRECISIONS = {
+    'compact': {'elevation': np.float32, 'angle': np.float32, 'seconds': np.int32,
+                'percentage': np.uint8, 'radiation': np.float32, 'mask': np.bool_, 'aggregate': np.float32},
+    'double': {'elevation': np.float64, 'angle': np.float64, 'seconds': np.float64,
+               'percentage': np.int16, 'radiation': np.float64, 'mask': np.bool_, 'aggregate': np.float64}
+}
+precision = PRECISIONS['compact']
+
 def get_datetime(year, month, day, hour, time_zone):
     """ Get the datetime for the local timezone."""
     local_timezone = pytz.timezone(time_zone)
@@ -38,6 +46,8 @@ def get_time_from_seconds(secs):
 
 def get_sun_rise_set(year, month, day, time_zone, lat, lon):
     """Get the sunrise and sunset given the day and position."""
+    from pysolar.util import get_sunrise_sunset
+
     # Get the date time for noon.
     hour = 12
     local_date_time = get_datetime(year, month, day, hour, time_zone)
@@ -47,15 +57,49 @@ def get_sun_rise_set(year, month, day, time_zone, lat, lon):
 
     return sunrise, sunset
 
-def create_image(shape, value, dtype=np.float):
-    """Create an image with a set size and set to a value."""
-    ele = None
-    if value != 0:
-        ele = np.ones((shape), dtype)
-        ele *= value
-    else:
-        ele = np.zeros((shape), dtype)
-    return ele
+def set_precision(name):
+    """Set the precision policy, compact or double."""
+    global precision
+    precision = PRECISIONS[name]
+    logging.info('Precision policy %s' % (name))
+
+def get_precision():
+    """Get the name of the precision policy."""
+    for name in PRECISIONS:
+        if PRECISIONS[name] is precision:
+            return name
+    return None
+
+def get_dtype(kind, no_data=None):
+    """
+    Get the dtype of a kind of data, e.g. elevation, angle, seconds, percentage, radiation, mask or aggregate.
+    Given the no data value it is held, an integer dtype that can not hold it (e.g. -3.4e38 or -9999.5) is float64.
+    """
+    dtype = precision[kind]
+    if no_data is not None and not can_hold(dtype, no_data):
+        logging.info('The %s dtype can not hold the no data value %s, using float64' % (kind, no_data))
+        return np.float64
+    return dtype
+
+def can_hold(dtype, value):
+    """Can the dtype hold the value exactly, a float dtype holds any value."""
+    if not np.issubdtype(dtype, np.integer):
+        return True
+    limits = np.iinfo(dtype)
+    return float(value).is_integer() and limits.min <= value <= limits.max
+
+def get_no_data(kind, no_data):
+    """Get the no data value of a kind of data, the largest value of an integer dtype that can not hold it."""
+    dtype = precision[kind]
+    if no_data is None or not can_hold(dtype, no_data):
+        return np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else no_data
+    return no_data
+
+def create_image(shape, value, dtype=None):
+    """Create an image with a set size and set to a value, by default of the elevation dtype."""
+    if dtype is None:
+        dtype = get_dtype('elevation')
+    return np.full(shape, value, dtype)
 
 def get_processing_times(sunrise, sunset, increments):
     """Create a list of processing times from sunset to sunrise."""
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""Zonal statistics code."""
+
+import logging
+import numpy as np
+
+# Solar defined code.
+import solar_geospatial as sg
+import solar_rasterio as sr
+
+# The percentiles of each zone.
+PERCENTILES = [25, 50, 75]
+
+def get_zone_labels(zone_file, shape, affine):
+    """
+    Rasterize the zones once into a label image aligned to the surface, zero is no zone.
+    Where zones overlap the later one wins.
+    """
+    features = sg.read_features(zone_file)
+    ids = [feature_id for (feature_id, _) in features]
+    labels = sr.rasterize_features([geometry for (_, geometry) in features], shape, affine)
+    logging.info('Rasterized %d zones covering %d points' % (len(ids), np.count_nonzero(labels)))
+    return ids, labels
+
+def zonal_statistics(labels, data, zones, no_data, percentiles=PERCENTILES):
+    """
+    Get the count, mean, min, max and percentiles of the data per zone.
+    The valid points are sorted by zone then value once, so every statistic is an index into the zone runs.
+    Zones without data have a zero count and no data statistics.
+    """
+    valid = (labels > 0) & (labels <= zones) & (data != no_data)
+    zone = labels[valid]
+    values = data[valid].astype(np.float64)
+    order = np.lexsort((values, zone))
+    zone = zone[order]
+    values = values[order]
+
+    # The runs of each zone in the sorted values.
+    count = np.bincount(zone, minlength=zones + 1)[1:]
+    total = np.bincount(zone, weights=values, minlength=zones + 1)[1:]
+    start = np.concatenate([[0], np.cumsum(count)[:-1]])
+    end = start + count - 1
+    has_data = count > 0
+
+    stats = {'count': count}
+    for name in ['mean', 'min', 'max'] + ['p%d' % (percentile) for percentile in percentiles]:
+        stats[name] = np.full(zones, float(no_data))
+    stats['mean'][has_data] = total[has_data] / count[has_data]
+    stats['min'][has_data] = values[start[has_data]]
+    stats['max'][has_data] = values[end[has_data]]
+
+    # Linear interpolation between the closest ranks, as numpy.percentile.
+    for percentile in percentiles:
+        position = start[has_data] + (count[has_data] - 1) * percentile / 100.0
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        fraction = position - lower
+        stats['p%d' % (percentile)][has_data] = values[lower] + (values[upper] - values[lower]) * fraction
+
+    return stats
+
+def write_zonal_statistics(name, ids, products, percentiles=PERCENTILES):
+    """Write the statistics of the products as a table, a row per zone."""
+    logging.info('Saving zonal statistics (%s)' % (name))
+    names = ['mean', 'min', 'max'] + ['p%d' % (percentile) for percentile in percentiles]
+    columns = ['id']
+    for (product, stats) in products:
+        columns += [product + '_count'] + [product + '_' + stat for stat in names]
+
+    with open(name, 'w') as zonal_file:
+        zonal_file.write(','.join(columns) + '\n')
+        for indx, zone_id in enumerate(ids):
+            row = [str(zone_id)]
+            for (_, stats) in products:
+                row += ['%d' % (stats['count'][indx])] + ['%.2f' % (stats[stat][indx]) for stat in names]
+            zonal_file.write(','.join(row) + '\n')
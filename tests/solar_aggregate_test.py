@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import unittest
+from datetime import date
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+import solar_aggregate as sd
+import solar_angle_processor as sa
+import solar_rasterio as sr
+import solar_utility as su
+
+logging.basicConfig(filename='solar_aggregate_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def test_running_statistics_1(self):
+        no_data = -9999
+        rng = np.random.default_rng(1)
+        days = rng.uniform(20000.0, 50000.0, (30, 8, 9)).astype(np.float32)
+        days[:, 0, 0] = no_data
+        days[::2, 1, 1] = no_data
+        statistics = sd.RunningStatistics()
+        statistics.open_statistics((8, 9), no_data)
+        for day in days:
+            statistics.add(day)
+        stats = statistics.get_statistics()
+        masked = np.ma.masked_equal(days.astype(np.float64), no_data)
+        for (name, expected) in [('sum', masked.sum(axis=0)), ('mean', masked.mean(axis=0)),
+                                 ('min', masked.min(axis=0)), ('max', masked.max(axis=0)),
+                                 ('variance', masked.var(axis=0))]:
+            self.assertEqual(stats[name][0, 0], no_data)
+            self.assertTrue(np.allclose(stats[name][1:, :], expected[1:, :], rtol=1e-5))
+            self.assertTrue(np.allclose(stats[name][0, 1:], expected[0, 1:], rtol=1e-5))
+        self.assertEqual(statistics.count[1, 1], 15)
+
+    def test_running_statistics_2(self):
+        statistics = sd.RunningStatistics()
+        statistics.open_statistics((2, 2), -9999, 4, (0.0, 100.0))
+        for value in [0, 10, 30, 60, 100, 100]:
+            statistics.add(np.full((2, 2), value, dtype=np.uint8), np.array([[True, True], [True, False]]))
+        self.assertEqual(statistics.histogram.shape, (4, 2, 2))
+        self.assertTrue(np.array_equal(statistics.histogram[:, 0, 0], [2, 1, 1, 2]))
+        self.assertTrue(np.array_equal(statistics.histogram[:, 1, 1], [0, 0, 0, 0]))
+
+    def test_daily_aggregate_1(self):
+        no_data = -9999
+        aggregate = sd.DailyAggregate()
+        aggregate.open_aggregate((2, 3), no_data, 5, ['light_secs', 'light_perc'])
+        light = np.array([[3600, 7200, no_data], [0, 36000, 72000]], dtype=np.int32)
+        percentage = np.array([[10, 20, 0], [0, 50, 100]], dtype=np.uint8)
+        aggregate.add_day(light, percentage)
+        aggregate.add_day(np.where(light != no_data, light * 2, no_data), percentage)
+        self.assertEqual(aggregate.days, 2)
+        stats = aggregate.statistics['light_secs'].get_statistics()
+        self.assertEqual(stats['mean'][0, 0], 5400)
+        self.assertEqual(stats['sum'][1, 2], 216000)
+        self.assertEqual(stats['mean'][0, 2], no_data)
+        stats = aggregate.statistics['light_perc'].get_statistics()
+        self.assertEqual(stats['mean'][0, 2], no_data)
+        self.assertEqual(stats['variance'][1, 1], 0)
+        self.assertNotIn('radiation', aggregate.statistics)
+        aggregate.add_day(light, percentage, np.ones((2, 3), dtype=np.float32))
+        self.assertNotIn('radiation', aggregate.statistics)
+
+    def test_write_aggregate_1(self):
+        # The DEM declares a no data value, the histogram counts have none.
+        no_data = -9999
+        aggregate = sd.DailyAggregate()
+        aggregate.open_aggregate((2, 3), no_data, 4, ['light_secs', 'light_perc'])
+        light = np.array([[3600, 7200, no_data], [0, 36000, 72000]], dtype=np.int32)
+        aggregate.add_day(light, np.array([[10, 20, 255], [0, 50, 100]], dtype=np.uint8))
+        profile = {'driver': 'GTiff', 'height': 2, 'width': 3, 'count': 1, 'dtype': 'float32', 'crs': 'EPSG:32610',
+                   'transform': Affine(1.0, 0.0, 550000.0, 0.0, -1.0, 5270000.0), 'nodata': no_data}
+        aggregate.write_aggregate(self.output_path, 'write_aggregate_1', profile)
+        with rasterio.open(os.path.join(self.output_path, 'write_aggregate_1_light_perc_histogram.tif')) as src:
+            self.assertIsNone(src.nodata)
+            self.assertEqual(src.count, 4)
+            self.assertEqual(src.read(1)[0, 0], 1)
+        with rasterio.open(os.path.join(self.output_path, 'write_aggregate_1_light_secs_mean.tif')) as src:
+            self.assertEqual(src.nodata, no_data)
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, 'write_aggregate_1_radiation_mean.tif')))
+
+    def test_get_days_1(self):
+        days = sd.get_days(date(2017, 6, 21), date(2017, 7, 5), 7)
+        self.assertEqual(days, [date(2017, 6, 21), date(2017, 6, 28), date(2017, 7, 5)])
+        self.assertEqual(len(sd.get_days(date(2017, 1, 1), date(2017, 12, 31))), 365)
+
+    def test_process_days_1(self):
+        filename = './tests/data/Patch_DEM.tif'
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        metadata.append('US/Pacific')
+        metadata.append(1)
+        metadata.append(self.output_path)
+        metadata.append(filename)
+        start_date = date(2017, 6, 21)
+        end_date = date(2017, 6, 23)
+        sd.process_days(surface, metadata, start_date, end_date, False, 'jet', 1, 1, 4)
+        img = sr.SolarImage()
+        self.assertTrue(img.open_image('./tests/results/Patch_DEM_2017-06-21_2017-06-23_light_secs_mean.tif'))
+        mean = img.get_bands(1)
+        img.close_image()
+        self.assertTrue(os.path.exists('./tests/results/Patch_DEM_2017-06-21_2017-06-23_light_perc_histogram.tif'))
+        self.assertFalse(os.path.exists('./tests/results/Patch_DEM_2017-06-22_light_perc.png'))
+
+        # The mean of the days run one by one, with few times a point near a shadow edge changes a lot a day.
+        days = []
+        for day in [21, 22, 23]:
+            (sunrise, sunset) = su.get_sun_rise_set(2017, 6, day, 'US/Pacific', metadata[4], metadata[5])
+            days.append(sa.process_surface(surface, metadata, date(2017, 6, day), sunrise, sunset, False, False,
+                                           'jet', 1))
+        light = days[1]
+        expected = np.mean(np.array(days, dtype=np.float64), axis=0)
+        self.assertTrue(np.all(np.abs(mean[light != -9999] - expected[light != -9999]) < 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,17 +2,90 @@
 
 import os
 import logging
+import math
+import shutil
 import unittest
 from datetime import datetime, date, time
 import numpy as np
 import pytz
+import rasterio
 
 import solar_utility as su
 import solar_rasterio as sr
 import solar_angle_processor as sa
+import solar_cache as sk
+import solar_checkpoint as sc
 
 logging.basicConfig(filename='solar_angle_processor_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
 
+def process_column(col_data, no_data, pixel_size=1.0, mask=None, max_elevation=None, altitude=None):
+    """The loop over the points of a column that process_angles replaced, the reference it is checked against."""
+
+    # Get the length of the array.
+    length = len(col_data)
+
+    # Create a bucket for the results array.
+    result = su.create_image((length), no_data, su.get_dtype('angle'))
+
+    # Filter the no data values and record the position.
+    elevation = []
+    position = []
+    for indx in range(length):
+        if col_data[indx] != no_data:
+            elevation.append(col_data[indx])
+            position.append(float(indx))
+
+    # We have nothing to do!
+    if len(elevation) <= 1:
+        logging.debug('Not enough elevations for comparison (%d)', len(elevation))
+        return result
+
+    # Change the values to arrays.
+    elevation = np.array(elevation)
+    position = np.array(position)
+
+    # Create the array of ratios.
+    ratios = su.create_image((length), 0.0, np.float64)
+
+    # The search is bounded by the relief when the sun is up.
+    bounded = max_elevation is not None and altitude is not None and altitude > 0
+    if bounded:
+        tan_altitude = math.tan(math.radians(altitude))
+
+    # Work out the maximum angle.
+    for indx in range(len(elevation) - 1):
+        # Only the requested points are computed.
+        if mask is not None and not mask[int(position[indx])]:
+            continue
+
+        # Reset the angles to zeros.
+        ratios *= 0.0
+
+        # The furthest point that could cast a shadow.
+        end = len(elevation)
+        if bounded:
+            search = (max_elevation - elevation[indx]) / tan_altitude
+            end = np.searchsorted(position, position[indx] + search / pixel_size, side='right')
+
+        # Difference from the reference point, i.
+        delta_ele = elevation[indx+1:end] - elevation[indx]
+        delta_len = (position[indx+1:end] - position[indx]) * pixel_size
+        delta_pos = position[indx]
+        delta_ratio = delta_ele / delta_len
+
+        # Get the angle between the reference and the next.
+        # Does this to the end.
+        for j in range(len(delta_ele)):
+            ratios[j] = delta_ratio[j]
+
+        # Find the max angle position.
+        pos = int(delta_pos)
+        max_ratio = np.amax(ratios)
+        max_angle = math.atan(max_ratio)
+        result[pos] = math.degrees(max_angle)
+
+    return result
+
 class TestAngleProcessor(unittest.TestCase):
 
     def setUp(self):
@@ -21,7 +94,7 @@ class TestAngleProcessor(unittest.TestCase):
     def test_process_column_1(self):
         no_data = -9999
         col_data = su.create_image((50), no_data)
-        angles = sa.process_column(col_data, no_data)
+        angles = sa.process_angles(col_data.reshape((-1, 1)), no_data)[:, 0]
         size = angles.shape
         self.assertEqual(size[0], 50)
         unique_values = np.unique(angles)
@@ -32,7 +105,7 @@ class TestAngleProcessor(unittest.TestCase):
         no_data = -9999
         col_data = su.create_image((50), 2)
         col_data[0] = 1
-        angles = sa.process_column(col_data, no_data)
+        angles = sa.process_angles(col_data.reshape((-1, 1)), no_data)[:, 0]
         size = angles.shape
         self.assertEqual(size[0], 50)
         self.assertEqual(angles[0], 45)
@@ -41,11 +114,116 @@ class TestAngleProcessor(unittest.TestCase):
         no_data = -9999
         col_data = su.create_image((50), 2)
         col_data[10] = 1
-        angles = sa.process_column(col_data, no_data)
+        angles = sa.process_angles(col_data.reshape((-1, 1)), no_data)[:, 0]
         size = angles.shape
         self.assertEqual(size[0], 50)
         self.assertEqual(angles[10], 45)
 
+    def test_process_column_4(self):
+        no_data = -9999
+        col_data = su.create_image((50), 0)
+        col_data[1] = 1
+        col_data[40] = 10
+        angles = sa.process_angles(col_data.reshape((-1, 1)), no_data)[:, 0]
+        self.assertAlmostEqual(angles[0], 45, delta=0.1)
+        self.assertAlmostEqual(angles[6], 16.39, delta=0.1)
+        # Nothing beyond 10m / tan(60) can cast a shadow.
+        angles = sa.process_angles(col_data.reshape((-1, 1)), no_data, max_elevation=10, altitude=60)[:, 0]
+        self.assertAlmostEqual(angles[0], 45, delta=0.1)
+        self.assertEqual(angles[6], 0)
+        self.assertAlmostEqual(angles[35], 63.43, delta=0.1)
+
+    def test_process_angles_pair_1(self):
+        no_data = -9999
+        col_data = su.create_image((50, 1), 2)
+        col_data[0] = 1
+        col_data[20] = no_data
+        col_data[49] = 1
+        (forward, backward) = sa.process_angles_pair(col_data, no_data)
+        self.assertEqual(forward[49][0], no_data)
+        self.assertEqual(backward[0][0], no_data)
+        self.assertEqual(backward[49][0], 45)
+
+        # The same as a scan each way.
+        rng = np.random.RandomState(3)
+        elevation = rng.uniform(100, 120, (40, 30)).astype(np.float32)
+        elevation[rng.uniform(size=(40, 30)) < 0.2] = no_data
+        (forward, backward) = sa.process_angles_pair(elevation, no_data, 0.5)
+        self.assertTrue(np.array_equal(forward, sa.process_angles(elevation, no_data, 0.5)))
+        self.assertTrue(np.array_equal(backward, sa.process_angles(elevation[::-1].copy(), no_data, 0.5)[::-1]))
+
+    def test_pair_times_1(self):
+        tasks = sa.pair_times([10, 20, 30, 40], [90.0, 100.0, 271.0, 200.0], 2.0)
+        self.assertEqual(tasks, [[10, 30], [20], [40]])
+        tasks = sa.pair_times([10, 20, 30, 40], [90.0, 100.0, 271.0, 200.0], 0.0)
+        self.assertEqual(len(tasks), 4)
+
+    def test_process_angles_5(self):
+        no_data = -9999
+        rng = np.random.RandomState(2)
+        elevation = rng.uniform(100, 120, (40, 30)).astype(np.float32)
+        elevation[rng.uniform(size=(40, 30)) < 0.2] = no_data
+        mask = rng.uniform(size=(40, 30)) < 0.3
+        for (col_mask, max_elevation, altitude) in [(None, None, None), (mask, None, None), (None, 120.0, 40.0)]:
+            angles = sa.process_angles(elevation, no_data, 0.5, col_mask, max_elevation, altitude)
+            for col in range(30):
+                expected = process_column(elevation[:, col], no_data, 0.5,
+                                             None if col_mask is None else col_mask[:, col], max_elevation, altitude)
+                self.assertTrue(np.array_equal(angles[:, col], expected))
+
+    def test_get_pool_1(self):
+        pool = sa.get_pool(2, 'thread')
+        self.assertEqual(pool.submit(sum, [1, 2]).result(), 3)
+        pool.shutdown()
+
+    def test_get_pixel_rotation_1(self):
+        self.assertEqual(sa.get_pixel_rotation(135.0, 0.5), (-45.0, 0.5))
+        (rotation_angle, pixel_size) = sa.get_pixel_rotation(90.0, (2.0, 1.0))
+        self.assertAlmostEqual(rotation_angle, -90.0)
+        self.assertAlmostEqual(pixel_size, 2.0)
+        (rotation_angle, pixel_size) = sa.get_pixel_rotation(45.0, (2.0, 1.0))
+        self.assertAlmostEqual(rotation_angle, 26.56505118 - 180.0)
+        self.assertAlmostEqual(pixel_size, 1.26491106)
+        (rotation_angle, pixel_size) = sa.get_pixel_rotation(45.0, (1.0, 1.0))
+        self.assertAlmostEqual(rotation_angle, -135.0)
+        self.assertAlmostEqual(pixel_size, 1.0)
+
+    def test_scale_pixel_size_1(self):
+        self.assertEqual(sa.scale_pixel_size(0.5, 4), 2.0)
+        self.assertEqual(sa.scale_pixel_size((0.5, 0.25), 4), (2.0, 1.0))
+
+    def test_split_columns_1(self):
+        costs = np.array([0.0, 4.0, 4.0, 0.0, 4.0, 4.0, 0.0])
+        columns = sa.split_columns(costs, 2)
+        self.assertEqual([(start, end) for (start, end, _) in columns], [(0, 4), (4, 7)])
+        self.assertEqual(columns[0][2], 8.0)
+        columns = sa.split_columns(costs, 10)
+        self.assertEqual(sum(cost for (_, _, cost) in columns), 16.0)
+        self.assertTrue(all(cost > 0 for (_, _, cost) in columns))
+
+    def test_get_block_count_1(self):
+        self.assertEqual(sa.get_block_count(3, 32), 22)
+        self.assertEqual(sa.get_block_count(64, 32), 1)
+        self.assertEqual(sa.get_block_count(3, 32, 4), 4)
+
+    def test_process_time_block_1(self):
+        no_data = -9999
+        surface = su.create_image((30, 30), 100.0)
+        surface[0:3, :] = no_data
+        surface[15, 10:20] = 110.0
+        local_date = date(2017, 7, 1)
+        (sun_azimuth, _) = sa.get_sun_position(40000, local_date, 'US/Pacific', 47.6, -122.3)
+        costs = sa.get_column_costs(surface, no_data, sa.get_rotation_angle(sun_azimuth), 30.0)
+        self.assertEqual(len(costs), 30)
+        angles = su.create_image((30, 30), no_data, su.get_dtype('angle'))
+        for (start, end, _) in sa.split_columns(costs, 4):
+            (time, first, block) = sa.process_time_block(40000, local_date, 'US/Pacific', 47.6, -122.3, surface,
+                                                         no_data, 0.5, (start, end))
+            self.assertEqual(time, 40000)
+            angles[:, first:first + block.shape[1]] = block
+        rotated = sr.rotate_image(surface, sa.get_rotation_angle(sun_azimuth))
+        self.assertTrue(np.array_equal(angles, sa.process_angles(rotated, no_data, 0.5)))
+
     def test_process_angles_1(self):
         no_data = -9999
         elevation = su.create_image((25, 5), 3.0)
@@ -98,6 +276,104 @@ class TestAngleProcessor(unittest.TestCase):
         self.assertEqual(angle_height, band_height)
         self.assertEqual(angle_width, band_width)
 
+    def test_process_angles_4(self):
+        no_data = -9999
+        elevation = su.create_image((25, 5), 3.0)
+        elevation[0][0] = 1.0
+        elevation[0][2] = 1.0
+        mask = np.zeros(elevation.shape, dtype=bool)
+        mask[0][0] = True
+        angles = sa.process_angles(elevation, no_data, 2.0, mask)
+        self.assertAlmostEqual(angles[0][0], 45, delta=0.1)
+        self.assertEqual(angles[0][2], no_data)
+        self.assertEqual(angles[1][0], no_data)
+
+    def test_get_sky_view_1(self):
+        no_data = -9999
+        hgt = su.create_image((60, 60), 100.0)
+        hgt[:, 20] = 130.0
+        hgt[:, 40] = 130.0
+        hgt[0, 0] = no_data
+        (pad_rows, pad_cols) = sa.get_padding(60, 60)
+        surface = sr.padded_image(hgt, pad_rows, pad_cols, no_data)
+        metadata = [pad_rows, pad_cols, 60, 60, 47.6, -122.3, 1.0, no_data]
+        sky_view = sa.get_sky_view(surface, metadata, 16, 2, 'thread')
+        self.assertEqual(sky_view.shape, (60, 60))
+        self.assertEqual(sky_view[0, 0], no_data)
+
+        # The walls of the canyon, 30 high and 10 away, hide the sky across it.
+        azimuths = np.radians(np.arange(16) * 22.5)
+        expected = 1.0 - np.mean(np.sin(np.arctan(3.0 * np.abs(np.sin(azimuths)))))
+        self.assertAlmostEqual(sky_view[30, 30], expected, delta=0.02)
+        self.assertTrue(sky_view[30, 5] > sky_view[30, 30])
+        self.assertTrue(np.all(sky_view[sky_view != no_data] <= 1.0))
+        self.assertTrue(np.all(sky_view[30, 21:40] < 0.5))
+
+    def test_get_radiation_product_1(self):
+        no_data = -9999
+        local_date = date(2017, 6, 21)
+        (sunrise_time, sunset_time) = su.get_sun_rise_set(2017, 6, 21, 'US/Pacific', 47.6, -122.3)
+        sunrise = np.array([[18000, 36000], [no_data, 18000]], dtype=np.int32)
+        sunset = np.array([[75000, 36000], [no_data, 75000]], dtype=np.int32)
+        (success, direct) = sa.get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date,
+                                                     'US/Pacific', 47.6, -122.3, no_data)
+        self.assertTrue(success)
+        sky_view = np.array([[1.0, 0.5], [0.5, no_data]], dtype=np.float32)
+        (success, total) = sa.get_radiation_product(sunrise, sunset, sunrise_time, sunset_time, local_date,
+                                                    'US/Pacific', 47.6, -122.3, no_data, sky_view)
+        (x_sec, y_rad) = sa.precompute_radiation(sunrise_time, sunset_time, local_date, 'US/Pacific', 47.6, -122.3)
+        diffuse = sa.get_diffuse_radiation(x_sec, y_rad, local_date)
+        self.assertTrue(0.1 < diffuse / direct[0, 0] < 0.2)
+        self.assertAlmostEqual(total[0, 0], direct[0, 0] + diffuse, delta=1.0)
+        self.assertAlmostEqual(total[0, 1], direct[0, 1] + 0.5 * diffuse, delta=1.0)
+        self.assertAlmostEqual(total[1, 0], 0.5 * diffuse, delta=1.0)
+        self.assertEqual(total[1, 1], direct[1, 1])
+
+    def test_get_shadow_boundary_1(self):
+        no_data = -9999
+        delta = su.create_image((10, 10), 20)
+        delta[:, 5:] = -20
+        delta[0][0] = no_data
+        boundary = sa.get_shadow_boundary(delta, no_data, radius=1)
+        self.assertTrue(boundary[3][4])
+        self.assertTrue(boundary[3][5])
+        self.assertFalse(boundary[3][2])
+        self.assertFalse(boundary[3][8])
+        self.assertFalse(boundary[0][0])
+        delta[3][2] = 1
+        boundary = sa.get_shadow_boundary(delta, no_data, radius=1)
+        self.assertTrue(boundary[3][2])
+
+    def test_get_rotation_angle_1(self):
+        self.assertEqual(sa.get_rotation_angle(180.0), 0.0)
+        self.assertEqual(sa.get_rotation_angle(90.0), -90.0)
+
+    def test_process_time_1(self):
+        # The shadow of a block falls to the west in the morning and to the east in the evening.
+        no_data = -9999
+        hgt = su.create_image((30, 30), 100.0)
+        hgt[14:17, 14:17] = 110.0
+        surface = sr.padded_image(hgt, 15, 15, no_data)
+        local_date = date(2017, 6, 21)
+        for (hour, shaded, lit) in [(8, 8, 22), (18, 22, 8)]:
+            secs = su.get_seconds_from_datetime(su.combine_datetime(local_date, hour, 0, 0, 'US/Pacific'))
+            (_, delta) = sa.process_time(secs, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data)
+            delta = sr.clip_padded_image(delta, 15, 15)
+            self.assertTrue(delta[16][shaded] < 0)
+            self.assertTrue(delta[16][lit] >= 0)
+
+    def test_fold_deltas_1(self):
+        # The no data value of a surface is a float, e.g. -9999.0 or the lowest float32.
+        for no_data in [-9999, -9999.0, float(np.finfo(np.float32).min)]:
+            prior = np.array([[-5.0, 5.0], [no_data, -5.0]], dtype=np.float32)
+            now = np.array([[5.0, -5.0], [no_data, -5.0]], dtype=np.float32)
+            (sunrise, sunset) = sa.fold_deltas([[100, prior], [200, now]], no_data)
+            self.assertEqual(sunrise[0][0], 150)
+            self.assertEqual(sunset[0][1], 150)
+            self.assertEqual(sunrise[1][0], no_data)
+            light_secs = sa.compute_light_in_seconds(sunrise, sunset, no_data)
+            self.assertTrue(np.all(light_secs == no_data))
+
     def test_interpolate_1(self):
         local_timezone = pytz.timezone('US/Pacific')
         d = date(2017, 7, 1)
@@ -285,6 +561,127 @@ class TestAngleProcessor(unittest.TestCase):
         self.assertTrue(os.path.exists('./tests/results/Patch_DEM_2017-09-03_light_perc.png'))
         self.assertTrue(os.path.exists('./tests/results/Patch_DEM_2017-09-03_radiation.tif'))
 
+    def test_process_surface_4(self):
+        # The approximate paired deltas and the deltas of the other precision are not reused by an exact run.
+        filename = './tests/data/Patch_DEM.tif'
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 7, 1)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 7, 1, time_zone, metadata[4], metadata[5])
+        metadata.extend([time_zone, 3, './tests/results', filename])
+        path = './tests/results/surface_cache'
+        shutil.rmtree(path, ignore_errors=True)
+        cache = sk.StageCache()
+        cache.open_cache(path)
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1, pair_tolerance=180.0,
+                           cache=cache)
+        entries = set(os.listdir(path))
+        self.assertEqual(len(entries), 2)
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1, cache=cache)
+        self.assertEqual(len(set(os.listdir(path)) - entries), 2)
+        entries = set(os.listdir(path))
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1, cache=cache)
+        self.assertEqual(set(os.listdir(path)), entries)
+        su.set_precision('double')
+        try:
+            sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1, cache=cache)
+        finally:
+            su.set_precision('compact')
+        self.assertEqual(len(set(os.listdir(path)) - entries), 2)
+
+    def test_process_surface_5(self):
+        # Blocks, pairs and whole times share the pool, the blocks assemble to the deltas of whole times.
+        filename = './tests/data/Patch_DEM.tif'
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 7, 1)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 7, 1, time_zone, metadata[4], metadata[5])
+        metadata.extend([time_zone, 3, './tests/results', filename])
+        deltas = []
+        for blocks in [1, 4]:
+            path = './tests/results/blocks_cache_%d' % (blocks)
+            shutil.rmtree(path, ignore_errors=True)
+            cache = sk.StageCache()
+            cache.open_cache(path)
+            sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 2,
+                               pair_tolerance=20.0, cache=cache, blocks=blocks)
+            names = [name for name in os.listdir(path) if cache.get(name[:-4]) is not None and
+                     'deltas' in cache.get(name[:-4])]
+            self.assertEqual(len(names), 1)
+            deltas.append(cache.get(names[0][:-4])['deltas'])
+        self.assertTrue(np.array_equal(deltas[0], deltas[1]))
+
+    def test_process_surface_6(self):
+        # A DEM that declares a no data value the percentage dtype can not hold, written with its own.
+        filename = './tests/results/Patch_DEM_no_data.tif'
+        with rasterio.open('./tests/data/Patch_DEM.tif') as src:
+            profile = src.profile
+            data = src.read(1)
+        data[0:5, 0:5] = -9999
+        profile.update(nodata=-9999)
+        with rasterio.open(filename, 'w', **profile) as dst:
+            dst.write(data, 1)
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        self.assertEqual(metadata[7], -9999)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 8, 2)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 8, 2, time_zone, metadata[4], metadata[5])
+        metadata.extend([time_zone, 3, './tests/results', filename])
+        sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, True, 'hot', 1, progressive=2)
+        for name in ['./tests/results/Patch_DEM_no_data_2017-08-02_light_perc.tif',
+                     './tests/results/Patch_DEM_no_data_2017-08-02_preview_2_light_perc.tif']:
+            with rasterio.open(name) as src:
+                self.assertEqual(src.nodata, 255)
+                percentage = src.read(1)
+            self.assertEqual(percentage.dtype, np.uint8)
+            self.assertTrue((percentage[0:5, 0:5] == 255).all())
+            self.assertTrue((percentage[10:, 10:] <= 100).all())
+
+    def test_process_surface_7(self):
+        # A checkpoint of another surface is not resumed.
+        filename = './tests/data/Patch_DEM.tif'
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 7, 1)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 7, 1, time_zone, metadata[4], metadata[5])
+        metadata.extend([time_zone, 3, './tests/results', filename])
+        expected = sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1)
+        times = su.get_processing_times(sunrise, sunset, 3)
+        checkpoint = sc.SolarCheckpoint()
+        checkpoint.open_checkpoint('./tests/results', 'Patch_DEM_2017-07-01', times, surface.shape,
+                                   su.get_dtype('angle'), 'another surface')
+        checkpoint.put_delta(times[1], su.create_image(surface.shape, 0.0, su.get_dtype('angle')))
+        light = sa.process_surface(surface, metadata, local_date, sunrise, sunset, False, False, 'hot', 1,
+                                   checkpoint=True)
+        self.assertTrue(np.array_equal(light, expected))
+        self.assertFalse(os.path.exists('./tests/results/Patch_DEM_2017-07-01_checkpoint.json'))
+
+    def test_compare_shadows_1(self):
+        filename = './tests/data/Patch_DEM.tif'
+        local_date = date(2017, 7, 1)
+        stats = sa.compare_shadows(filename, filename, 30000, local_date, 'US/Pacific')
+        self.assertEqual(stats, {'differ': 0.0, 'lost': 0.0, 'added': 0.0})
+
+        # The max of 2 by 2 blocks keeps the obstacles, the shadows differ a little along their edges.
+        with rasterio.open(filename) as src:
+            profile = src.profile
+            data = src.read(1)
+        (height, width) = (data.shape[0] // 2, data.shape[1] // 2)
+        coarse = data[:height * 2, :width * 2].reshape(height, 2, width, 2).max(axis=(1, 3))
+        transform = profile['transform']
+        profile.update(height=height, width=width, transform=rasterio.Affine(transform.a * 2, 0.0, transform.c, 0.0,
+                                                                             transform.e * 2, transform.f))
+        coarse_name = './tests/results/Patch_DEM_max_2.tif'
+        with rasterio.open(coarse_name, 'w', **profile) as dst:
+            dst.write(coarse, 1)
+        stats = sa.report_resampling_shadows(filename, coarse_name, [20000, 60000], local_date, 'US/Pacific')
+        self.assertTrue(0.0 < stats['differ'] < 50.0)
+        self.assertAlmostEqual(stats['differ'], stats['lost'] + stats['added'])
+
     def test_clean_given_surface_1(self):
         size = 10
         no_data = -9999
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import unittest
+import numpy as np
+
+import solar_utility as su
+import solar_rasterio as sr
+import solar_benchmark as sb
+
+logging.basicConfig(filename='solar_benchmark_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_get_scaled_surface_1(self):
+        no_data = -9999
+        hgt = su.create_image((6, 8), 5.0)
+        surface = sr.padded_image(hgt, 2, 1, no_data)
+        metadata = [2, 1, 6, 8, 37.5, -122.4, 1.0, no_data]
+        (scaled, scaled_metadata) = sb.get_scaled_surface(surface, metadata, 3)
+        self.assertEqual(scaled_metadata[2:4], [18, 24])
+        self.assertEqual(scaled_metadata[4:], metadata[4:])
+        self.assertEqual(np.count_nonzero(scaled == 5.0), 18 * 24)
+        self.assertEqual(scaled.shape, (18 + 2 * scaled_metadata[0], 24 + 2 * scaled_metadata[1]))
+
+    def test_write_benchmark_1(self):
+        if not os.path.exists('./tests/results'):
+            os.makedirs('./tests/results')
+        rows = [[1, 100, 'process', 2, 3.0], [1, 100, 'thread', 2, 2.0]]
+        sb.write_benchmark('./tests/results/benchmark_1.csv', rows)
+        with open('./tests/results/benchmark_1.csv', 'r') as benchmark_file:
+            lines = benchmark_file.read().splitlines()
+        self.assertEqual(lines[2], '1,100,thread,2,2.000')
+
+if __name__ == '__main__':
+    unittest.main()
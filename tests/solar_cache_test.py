@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import shutil
+import time
+import unittest
+import numpy as np
+
+import solar_cache as sk
+
+logging.basicConfig(filename='solar_cache_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = './tests/results/cache'
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        self.cache = sk.StageCache()
+        self.cache.open_cache(self.path, 1)
+
+    def test_get_key_1(self):
+        surface = np.zeros((10, 10), dtype=np.float32)
+        key = self.cache.get_key('deltas', surface, [1.0, 2.0], None)
+        self.assertEqual(key, self.cache.get_key('deltas', surface.copy(), [1.0, 2.0], None))
+        self.assertNotEqual(key, self.cache.get_key('deltas', surface.astype(np.float64), [1.0, 2.0], None))
+        self.assertNotEqual(key, self.cache.get_key('deltas', surface, [1.0, 2.5], None))
+        surface[3][4] = 1
+        self.assertNotEqual(key, self.cache.get_key('deltas', surface, [1.0, 2.0], None))
+        self.assertNotEqual(self.cache.get_key('block', 1, 10), self.cache.get_key('block', 11, 0))
+        self.assertNotEqual(self.cache.get_key('ab', 'c'), self.cache.get_key('a', 'bc'))
+
+    def test_get_file_key_1(self):
+        key = self.cache.get_file_key('./tests/data/Patch_DEM.tif', 1.0, 32610, 'near')
+        self.assertEqual(key, self.cache.get_file_key('./tests/data/Patch_DEM.tif', 1.0, 32610, 'near'))
+        self.assertNotEqual(key, self.cache.get_file_key('./tests/data/Patch_DEM.tif', 1.0, 32610, 'max'))
+        self.assertNotEqual(key, self.cache.get_file_key('./tests/data/DEM_test.tif', 1.0, 32610, 'near'))
+
+    def test_put_1(self):
+        key = self.cache.get_key('fold', 'a')
+        self.assertEqual(self.cache.get(key), None)
+        sunrise = np.arange(12).reshape((3, 4))
+        self.cache.put(key, sunrise=sunrise, sunset=sunrise + 1)
+        stored = self.cache.get(key)
+        self.assertTrue(np.array_equal(stored['sunrise'], sunrise))
+        self.assertTrue(np.array_equal(stored['sunset'], sunrise + 1))
+
+    def test_evict_1(self):
+        # Three 400KB entries do not fit in 1MB, the least recently used goes.
+        keys = [self.cache.get_key(indx) for indx in range(3)]
+        self.cache.put(keys[0], data=np.zeros(50000))
+        time.sleep(0.05)
+        self.cache.put(keys[1], data=np.zeros(50000))
+        time.sleep(0.05)
+        self.assertTrue(self.cache.get(keys[0]) is not None)
+        time.sleep(0.05)
+        self.cache.put(keys[2], data=np.zeros(50000))
+        self.assertTrue(self.cache.get(keys[0]) is not None)
+        self.assertEqual(self.cache.get(keys[1]), None)
+        self.assertTrue(self.cache.get(keys[2]) is not None)
+
+    def test_put_file_1(self):
+        key = self.cache.get_file_key('./tests/data/Patch_DEM.tif')
+        self.assertEqual(self.cache.get_file(key, '.tif'), None)
+        name = self.cache.put_file(key, './tests/data/Patch_DEM.tif')
+        self.assertEqual(self.cache.get_file(key, '.tif'), name)
+        self.assertEqual(os.path.getsize(name), os.path.getsize('./tests/data/Patch_DEM.tif'))
+
+if __name__ == '__main__':
+    unittest.main()
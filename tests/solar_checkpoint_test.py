@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import unittest
+import numpy as np
+
+import solar_checkpoint as sc
+import solar_utility as su
+
+logging.basicConfig(filename='solar_checkpoint_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        self.times = [18000, 30000.5, 42000]
+        self.shape = (10, 12)
+
+    def test_open_checkpoint_1(self):
+        checkpoint = sc.SolarCheckpoint()
+        self.assertFalse(checkpoint.open_checkpoint(self.output_path, 'checkpoint_1', self.times, self.shape))
+        self.assertEqual(len(checkpoint.completed_times()), 0)
+        self.assertTrue(os.path.exists('./tests/results/checkpoint_1_checkpoint.npy'))
+        self.assertTrue(os.path.exists('./tests/results/checkpoint_1_checkpoint.json'))
+        checkpoint.remove()
+        self.assertFalse(os.path.exists('./tests/results/checkpoint_1_checkpoint.npy'))
+        self.assertFalse(os.path.exists('./tests/results/checkpoint_1_checkpoint.json'))
+
+    def test_resume_1(self):
+        delta = su.create_image(self.shape, 3.5)
+        delta[2][3] = -9999
+        checkpoint = sc.SolarCheckpoint()
+        checkpoint.open_checkpoint(self.output_path, 'checkpoint_2', self.times, self.shape)
+        checkpoint.put_delta(30000.5, delta)
+        checkpoint = sc.SolarCheckpoint()
+        self.assertTrue(checkpoint.open_checkpoint(self.output_path, 'checkpoint_2', self.times, self.shape))
+        self.assertTrue(checkpoint.is_completed(30000.5))
+        self.assertFalse(checkpoint.is_completed(18000))
+        self.assertEqual(checkpoint.completed_times(), [30000.5])
+        self.assertTrue(np.array_equal(checkpoint.get_delta(30000.5), delta))
+        checkpoint.remove()
+
+    def test_resume_2(self):
+        delta = su.create_image(self.shape, 1)
+        checkpoint = sc.SolarCheckpoint()
+        checkpoint.open_checkpoint(self.output_path, 'checkpoint_3', self.times, self.shape)
+        checkpoint.put_delta(18000, delta)
+        checkpoint = sc.SolarCheckpoint()
+        self.assertFalse(checkpoint.open_checkpoint(self.output_path, 'checkpoint_3', self.times[:2], self.shape))
+        self.assertEqual(len(checkpoint.completed_times()), 0)
+        checkpoint.remove()
+
+    def test_resume_3(self):
+        # Only a run of the same inputs and dtype resumes.
+        delta = su.create_image(self.shape, 1)
+        for (dtype, key, resume) in [(np.float32, 'b', False), (np.float64, 'a', False), (np.float32, 'a', True)]:
+            checkpoint = sc.SolarCheckpoint()
+            checkpoint.open_checkpoint(self.output_path, 'checkpoint_4', self.times, self.shape, np.float32, 'a')
+            checkpoint.put_delta(18000, delta)
+            checkpoint = sc.SolarCheckpoint()
+            self.assertEqual(checkpoint.open_checkpoint(self.output_path, 'checkpoint_4', self.times, self.shape,
+                                                        dtype, key), resume)
+            self.assertEqual(checkpoint.is_completed(18000), resume)
+            self.assertEqual(checkpoint.cube.dtype, dtype)
+            checkpoint.remove()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import unittest
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+
+import solar_angle_processor as sa
+import solar_estimate as se
+
+logging.basicConfig(filename='solar_estimate_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestEstimate(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def test_get_padding_1(self):
+        self.assertEqual(sa.get_padding(214, 186), (35, 49))
+        self.assertEqual(sa.get_padding(100, 100), (21, 21))
+
+    def test_load_cost_model_1(self):
+        self.assertEqual(se.load_cost_model(), se.DEFAULT_COST_MODEL)
+        self.assertEqual(se.load_cost_model('./tests/results/missing.json'), se.DEFAULT_COST_MODEL)
+        name = os.path.join(self.output_path, 'cost_model_1.json')
+        with open(name, 'w') as cost_file:
+            json.dump({'time_bytes': 10.0}, cost_file)
+        cost_model = se.load_cost_model(name)
+        self.assertEqual(cost_model['time_bytes'], 10.0)
+        self.assertEqual(cost_model['fold_bytes'], se.DEFAULT_COST_MODEL['fold_bytes'])
+
+    def test_calibrate_1(self):
+        cost_model = se.calibrate([24, 32])
+        self.assertEqual(sorted(cost_model), sorted(se.DEFAULT_COST_MODEL))
+        self.assertEqual(len(cost_model['time_seconds']), 2)
+        for name in ['time_bytes', 'fold_bytes', 'output_bytes', 'fold_seconds', 'output_seconds']:
+            self.assertTrue(cost_model[name] > 0)
+
+    def test_estimate_run_1(self):
+        rows = se.estimate_run(200, 300, 5, 4)
+        self.assertEqual([row[0] for row in rows], ['load', 'times', 'fold', 'output'])
+        (pad_rows, pad_cols) = sa.get_padding(200, 300)
+        padded = (200 + 2 * pad_rows) * (300 + 2 * pad_cols)
+
+        # The deltas of the times are held until the fold.
+        more = se.estimate_run(200, 300, 10, 4)
+        self.assertTrue(more[2][1] - rows[2][1] >= 5 * padded * 4)
+        self.assertTrue(se.get_peak(se.estimate_run(400, 600, 5, 4)) > 3 * se.get_peak(rows))
+
+        # The threads share the surface and the rotations.
+        self.assertTrue(se.estimate_run(200, 300, 5, 4, 'thread')[1][1] < rows[1][1])
+
+        # A running sum per panel.
+        panels = se.estimate_run(200, 300, 5, 4, panel_count=3)
+        self.assertEqual(panels[1][1] - rows[1][1], 3 * padded * 8)
+
+    def test_get_tile_count_1(self):
+        peak = se.get_peak(se.estimate_run(1000, 1000, 5, 2))
+        self.assertEqual(se.get_tile_count(1000, 1000, 5, 2, peak), 1)
+        tiles = se.get_tile_count(1000, 1000, 5, 2, peak / 3.0)
+        self.assertTrue(tiles >= 2)
+        side = 1000 // tiles
+        self.assertTrue(se.get_peak(se.estimate_run(side, side, 5, 2)) <= peak / 3.0)
+        side = 1000 // (tiles - 1)
+        self.assertTrue(se.get_peak(se.estimate_run(side, side, 5, 2)) > peak / 3.0)
+        self.assertIsNone(se.get_tile_count(10, 10, 5, 2, 1.0))
+
+    def test_get_surface_size_1(self):
+        (success, size) = se.get_surface_size('./tests/data/Patch_DEM.tif', 0.1)
+        self.assertTrue(success)
+        self.assertEqual(size[0:2], [214, 186])
+        (success, size) = se.get_surface_size('./tests/data/Patch_DEM.tif', 0.1, bounds=(0.0, 0.0, 1.0, 1.0))
+        self.assertFalse(success)
+
+    def test_get_surface_size_2(self):
+        # A projected surface that is not UTM is warped to the GSD, finer or coarser, in meters.
+        for (epsg_code, x, y, sizes) in [(3857, -13614000.0, 6040000.0, {4.0: 50, 1.0: 200}),
+                                         (2263, 980000.0, 200000.0, {4.0: 16, 0.5: 122})]:
+            name = os.path.join(self.output_path, 'surface_size_%d.tif' % (epsg_code))
+            with rasterio.open(name, 'w', driver='GTiff', height=100, width=100, count=1, dtype='float32',
+                               crs='EPSG:%d' % (epsg_code), transform=Affine(2.0, 0.0, x, 0.0, -2.0, y)) as dst:
+                dst.write(np.zeros((100, 100), dtype=np.float32), 1)
+            for gsd in sizes:
+                (success, size) = se.get_surface_size(name, gsd)
+                self.assertTrue(success)
+                self.assertEqual(size[0:2], [sizes[gsd], sizes[gsd]])
+            os.remove(name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import json
 import logging
+import os
 import unittest
 
-from solar_geospatial import is_valid_utm_epsg, get_utm_zone_and_hemisphere, get_lat_lon, get_utm_epsg_from_epsg
+from solar_geospatial import is_valid_utm_epsg, get_utm_zone_and_hemisphere, get_lat_lon, get_utm_epsg_from_epsg, get_utm_from_lat_lon, read_features, is_geographic_epsg, get_metric_pixel_size
  
 logging.basicConfig(filename='solar_geospatial_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
 
@@ -57,6 +59,16 @@ class TestGeospatial(unittest.TestCase):
         self.assertAlmostEqual(lat, -33.0877144, places=3)
         self.assertAlmostEqual(lon, 134.5967937, places=3)
 
+    def test_get_utm_from_lat_lon_1(self):
+        (easting, northing) = get_utm_from_lat_lon(32638, 33.33, 44.4)
+        self.assertAlmostEqual(easting, 444160, delta=50)
+        self.assertAlmostEqual(northing, 3688032, delta=50)
+
+    def test_get_utm_from_lat_lon_2(self):
+        (easting, northing) = get_utm_from_lat_lon(4356, 33.33, 44.4)
+        self.assertEqual(easting, None)
+        self.assertEqual(northing, None)
+
     def test_get_utm_from_epsg_1(self):
         lat = 37.42104680
         lon = -122.11992745
@@ -69,5 +81,43 @@ class TestGeospatial(unittest.TestCase):
         utm_epsg = get_utm_epsg_from_epsg(4326, lon, lat)
         self.assertEqual(utm_epsg, 32710)
 
+    def test_is_geographic_epsg_1(self):
+        self.assertTrue(is_geographic_epsg(4326))
+        self.assertFalse(is_geographic_epsg(32610))
+
+    def test_get_lat_lon_4(self):
+        (lat, lon) = get_lat_lon(4326, -122.383, 37.5)
+        self.assertEqual(lat, 37.5)
+        self.assertEqual(lon, -122.383)
+
+    def test_get_metric_pixel_size_1(self):
+        # An arc second at the equator and at 60 degrees.
+        affine = [1.0 / 3600.0, 0.0, 0.0, 0.0, -1.0 / 3600.0, 0.0]
+        (width, height) = get_metric_pixel_size(affine, 0.0)
+        self.assertAlmostEqual(width, 30.92, places=2)
+        self.assertAlmostEqual(height, 30.72, places=2)
+        (width, height) = get_metric_pixel_size(affine, 60.0)
+        self.assertAlmostEqual(width, 15.50, places=2)
+        self.assertAlmostEqual(height, 30.95, places=2)
+
+    def test_read_features_1(self):
+        if not os.path.exists('./tests/results'):
+            os.makedirs('./tests/results')
+        name = './tests/results/features_1.geojson'
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'id': 'panel'}, 'geometry': {'type': 'Point', 'coordinates': [1.0, 2.0]}},
+            {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Point', 'coordinates': [3.0, 4.0]}},
+            {'type': 'Feature', 'properties': {}, 'geometry': None}]}
+        with open(name, 'w') as geojson_file:
+            json.dump(collection, geojson_file)
+        features = read_features(name)
+        self.assertEqual(len(features), 2)
+        self.assertEqual(features[0][0], 'panel')
+        self.assertEqual(features[1][0], 2)
+        self.assertEqual(features[1][1]['coordinates'], [3.0, 4.0])
+
+    def test_read_features_2(self):
+        self.assertEqual(read_features('./tests/data/missing.geojson'), [])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import unittest
+import numpy as np
+
+import solar_horizon as sh
+
+logging.basicConfig(filename='solar_horizon_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestHorizon(unittest.TestCase):
+
+    def setUp(self):
+        # A ridge 1500m to the east of the site.
+        self.horizon = sh.FarFieldHorizon()
+        self.horizon.elevation = np.zeros((200, 200))
+        self.horizon.elevation[:, 150] = 500.0
+        self.horizon.row = 100
+        self.horizon.col = 100
+        self.horizon.gsd = 30.0
+        self.horizon.no_data = -9999
+        self.horizon.start_distance = 300.0
+
+    def test_get_profile_1(self):
+        (distances, elevations) = self.horizon.get_profile(90.0)
+        self.assertAlmostEqual(distances[0], 300.0)
+        self.assertAlmostEqual(np.amax(elevations), 500.0, delta=0.5)
+
+    def test_get_far_field_1(self):
+        (levels, angles) = self.horizon.get_far_field(90.0, 0.0, 100.0)
+        self.assertEqual(levels[0], 0.0)
+        self.assertEqual(levels[-1], 100.0)
+        self.assertAlmostEqual(angles[0], math.degrees(math.atan(500.0 / 1500.0)), delta=0.1)
+        self.assertLess(angles[-1], angles[0])
+
+    def test_get_far_field_2(self):
+        (_, angles) = self.horizon.get_far_field(270.0, 0.0, 100.0)
+        self.assertEqual(np.amax(angles), 0.0)
+
+    def test_apply_far_field_1(self):
+        no_data = -9999
+        far_field = self.horizon.get_far_field(90.0, 0.0, 100.0)
+        delta = np.array([[10.0, no_data], [30.0, 40.0]])
+        surface = np.array([[0.0, 0.0], [no_data, 100.0]])
+        delta = sh.apply_far_field(delta, surface, 20.0, far_field, no_data)
+        self.assertLess(delta[0][0], 2.0)
+        self.assertEqual(delta[0][1], no_data)
+        self.assertEqual(delta[1][0], 30.0)
+        self.assertLess(delta[1][1], 40.0)
+
+if __name__ == '__main__':
+    unittest.main()
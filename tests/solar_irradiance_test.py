@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import logging
+import math
+import unittest
+from datetime import date
+import numpy as np
+from pysolar.solar import radiation
+
+import solar_angle_processor as sa
+import solar_irradiance as si
+import solar_rasterio as sr
+import solar_utility as su
+
+logging.basicConfig(filename='solar_irradiance_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestIrradiance(unittest.TestCase):
+
+    def setUp(self):
+        self.no_data = -9999
+        self.local_date = date(2017, 12, 21)
+        self.time_zone = 'US/Pacific'
+        self.lat = 47.6
+        self.lon = -122.3
+        (self.sunrise, self.sunset) = su.get_sun_rise_set(2017, 12, 21, self.time_zone, self.lat, self.lon)
+
+    def get_irradiance(self, hgt, increments, reverse=False, panels=None, sky_view=None):
+        (pad_rows, pad_cols) = sa.get_padding(*hgt.shape)
+        surface = sr.padded_image(hgt, pad_rows, pad_cols, self.no_data)
+        times = su.get_processing_times(self.sunrise, self.sunset, increments)
+        irradiance = si.SolarIrradiance()
+        irradiance.open_irradiance(surface, self.no_data, 1.0, times, self.local_date, self.time_zone, self.lat,
+                                   self.lon, panels)
+        for time in (times[::-1] if reverse else times):
+            (_, delta) = sa.process_time(time, self.local_date, self.time_zone, self.lat, self.lon, surface,
+                                         self.no_data)
+            irradiance.add_time(time, delta)
+        self.assertEqual(irradiance.steps, len(times))
+        return irradiance.get_irradiance(pad_rows, pad_cols, sky_view)
+
+    def test_get_time_weights_1(self):
+        weights = si.get_time_weights([100, 200, 400])
+        self.assertTrue(np.array_equal(weights, [50, 150, 100]))
+        self.assertEqual(np.sum(weights), 300)
+        self.assertTrue(np.array_equal(si.get_time_weights([100]), [0]))
+
+    def test_get_surface_normals_1(self):
+        # Rising one meter a row to the north, so the surface faces south at 45 degrees.
+        hgt = np.array([[3.0, 3.0, 3.0], [2.0, 2.0, 2.0], [1.0, 1.0, 1.0]])
+        (east, north, up) = si.get_surface_normals(hgt, self.no_data, 1.0)
+        self.assertAlmostEqual(east[1, 1], 0.0)
+        self.assertAlmostEqual(north[1, 1], -math.sqrt(0.5))
+        self.assertAlmostEqual(up[1, 1], math.sqrt(0.5))
+        hgt[0, 1] = self.no_data
+        (east, north, up) = si.get_surface_normals(hgt, self.no_data, (2.0, 1.0))
+        self.assertEqual(up[1, 1], 1.0)
+
+    def test_solar_irradiance_1(self):
+        hgt = su.create_image((30, 30), 100.0)
+        for row in range(30):
+            hgt[row, :10] = 100.0 + (30 - row) * 0.5
+        irradiance = self.get_irradiance(hgt, 40)
+
+        # A flat point sees the direct beam on the horizontal.
+        start = su.get_seconds_from_datetime(self.sunrise)
+        end = su.get_seconds_from_datetime(self.sunset)
+        seconds = np.arange(start, end, 60.0)
+        beam = []
+        for time in seconds:
+            (_, altitude) = sa.get_sun_position(time, self.local_date, self.time_zone, self.lat, self.lon)
+            (h, m, s) = su.get_time_from_seconds(time)
+            local_datetime = su.combine_datetime(self.local_date, h, m, int(s), self.time_zone)
+            beam.append(radiation.get_radiation_direct(local_datetime, altitude) * math.sin(math.radians(altitude))
+                        if altitude > 0 else 0.0)
+        expected = np.trapz(beam, seconds) / 3600
+        self.assertAlmostEqual(irradiance[15, 25] / expected, 1.0, delta=0.01)
+
+        # The slope facing the low winter sun gets more.
+        self.assertTrue(irradiance[15, 4] > 2.0 * irradiance[15, 25])
+
+        # The times can come in any order.
+        self.assertTrue(np.allclose(self.get_irradiance(hgt, 40, True), irradiance))
+
+    def test_solar_irradiance_2(self):
+        # A pole shades the point north of it around noon only, its sunrise and sunset are unchanged.
+        hgt = su.create_image((30, 30), 100.0)
+        hgt[20, 15] = 110.0
+        irradiance = self.get_irradiance(hgt, 20)
+        self.assertTrue(0.0 < irradiance[15, 15] < 0.9 * irradiance[15, 5])
+        self.assertAlmostEqual(irradiance[25, 15], irradiance[15, 5], delta=1.0)
+
+    def test_get_panel_normals_1(self):
+        normals = si.get_panel_normals([(0.0, 180.0), (90.0, 180.0), (90.0, 90.0)])
+        self.assertEqual(normals.shape, (3, 3))
+        self.assertTrue(np.allclose(normals, [[0.0, 0.0, 1.0], [0.0, -1.0, 0.0], [1.0, 0.0, 0.0]]))
+
+    def test_panel_irradiance_1(self):
+        hgt = su.create_image((30, 30), 100.0)
+        hgt[20, 15] = 110.0
+        panels = [(0.0, 180.0), (60.0, 180.0), (60.0, 0.0)]
+        irradiance = self.get_panel_irradiance(hgt, panels)
+        self.assertEqual(irradiance.shape, (3, 30, 30))
+
+        # A flat panel is the flat surface with its open sky, a panel facing the low winter sun gets more and
+        # one facing away gets the diffuse radiation only.
+        flat = self.get_irradiance(hgt, 20)
+        sky = np.ones((30, 30))
+        diffuse = self.get_irradiance(hgt, 20, sky_view=sky) - flat
+        self.assertTrue(np.allclose(irradiance[0, 5:10, 5:10], flat[5:10, 5:10] + diffuse[5:10, 5:10]))
+        self.assertTrue(np.all(irradiance[1, 5:10, 5:10] > 2.0 * irradiance[0, 5:10, 5:10]))
+        self.assertTrue(np.allclose(irradiance[2, 5:10, 5:10], 0.75 * diffuse[5:10, 5:10]))
+
+        # The pole shades the panels north of it, and each panel is the same as on its own.
+        self.assertTrue(irradiance[1, 15, 15] < 0.9 * irradiance[1, 15, 5])
+        self.assertTrue(np.allclose(self.get_panel_irradiance(hgt, panels[1:2])[0], irradiance[1]))
+
+    def get_panel_irradiance(self, hgt, panels):
+        return self.get_irradiance(hgt, 20, panels=panels)
+
+if __name__ == '__main__':
+    unittest.main()
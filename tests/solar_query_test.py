@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import unittest
+from datetime import date
+import numpy as np
+
+import solar_utility as su
+import solar_angle_processor as sa
+import solar_query as sq
+import solar_rasterio as sr
+
+logging.basicConfig(filename='solar_query_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def test_query_time_1(self):
+        no_data = -9999
+        surface = su.create_image((40, 40), 100.0)
+        surface[0:5, :] = no_data
+        surface[20, 18:22] = 110.0
+        surface[30, 5] = 140.0
+        local_date = date(2017, 7, 1)
+        rows = np.array([10, 19, 21, 25, 29, 2])
+        cols = np.array([20, 20, 20, 7, 5, 2])
+        for time in [30000, 45000, 60000]:
+            (_, delta) = sa.process_time(time, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data, 0.5)
+            (_, query) = sq.query_time(time, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data, rows, cols, 0.5)
+            self.assertTrue(np.array_equal(query, delta[rows, cols]))
+
+        # Only the query pixels and their columns are rotated, not the whole surface.
+        sr.rotation_cache.clear()
+        (_, query) = sq.query_time(45000, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data, rows, cols, 0.5)
+        self.assertEqual(len(sr.rotation_cache), 0)
+
+    def test_get_query_pixels_1(self):
+        metadata = [3, 4, 10, 20, 0, 0, 1.0, -9999, None, [2.0, 0.0, 1000.0, 0.0, -2.0, 5000.0]]
+        features = [('a', {'type': 'Point', 'coordinates': [1005.0, 4991.0]}),
+                    ('b', {'type': 'Point', 'coordinates': [900.0, 4991.0]})]
+        queries = sq.get_query_pixels(features, metadata)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0][0], 'a')
+        self.assertEqual(queries[0][2][0], 4 + 3)
+        self.assertEqual(queries[0][3][0], 2 + 4)
+
+    def test_process_query_1(self):
+        filename = './tests/data/Patch_DEM.tif'
+        (success, surface, metadata) = sa.load_surface(filename)
+        self.assertTrue(success)
+        affine = metadata[9]
+        x = affine[2] + 50.5 * affine[0]
+        y = affine[5] + 60.5 * affine[4]
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'id': 'point'}, 'geometry': {'type': 'Point', 'coordinates': [x, y]}},
+            {'type': 'Feature', 'properties': {'id': 'polygon'}, 'geometry': {'type': 'Polygon', 'coordinates': [[
+                [x, y], [x + 10 * affine[0], y], [x + 10 * affine[0], y + 10 * affine[4]], [x, y + 10 * affine[4]],
+                [x, y]]]}}]}
+        query_file = './tests/results/query_1.geojson'
+        with open(query_file, 'w') as geojson_file:
+            json.dump(collection, geojson_file)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 7, 1)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 7, 1, time_zone, metadata[4], metadata[5])
+        metadata.append(time_zone)
+        metadata.append(1)
+        metadata.append(self.output_path)
+        metadata.append(filename)
+        results = sq.process_query(surface, metadata, local_date, sunrise, sunset, query_file, 1)
+        self.assertTrue(os.path.exists('./tests/results/Patch_DEM_2017-07-01_query.csv'))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], 'point')
+        self.assertEqual(results[0][2], 1)
+        self.assertTrue(results[1][2] > 50)
+        self.assertTrue(0 <= results[1][6] <= 100)
+
+    def test_process_query_2(self):
+        # The radiation of the query points is that of the whole surface, with the diffuse radiation.
+        no_data = -9999
+        hgt = su.create_image((40, 40), 100.0)
+        hgt[20, 18:22] = 110.0
+        hgt[30, 5] = 140.0
+        (pad_rows, pad_cols) = sa.get_padding(40, 40)
+        surface = sr.padded_image(hgt, pad_rows, pad_cols, no_data)
+        time_zone = 'US/Pacific'
+        local_date = date(2017, 7, 1)
+        (lat, lon) = (47.6, -122.3)
+        (sunrise, sunset) = su.get_sun_rise_set(2017, 7, 1, time_zone, lat, lon)
+        affine = [1.0, 0.0, 1000.0, 0.0, -1.0, 5000.0]
+        metadata = [pad_rows, pad_cols, 40, 40, lat, lon, 1.0, no_data, None, affine, time_zone, 3, self.output_path,
+                    'query_2.tif']
+        points = [(21, 20), (31, 5), (10, 10)]
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'id': str(indx)}, 'geometry': {'type': 'Point', 'coordinates': [
+                1000.5 + col, 4999.5 - row]}} for (indx, (row, col)) in enumerate(points)]}
+        query_file = './tests/results/query_2.geojson'
+        with open(query_file, 'w') as geojson_file:
+            json.dump(collection, geojson_file)
+        sky_view = sa.get_sky_view(surface, metadata, 8, 1)
+        results = sq.process_query(surface, metadata, local_date, sunrise, sunset, query_file, 1, radiation=True,
+                                   sky_view=sky_view)
+        with open('./tests/results/query_2_2017-07-01_query.csv', 'r') as csv_file:
+            self.assertTrue(csv_file.readline().strip().endswith(',radiation'))
+
+        times = su.get_processing_times(sunrise, sunset, 3)
+        deltas = [sa.process_time(time, local_date, time_zone, lat, lon, surface, no_data) for time in times]
+        (rise, fall) = sa.fold_deltas(deltas, no_data)
+        (rise, fall, _, _) = sa.get_light_products(rise, fall, surface, times, pad_rows, pad_cols, 40, 40, no_data)
+        (success, radiation) = sa.get_radiation_product(rise, fall, sunrise, sunset, local_date, time_zone, lat, lon,
+                                                        no_data, sky_view)
+        self.assertTrue(success)
+        self.assertEqual(len(results), 3)
+        for (indx, (row, col)) in enumerate(points):
+            self.assertAlmostEqual(results[indx][7], float(radiation[row][col]), places=3)
+        # The point beside the wall sees less of the sun and the sky.
+        self.assertTrue(results[0][7] < results[2][7])
+
+if __name__ == '__main__':
+    unittest.main()
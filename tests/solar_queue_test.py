@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import logging
+import math
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import time
+import unittest
+from datetime import date
+import numpy as np
+
+import solar_utility as su
+import solar_angle_processor as sa
+import solar_queue as sw
+
+logging.basicConfig(filename='solar_queue_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def get_queue_path(self, name):
+        queue_path = os.path.join(self.output_path, name)
+        shutil.rmtree(queue_path, ignore_errors=True)
+        os.makedirs(queue_path)
+        return queue_path
+
+    def get_surface(self):
+        no_data = -9999
+        surface = su.create_image((40, 40), 100.0)
+        surface[0:5, :] = no_data
+        surface[20, 18:22] = 110.0
+        surface[30, 5] = 140.0
+        return surface, no_data
+
+    def test_claim_task_1(self):
+        connection = sw.open_queue(self.get_queue_path('queue_1'))
+        task_id = sw.put_task(connection, pickle.dumps((math.sqrt, (4.0,), {})))
+        self.assertEqual(sw.claim_task(connection, 'a', 0.2)[0], task_id)
+        self.assertIsNone(sw.claim_task(connection, 'b', 0.2))
+        self.assertTrue(sw.renew_lease(connection, task_id, 'a', 0.2))
+        self.assertFalse(sw.renew_lease(connection, task_id, 'b', 0.2))
+
+        # Worker a stops renewing, so b takes the task over.
+        time.sleep(0.3)
+        self.assertEqual(sw.claim_task(connection, 'b', 0.2)[0], task_id)
+        self.assertFalse(sw.complete_task(connection, task_id, 'a', b''))
+        self.assertTrue(sw.complete_task(connection, task_id, 'b', b''))
+        self.assertIsNone(sw.claim_task(connection, 'c', 0.2))
+        connection.close()
+
+    def test_claim_task_2(self):
+        connection = sw.open_queue(self.get_queue_path('queue_2'))
+        task_id = sw.put_task(connection, pickle.dumps((math.sqrt, (4.0,), {})))
+        for attempt in range(sw.MAX_ATTEMPTS):
+            self.assertEqual(sw.claim_task(connection, 'a', 0.0)[0], task_id)
+        self.assertIsNone(sw.claim_task(connection, 'a', 0.0))
+        (state, result) = connection.execute('SELECT state, result FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        self.assertEqual(state, 'failed')
+        self.assertIsInstance(pickle.loads(result), RuntimeError)
+        connection.close()
+
+    def test_store_arrays_1(self):
+        queue_path = self.get_queue_path('queue_3')
+        a = np.arange(12.0).reshape(3, 4)
+        names = {}
+        value = sw.store_arrays([1, (a, None, a), np.ones(2, dtype=np.int32)], queue_path, 'array', names)
+        self.assertEqual(len(names), 2)
+        self.assertEqual(value[1][0].name, value[1][2].name)
+        self.assertEqual(len(sw.get_array_names(value)), 3)
+        loaded = sw.load_arrays(value, queue_path, 'r')
+        self.assertIsInstance(loaded[1][0], np.memmap)
+        self.assertTrue(np.array_equal(loaded[1][2], a))
+        self.assertIsNone(loaded[1][1])
+        self.assertEqual(loaded[2].dtype, np.int32)
+
+    def test_queue_executor_1(self):
+        (surface, no_data) = self.get_surface()
+        local_date = date(2017, 7, 1)
+        times = [30000, 45000, 60000]
+        pool = sw.QueueExecutor(self.get_queue_path('queue_4'), 2, poll=0.05)
+        futures = {}
+        for time_secs in times:
+            futures[pool.submit(sa.process_time, time_secs, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data,
+                                0.5)] = time_secs
+        failed = pool.submit(math.sqrt, -1.0)
+        for x in concurrent.futures.as_completed(futures):
+            (time_secs, delta) = x.result()
+            self.assertEqual(time_secs, futures[x])
+            (_, expected) = sa.process_time(time_secs, local_date, 'US/Pacific', 47.6, -122.3, surface, no_data, 0.5)
+            self.assertTrue(np.array_equal(delta, expected))
+        self.assertIsInstance(failed.exception(), ValueError)
+        pool.shutdown()
+
+        # The queue stays for the next pool, the tasks and arrays of the session are gone.
+        queue_path = os.path.join(self.output_path, 'queue_4')
+        connection = sw.open_queue(queue_path)
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM tasks').fetchone()[0], 0)
+        connection.close()
+        self.assertEqual(os.listdir(os.path.join(queue_path, sw.ARRAYS_DIR)), [])
+        self.assertEqual(os.listdir(os.path.join(queue_path, sw.RESULTS_DIR)), [])
+
+    def test_run_worker_1(self):
+        # Workers started on their own, as on other nodes, pointed at the same directory serve every pool of
+        # the run and stop when the run closes the queue.
+        (surface, no_data) = self.get_surface()
+        queue_path = self.get_queue_path('queue_5')
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.abspath('./src')] + env.get('PYTHONPATH', '').split(os.pathsep))
+        workers = [subprocess.Popen([sys.executable, os.path.abspath('./src/solar_queue.py'), '-q',
+                                     os.path.abspath(queue_path)], cwd=self.output_path, env=env) for _ in range(2)]
+        columns = sa.split_columns(np.ones(40), 4)
+        for time_secs in [45000, 50000]:
+            pool = sw.QueueExecutor(queue_path, 0, poll=0.05)
+            try:
+                futures = [pool.submit(sa.process_time_block, time_secs, date(2017, 7, 1), 'US/Pacific', 47.6,
+                                       -122.3, surface, no_data, 0.5, (start, end)) for (start, end, _) in columns]
+                results = [x.result(timeout=60) for x in futures]
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+            pool.shutdown()
+            self.assertEqual([result[1] for result in results], [start for (start, _, _) in columns])
+            self.assertEqual(sum(result[2].shape[1] for result in results), surface.shape[1])
+            for worker in workers:
+                self.assertIsNone(worker.poll())
+        sw.close_queue(queue_path)
+        for worker in workers:
+            self.assertEqual(worker.wait(timeout=60), 0)
+
+    def test_queue_executor_2(self):
+        # Two runs share the directory, neither takes the tasks or results of the other.
+        queue_path = self.get_queue_path('queue_6')
+        first = sw.QueueExecutor(queue_path, 1, poll=0.05)
+        first_futures = [first.submit(math.sqrt, value) for value in [4.0, 9.0, 16.0]]
+        second = sw.QueueExecutor(queue_path, 1, poll=0.05)
+        second_futures = [second.submit(math.pow, value, 2.0) for value in [4.0, 9.0, 16.0]]
+        self.assertEqual([x.result(timeout=60) for x in first_futures], [2.0, 3.0, 4.0])
+        self.assertEqual([x.result(timeout=60) for x in second_futures], [16.0, 81.0, 256.0])
+        first.shutdown()
+        second.shutdown()
+
+    def test_run_task_1(self):
+        # The task carries the precision policy of its session.
+        queue_path = self.get_queue_path('queue_7')
+        for directory in [sw.ARRAYS_DIR, sw.RESULTS_DIR]:
+            os.makedirs(os.path.join(queue_path, directory))
+        try:
+            result = sw.run_task(queue_path, 1, pickle.dumps((su.get_precision, (), {}, 'double')))
+            self.assertEqual(result, 'double')
+        finally:
+            su.set_precision('compact')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import logging
+import numpy as np
 import os
 import unittest
 
@@ -113,6 +114,51 @@ class TestRaster(unittest.TestCase):
         self.assertAlmostEqual(padded[107][107], rotated[107][107], delta=1)
         self.assertAlmostEqual(padded[0][107], rotated[107][0], delta=1)
 
+    def test_downsample_image_1(self):
+        image = np.ones((5, 6)) * 4.0
+        image[0][0] = 0.0
+        image[4][4:] = -9999
+        down = sr.downsample_image(image, 2, no_data=-9999)
+        self.assertEqual(down.shape, (3, 3))
+        self.assertEqual(down[0][0], 3.0)
+        self.assertEqual(down[1][1], 4.0)
+        self.assertEqual(down[2][2], -9999)
+
+    def test_upsample_image_1(self):
+        image = np.arange(6.0).reshape((2, 3))
+        up = sr.upsample_image(image, 2, (5, 7), no_data=-9999)
+        self.assertEqual(up.shape, (5, 7))
+        self.assertEqual(up[1][1], 0.0)
+        self.assertEqual(up[3][5], 5.0)
+        self.assertEqual(up[4][0], -9999)
+        self.assertEqual(up[0][6], -9999)
+
+        # The seconds of a sunrise, rasterio gives the no data value as a float.
+        up = sr.upsample_image(np.arange(6, dtype=np.int32).reshape((2, 3)), 2, (5, 7), no_data=-9999.0)
+        self.assertEqual(up.dtype, np.int32)
+        self.assertEqual(up[4][0], -9999)
+
+    def test_rotate_image_3(self):
+        image = np.arange(49.0).reshape((7, 7))
+        rotated = sr.rotate_image(image, 90.0, no_data=-9999)
+        self.assertTrue(np.array_equal(rotated, np.rot90(image)))
+        restored = sr.rotate_image(rotated, -90.0, no_data=-9999)
+        self.assertTrue(np.array_equal(restored, image))
+
+    def test_get_rotation_indices_1(self):
+        indices = sr.get_rotation_indices((9, 11), 30.004)
+        self.assertIs(sr.get_rotation_indices((9, 11), 30.0), indices)
+        self.assertIn(((9, 11), -3000), sr.rotation_cache)
+        self.assertEqual(indices.shape, (9, 11))
+        self.assertEqual(indices[0][0], 99)
+
+    def test_get_rotation_sources_1(self):
+        indices = sr.compute_rotation_indices((9, 11), 30.0)
+        rows = np.array([0, 4, 8, 2])
+        cols = np.array([0, 5, 10, 7])
+        self.assertTrue(np.array_equal(sr.get_rotation_sources((9, 11), 30.0, rows, cols), indices[rows, cols]))
+        self.assertTrue(np.array_equal(sr.get_rotation_sources((9, 11), 30.0, np.arange(3, 9), 6), indices[3:, 6]))
+
     def test_resample_image_1(self):
         src = './tests/data/pa_large_dsm_3_1.tif'
         dst = './tests/results/pa_large_dsm_3_1_1p0.tif'
@@ -122,6 +168,22 @@ class TestRaster(unittest.TestCase):
         avg_gsd = sr.get_gsd(dst)
         self.assertEqual(avg_gsd, 1.0)
 
+    def test_resample_image_2(self):
+        dst = './tests/results/Patch_DEM_2p0_max.tif'
+        epsg = 32610
+        resampled = sr.resample_image(self.patch, dst, epsg, epsg, 2.0, -9999, resampling='max')
+        self.assertTrue(resampled)
+        self.assertEqual(sr.get_gsd(dst), 2.0)
+        stats = sr.compare_surfaces(self.patch, dst)
+        self.assertGreaterEqual(stats['min'], 0.0)
+        self.assertEqual(stats['lost'], 0.0)
+
+    def test_compare_surfaces_1(self):
+        stats = sr.compare_surfaces(self.patch, self.patch)
+        self.assertEqual(stats['min'], 0.0)
+        self.assertEqual(stats['max'], 0.0)
+        self.assertEqual(stats['lost'], 0.0)
+
     def test_clip_padded_image_1(self):
         img = sr.SolarImage()
         self.assertTrue(img.open_image(self.lena))
@@ -140,5 +202,27 @@ class TestRaster(unittest.TestCase):
         sr.write_affine(filename, affine)
         self.assertTrue(os.path.exists(filename))
 
+    def test_patch_output_1(self):
+        if not os.path.exists('./tests/results'):
+            os.makedirs('./tests/results')
+        filename = './tests/results/patch_output.tif'
+        img = sr.SolarImage()
+        img.open_image(self.patch)
+        profile = img.profile()
+        img.close_image()
+        profile.update(height=20, width=30)
+        sr.write_output(filename, np.zeros((20, 30), dtype=np.float32), profile)
+        mask = np.zeros((20, 30), dtype=bool)
+        mask[5, 7] = True
+        mask[12, 20] = True
+        sr.patch_output(filename, np.full((20, 30), 3.0, dtype=np.float32), mask)
+        img = sr.SolarImage()
+        img.open_image(filename)
+        patched = img.get_bands(1)
+        img.close_image()
+        self.assertEqual(np.sum(patched), 6.0)
+        self.assertEqual(patched[5][7], 3.0)
+        self.assertEqual(patched[12][20], 3.0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import functools
+import hashlib
+import http.server
+import io
+import logging
+import os
+import re
+import shutil
+import threading
+import unittest
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.transform import Affine
+
+import solar_cache as sk
+import solar_rasterio as sr
+import solar_remote as sm
+
+logging.basicConfig(filename='solar_remote_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Stand in for object storage, serves byte ranges and counts the bytes sent."""
+    protocol_version = 'HTTP/1.1'
+    served = []
+
+    def send_head(self):
+        path = self.translate_path(self.path.split('?')[0])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, 'rb') as src:
+            data = src.read()
+        etag = '"%s"' % (hashlib.md5(data).hexdigest())
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if 'no_etag' not in path:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if self.command == 'GET':
+            RangeHandler.served.append(len(data))
+        return io.BytesIO(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestRemote(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.output_path = './tests/results'
+        cls.remote_path = os.path.join(cls.output_path, 'remote')
+        if not os.path.exists(cls.remote_path):
+            os.makedirs(cls.remote_path)
+
+        # A cloud optimized GeoTIFF of small blocks with overviews, the patch tiled 4 by 4 so a window is a
+        # small part of it.
+        with rasterio.open('./tests/data/Patch_DEM.tif') as src:
+            profile = src.profile
+            data = np.tile(src.read(1), (4, 4))
+        profile.update(driver='GTiff', height=data.shape[0], width=data.shape[1])
+        tiled_name = os.path.join(cls.remote_path, 'Patch_DEM_tiled.tif')
+        with rasterio.open(tiled_name, 'w', **profile) as dst:
+            dst.write(data, 1)
+        cls.file_name = os.path.join(cls.remote_path, 'Patch_DEM_cog.tif')
+        rasterio.shutil.copy(tiled_name, cls.file_name, driver='COG', BLOCKSIZE=64, OVERVIEW_RESAMPLING='average')
+        os.remove(tiled_name)
+        handler = functools.partial(RangeHandler, directory=cls.remote_path)
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = 'http://127.0.0.1:%d/Patch_DEM_cog.tif' % (cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get_local(self, name):
+        img = sr.SolarImage()
+        self.assertTrue(img.open_image(name))
+        data = img.get_bands(1)
+        affine = img.get_affine()
+        img.close_image()
+        return data, affine
+
+    def test_get_gdal_path_1(self):
+        self.assertTrue(sm.is_remote('https://example.com/dem.tif'))
+        self.assertFalse(sm.is_remote('./tests/data/Patch_DEM.tif'))
+        self.assertEqual(sm.get_gdal_path('s3://bucket/dem.tif'), '/vsis3/bucket/dem.tif')
+        self.assertEqual(sm.get_gdal_path('https://example.com/dem.tif'), 'https://example.com/dem.tif')
+
+    def test_get_overview_level_1(self):
+        self.assertIsNone(sm.get_overview_level([2, 4, 8], 0.5, 0.5))
+        self.assertEqual(sm.get_overview_level([2, 4, 8], 0.5, 1.0), 0)
+        self.assertEqual(sm.get_overview_level([2, 4, 8], 0.5, 3.0), 1)
+        self.assertEqual(sm.get_overview_level([2, 4, 8], 0.5, 30.0), 2)
+
+    def test_get_metric_gsd_1(self):
+        # A 2 unit pixel in meters, feet and degrees.
+        data = np.zeros((10, 10), dtype=np.float32)
+        gsds = {}
+        for (epsg_code, x, y, gsd) in [(32610, 550000.0, 5270000.0, 2.0), (2263, 980000.0, 200000.0, 2.0),
+                                       (4326, -122.3, 47.6, 2.0 / 3600.0)]:
+            name = os.path.join(self.remote_path, 'gsd_%d.tif' % (epsg_code))
+            with rasterio.open(name, 'w', driver='GTiff', height=10, width=10, count=1, dtype='float32',
+                               crs='EPSG:%d' % (epsg_code), transform=Affine(gsd, 0.0, x, 0.0, -gsd, y)) as dst:
+                dst.write(data, 1)
+            img = sr.SolarImage()
+            self.assertTrue(img.open_image(name))
+            gsds[epsg_code] = sm.get_metric_gsd(img)
+            img.close_image()
+            os.remove(name)
+        self.assertAlmostEqual(gsds[32610], 2.0)
+        self.assertAlmostEqual(gsds[2263], 2.0 * 0.3048006096)
+        # Two arc seconds are about 42 m east and 62 m north at 47.6 degrees.
+        self.assertTrue(abs(gsds[4326] - (41.7 + 61.8) / 2.0) < 0.5)
+
+    def test_get_version_1(self):
+        version = sm.get_version(self.url + '?version_1')
+        self.assertIsNotNone(version)
+        self.assertEqual(sm.get_version(self.url + '?version_2'), version)
+        self.assertIsNone(sm.get_version('s3://bucket/dem.tif'))
+        self.assertIsNone(sm.get_version(self.url.replace('Patch_DEM_cog', 'missing')))
+
+    def test_get_bounds_window_1(self):
+        affine = (0.5, 0.0, 1000.0, 0.0, -0.5, 2000.0)
+        self.assertEqual(sm.get_bounds_window(affine, (100, 200)), ((0, 100), (0, 200)))
+        self.assertEqual(sm.get_bounds_window(affine, (100, 200), (1010.0, 1980.0, 1020.25, 1990.0)),
+                         ((20, 40), (20, 41)))
+        self.assertEqual(sm.get_bounds_window(affine, (100, 200), (900.0, 1900.0, 1010.0, 2100.0)),
+                         ((0, 100), (0, 20)))
+        self.assertIsNone(sm.get_bounds_window(affine, (100, 200), (3000.0, 1900.0, 3010.0, 2100.0)))
+
+    def test_fetch_surface_1(self):
+        (full, affine) = self.get_local(self.file_name)
+        bounds = (affine[2] + 10 * affine[0], affine[5] + 90 * affine[4], affine[2] + 70 * affine[0],
+                  affine[5] + 30 * affine[4])
+        cache = sk.StageCache()
+        cache_path = os.path.join(self.output_path, 'remote_cache')
+        shutil.rmtree(cache_path, ignore_errors=True)
+        cache.open_cache(cache_path)
+
+        RangeHandler.served = []
+        (success, name) = sm.fetch_surface(self.url + '?fetch_1', self.output_path, bounds, cache=cache)
+        self.assertTrue(success)
+        (window, window_affine) = self.get_local(name)
+        os.remove(name)
+        self.assertTrue(np.array_equal(window, full[30:90, 10:70]))
+        self.assertAlmostEqual(window_affine[2], bounds[0])
+        self.assertAlmostEqual(window_affine[5], bounds[3])
+        self.assertTrue(sum(RangeHandler.served) < os.path.getsize(self.file_name) / 4)
+
+        # The blocks come from the cache the second time, only the header is read.
+        first = sum(RangeHandler.served)
+        RangeHandler.served = []
+        (success, name) = sm.fetch_surface(self.url + '?fetch_2', self.output_path, bounds, cache=cache)
+        self.assertTrue(success)
+        (cached, _) = self.get_local(name)
+        os.remove(name)
+        self.assertTrue(np.array_equal(cached, window))
+        self.assertTrue(sum(RangeHandler.served) < first)
+
+    def test_fetch_surface_2(self):
+        img = sr.SolarImage()
+        self.assertTrue(img.open_image(self.file_name))
+        gsd = img.get_avg_gsd() * img.overviews()[0]
+        height = img.shape()[0]
+        img.close_image()
+        (success, name) = sm.fetch_surface(self.url + '?fetch_3', self.output_path, gsd=gsd)
+        self.assertTrue(success)
+        (overview, _) = self.get_local(name)
+        os.remove(name)
+        self.assertEqual(overview.shape[0], (height + 1) // 2)
+        (success, name) = sm.fetch_surface(self.url + '?fetch_4', self.output_path, (0.0, 0.0, 1.0, 1.0))
+        self.assertFalse(success)
+
+    def test_fetch_surface_3(self):
+        # A surface replaced under the same URL is read again, one without a version is never cached.
+        cache = sk.StageCache()
+        cache_path = os.path.join(self.output_path, 'remote_cache_3')
+        shutil.rmtree(cache_path, ignore_errors=True)
+        cache.open_cache(cache_path)
+        (full, _) = self.get_local(self.file_name)
+        for (name, changed) in [('Patch_DEM_changed.tif', True), ('Patch_DEM_no_etag.tif', False)]:
+            local_name = os.path.join(self.remote_path, name)
+            url = self.url.replace('Patch_DEM_cog.tif', name)
+            shutil.copy(self.file_name, local_name)
+            (success, first) = sm.fetch_surface(url + '?before', self.output_path, cache=cache)
+            self.assertTrue(success)
+            with rasterio.open(self.file_name) as src:
+                profile = src.profile
+            with rasterio.open(local_name, 'w', **profile) as dst:
+                dst.write(full + 1.0, 1)
+            RangeHandler.served = []
+            (success, second) = sm.fetch_surface(url + '?after', self.output_path, cache=cache)
+            self.assertTrue(success)
+            self.assertTrue(sum(RangeHandler.served) > 0)
+            (before, _) = self.get_local(first)
+            (after, _) = self.get_local(second)
+            self.assertTrue(np.array_equal(after, before + 1.0))
+            os.remove(first)
+            os.remove(second)
+            os.remove(local_name)
+        self.assertTrue(any(x.endswith('.npz') for x in os.listdir(cache_path)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import unittest
+import numpy as np
+
+import solar_shadow_cube as ss
+
+logging.basicConfig(filename='solar_shadow_cube_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestShadowCube(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+        self.name = os.path.join(self.output_path, 'cube_test_shadow')
+        self.times = [0, 3600, 7200, 10800]
+        valid = np.ones((4, 11), dtype=bool)
+        valid[3][10] = False
+        cube = ss.ShadowCube()
+        cube.create_cube(self.name, self.times, valid)
+        for time in self.times:
+            shadow = np.zeros((4, 11), dtype=bool)
+            if time < 7200:
+                shadow[0][:] = True
+            cube.put_shadow(time, shadow)
+
+    def test_open_cube_1(self):
+        cube = ss.ShadowCube()
+        self.assertTrue(cube.open_cube(self.name))
+        self.assertEqual(cube.shape, (4, 11))
+        self.assertEqual(cube.times, [0, 3600, 7200, 10800])
+        self.assertTrue(cube.get_shadow(1)[0][10])
+        self.assertFalse(cube.get_shadow(2)[0][10])
+
+    def test_open_cube_2(self):
+        cube = ss.ShadowCube()
+        self.assertFalse(cube.open_cube('./tests/results/no_cube'))
+
+    def test_get_weights_1(self):
+        cube = ss.ShadowCube()
+        cube.open_cube(self.name)
+        weights = cube.get_weights(0, 10800)
+        self.assertEqual(list(weights), [1800, 3600, 3600, 1800])
+        weights = cube.get_weights(3600, 7200)
+        self.assertEqual(list(weights), [0, 1800, 1800, 0])
+
+    def test_sun_seconds_1(self):
+        cube = ss.ShadowCube()
+        cube.open_cube(self.name)
+        seconds = cube.sun_seconds(0, 10800)
+        self.assertEqual(seconds[0][0], 5400)
+        self.assertEqual(seconds[1][0], 10800)
+        self.assertEqual(seconds[3][10], -9999)
+        seconds = cube.sun_seconds(0, 10800, rows=slice(0, 1))
+        self.assertEqual(seconds.shape, (1, 11))
+
+    def test_region_sun_seconds_1(self):
+        cube = ss.ShadowCube()
+        cube.open_cube(self.name)
+        region = np.zeros((4, 11), dtype=bool)
+        region[0:2, :] = True
+        self.assertEqual(cube.region_sun_seconds(0, 10800, region), 8100)
+        region = np.zeros((4, 11), dtype=bool)
+        region[3][10] = True
+        self.assertEqual(cube.region_sun_seconds(0, 10800, region), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+import unittest
+from unittest import mock
+
+logging.basicConfig(filename='solar_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+# How many times slower the help may start than a bare interpreter, and the angle processor than NumPy alone.
+# Relative to the same machine, so a loaded CI machine slows both sides.
+IMPORT_BUDGET = 3.0
+
+# Dependencies only a stage that needs them may load.
+HEAVY_MODULES = ['matplotlib', 'scipy', 'osgeo', 'rasterio', 'skimage', 'pysolar', 'tqdm', 'numpy']
+
+HELP_CODE = '''
+import sys
+import solar
+sys.argv = ['solar.py', '--help']
+try:
+    solar.arg_parse()
+except SystemExit:
+    pass
+print(' '.join(sorted(set(name.split('.')[0] for name in sys.modules))))
+'''
+
+class TestSolar(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def run_code(self, code):
+        """Run code in a fresh interpreter, returning its output lines."""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([os.path.abspath('./src')] + env.get('PYTHONPATH', '').split(os.pathsep))
+        result = subprocess.run([sys.executable, '-c', code], cwd=self.output_path, env=env, capture_output=True,
+                                text=True, check=True)
+        return result.stdout.strip().split('\n')
+
+    def time_code(self, code, runs=3):
+        """Get the fastest of some runs of code in a fresh interpreter, in seconds."""
+        seconds = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            self.run_code(code)
+            seconds.append(time.perf_counter() - start)
+        return min(seconds)
+
+    def test_help_1(self):
+        lines = self.run_code(HELP_CODE)
+        modules = lines[-1].split()
+        self.assertIn('argparse', modules)
+        for module in HEAVY_MODULES:
+            # The interpreter itself may preload some, only those the help loads count.
+            if module not in self.run_code('import sys; print(" ".join(sys.modules))')[-1].split():
+                self.assertNotIn(module, modules)
+
+    def test_arg_parse_choices_1(self):
+        # The parser repeats the choices of the modules it does not load, they stay the same.
+        import solar
+        import solar_angle_processor as sa
+        import solar_tiles as st
+        import solar_utility as su
+        parsers = []
+        with mock.patch.object(argparse.ArgumentParser, 'parse_args', autospec=True,
+                               side_effect=lambda parser, *args: parsers.append(parser)):
+            solar.arg_parse()
+        choices = {action.dest: action.choices for action in parsers[0]._actions}
+        self.assertEqual(choices['executor'], sa.EXECUTORS)
+        self.assertEqual(choices['render'], st.RENDERERS)
+        self.assertEqual(choices['precision'], list(su.PRECISIONS))
+
+    def test_checkpoint_progressive_1(self):
+        code = ('import sys, solar\nsys.argv = ["solar.py", "-s", "dem.tif", "-o", ".", "-y", "2017", "-m", "6", "-d", "21", '
+                '"-k", "-p", "2"]\nsolar.main()')
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.run_code(code)
+        self.assertEqual(context.exception.returncode, 1)
+        self.assertIn('can not be combined', context.exception.stdout)
+
+    def test_angle_processor_imports_1(self):
+        lines = self.run_code('import sys, solar_angle_processor\nprint(" ".join(sys.modules))')
+        modules = lines[-1].split()
+        self.assertIn('solar_rasterio', modules)
+        self.assertNotIn('matplotlib', modules)
+        self.assertNotIn('scipy', modules)
+        self.assertNotIn('osgeo', modules)
+        # Spawned pool and queue workers import it too, they load these only when a stage runs.
+        self.assertNotIn('rasterio', modules)
+        self.assertNotIn('pysolar', modules)
+        self.assertNotIn('tqdm', modules)
+
+    def test_import_budget_1(self):
+        bare = self.time_code('pass')
+        self.assertLess(self.time_code(HELP_CODE), IMPORT_BUDGET * bare)
+        numpy = self.time_code('import numpy')
+        self.assertLess(self.time_code('import solar_angle_processor'), IMPORT_BUDGET * numpy)
+
+if __name__ == '__main__':
+    unittest.main()
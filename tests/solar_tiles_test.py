@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import unittest
+import matplotlib
+import matplotlib.image
+import numpy as np
+import rasterio
+
+import solar_rasterio as sr
+import solar_tiles as st
+
+logging.basicConfig(filename='solar_tiles_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def test_get_color_lut_1(self):
+        lut = st.get_color_lut('jet')
+        self.assertEqual(lut.shape, (256, 4))
+        self.assertEqual(lut.dtype, np.uint8)
+        expected = np.round(matplotlib.colormaps['jet'](1.0) * np.array(255.0)).astype(np.uint8)
+        self.assertTrue(np.array_equal(lut[255], expected))
+
+    def test_apply_color_lut_1(self):
+        lut = st.get_color_lut('gray')
+        data = np.array([[0, 50, 100], [100, 0, 25]], dtype=np.uint8)
+        valid = np.array([[True, True, True], [False, True, True]])
+        rgba = st.apply_color_lut(data, lut, valid)
+        self.assertEqual(rgba.shape, (2, 3, 4))
+        self.assertTrue(np.array_equal(rgba[0, 0], lut[0]))
+        self.assertTrue(np.array_equal(rgba[0, 1], lut[128]))
+        self.assertTrue(np.array_equal(rgba[0, 2], lut[255]))
+        self.assertTrue(np.array_equal(rgba[1, 0], [0, 0, 0, 0]))
+        self.assertTrue(np.array_equal(rgba[1, 2], lut[64]))
+
+    def test_get_tile_range_1(self):
+        self.assertEqual(st.get_tile_range((-180.0, -85.0, 180.0, 85.0), 0), (0, 0, 0, 0))
+        self.assertEqual(st.get_tile_range((-122.4, 37.7, -122.3, 37.8), 1), (0, 0, 0, 0))
+        (min_x, max_x, min_y, max_y) = st.get_tile_range((-122.4, 37.7, -122.3, 37.8), 12)
+        self.assertEqual((min_x, min_y), (655, 1582))
+        self.assertTrue(max_x >= min_x and max_y >= min_y)
+
+    def test_get_tile_bounds_1(self):
+        (left, bottom, right, top) = st.get_tile_bounds(1, 0, 1)
+        self.assertAlmostEqual(left, 0.0)
+        self.assertAlmostEqual(bottom, 0.0)
+        self.assertAlmostEqual(right, st.MERCATOR_ORIGIN)
+        self.assertAlmostEqual(top, st.MERCATOR_ORIGIN)
+
+    def test_render_tile_1(self):
+        # A one degree geographic surface, left half valid.
+        data = np.full((10, 10), 100, dtype=np.uint8)
+        valid = np.zeros((10, 10), dtype=bool)
+        valid[:, 0:5] = True
+        affine = [0.1, 0.0, 10.0, 0.0, -0.1, 1.0]
+        lut = st.get_color_lut('jet')
+        self.assertIsNone(st.render_tile(data, valid, affine, 'EPSG:4326', 0, 0, 1, lut))
+        (min_x, max_x, min_y, max_y) = st.get_tile_range((10.0, 0.0, 11.0, 1.0), 8)
+        rgba = st.render_tile(data, valid, affine, 'EPSG:4326', min_x, min_y, 8, lut)
+        self.assertEqual(rgba.shape, (st.TILE_SIZE, st.TILE_SIZE, 4))
+        alpha = rgba[:, :, 3] > 0
+        self.assertTrue(alpha.any())
+        self.assertTrue(np.all(rgba[alpha] == lut[255]))
+        # The valid points are west of 10.5 degrees.
+        (left, _, right, _) = st.get_tile_bounds(min_x, min_y, 8)
+        lon = np.degrees((left + (np.nonzero(alpha.any(axis=0))[0] + 0.5) * (right - left) / st.TILE_SIZE) /
+                         st.MERCATOR_RADIUS)
+        self.assertTrue(np.all(lon < 10.5) and np.all(lon >= 10.0))
+
+    def test_write_tiles_1(self):
+        data = np.full((10, 10), 50, dtype=np.uint8)
+        valid = np.ones((10, 10), dtype=bool)
+        affine = [0.1, 0.0, 10.0, 0.0, -0.1, 1.0]
+        tile_path = os.path.join(self.output_path, 'tiles_1')
+        count = st.write_tiles(tile_path, data, valid, affine, 'EPSG:4326', 'jet', 0, 3, 2)
+        self.assertEqual(count, 4)
+        self.assertTrue(os.path.exists(os.path.join(tile_path, '0', '0', '0.png')))
+        self.assertTrue(os.path.exists(os.path.join(tile_path, '3', '4', '3.png')))
+        count = st.write_tiles(tile_path, data, valid, affine, 'EPSG:4326', 'jet', 3, 3, 2, tms=True)
+        self.assertEqual(count, 1)
+        self.assertTrue(os.path.exists(os.path.join(tile_path, '3', '4', '4.png')))
+        tile = matplotlib.image.imread(os.path.join(tile_path, '3', '4', '4.png'))
+        self.assertEqual(tile.shape, (st.TILE_SIZE, st.TILE_SIZE, 4))
+
+    def test_write_color_image_1(self):
+        filename = './tests/data/Patch_DEM.tif'
+        img = sr.SolarImage()
+        self.assertTrue(img.open_image(filename))
+        profile = img.profile()
+        img.close_image()
+        (height, width) = (profile['height'], profile['width'])
+        percentage_light = np.tile(np.linspace(0, 100, width).astype(np.uint8), (height, 1))
+        valid = np.ones((height, width), dtype=bool)
+        valid[0, :] = False
+        affine = [1.0, 0.0, 0.0, 0.0, -1.0, 0.0]
+        st.write_color_image(self.output_path, 'color_1', percentage_light, valid, affine, profile, 'jet')
+        self.assertTrue(os.path.exists('./tests/results/color_1_light_perc.pngw'))
+        png = matplotlib.image.imread('./tests/results/color_1_light_perc.png')
+        self.assertEqual(png.shape, (height, width, 4))
+        with rasterio.open('./tests/results/color_1_light_perc_rgba.tif') as src:
+            self.assertEqual(src.count, 4)
+            rgba = src.read()
+        self.assertTrue(np.all(rgba[3, 0, :] == 0))
+        self.assertTrue(np.all(rgba[3, 1:, :] == 255))
+        self.assertTrue(np.array_equal(rgba[0:3, 1, -1], st.get_color_lut('jet')[255, 0:3]))
+
+if __name__ == '__main__':
+    unittest.main()
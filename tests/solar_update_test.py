@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import logging
+import unittest
+import numpy as np
+
+import solar_utility as su
+import solar_update as sp
+
+logging.basicConfig(filename='solar_update_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.no_data = -9999
+        self.previous = su.create_image((40, 40), 100.0)
+        self.surface = self.previous.copy()
+        self.surface[20, 20] = 110.0
+
+    def test_get_changed_mask_1(self):
+        self.surface[3, 4] = self.no_data
+        self.surface[5, 6] += 0.001
+        changed = sp.get_changed_mask(self.surface, self.previous, self.no_data)
+        self.assertEqual(np.count_nonzero(changed), 2)
+        self.assertTrue(changed[20][20])
+        self.assertTrue(changed[3][4])
+
+    def test_get_affected_mask_1(self):
+        # The sun in the south, a change can only affect the points to the north.
+        changed = sp.get_changed_mask(self.surface, self.previous, self.no_data)
+        affected = sp.get_affected_mask(changed, self.surface, self.previous, 180.0, 30.0, self.no_data)
+        self.assertTrue(affected[0][20])
+        self.assertTrue(affected[20][20])
+        self.assertFalse(affected[25][20])
+        self.assertFalse(affected[10][10])
+
+    def test_get_affected_mask_2(self):
+        # Bounded, a 10m change with the sun at 45 degrees reaches 10m.
+        changed = sp.get_changed_mask(self.surface, self.previous, self.no_data)
+        affected = sp.get_affected_mask(changed, self.surface, self.previous, 90.0, 45.0, self.no_data, 1.0, True)
+        self.assertTrue(affected[20][10])
+        self.assertFalse(affected[20][5])
+        self.assertFalse(affected[20][25])
+
+if __name__ == '__main__':
+    unittest.main()
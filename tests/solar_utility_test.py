@@ -9,7 +9,7 @@ import pytz
 import skimage.io as io
 import unittest
 
-from solar_utility import get_seconds_from_datetime, get_time_from_seconds, get_sun_rise_set, create_image, get_processing_times, get_datetime, combine_datetime, log
+from solar_utility import get_seconds_from_datetime, get_time_from_seconds, get_sun_rise_set, create_image, get_processing_times, get_datetime, combine_datetime, log, set_precision, get_dtype, get_no_data
 
 logging.basicConfig(filename='solar_utility_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
 
@@ -54,7 +54,7 @@ class TestUtility(unittest.TestCase):
         (height, width) = test_image.shape
         self.assertEquals(height, 15)
         self.assertEquals(width, 10)
-        self.assertEquals(test_image.dtype, 'float64')
+        self.assertEquals(test_image.dtype, 'float32')
         self.assertEquals(test_image[5][5], 10)
 
     def test_create_image_2(self):
@@ -62,7 +62,7 @@ class TestUtility(unittest.TestCase):
         (height, width) = test_image.shape
         self.assertEquals(height, 10)
         self.assertEquals(width, 15)
-        self.assertEquals(test_image.dtype, 'float64')
+        self.assertEquals(test_image.dtype, 'float32')
         self.assertEquals(test_image[5][5], 0)
 
     def test_create_image_3(self):
@@ -81,6 +81,36 @@ class TestUtility(unittest.TestCase):
         self.assertEquals(width, 1)
         self.assertEquals(test_image[10][0], no_data)
 
+    def test_create_image_5(self):
+        set_precision('double')
+        test_image = create_image((20, 15), 3)
+        self.assertEquals(test_image.dtype, 'float64')
+        set_precision('compact')
+        test_image = create_image((20, 15), 3)
+        self.assertEquals(test_image.dtype, 'float32')
+
+    def test_get_dtype_1(self):
+        self.assertEquals(get_dtype('seconds'), np.int32)
+        self.assertEquals(get_dtype('percentage'), np.uint8)
+        self.assertEquals(get_dtype('mask'), np.bool_)
+
+    def test_get_dtype_2(self):
+        # rasterio gives the no data value as a float.
+        self.assertEqual(get_dtype('seconds', -9999.0), np.int32)
+        self.assertEqual(get_dtype('seconds', -3.4028234663852886e+38), np.float64)
+        self.assertEqual(get_dtype('seconds', -9999.5), np.float64)
+        self.assertEqual(get_dtype('angle', -3.4028234663852886e+38), np.float32)
+        test_image = create_image((5, 5), -9999.0, get_dtype('seconds', -9999.0))
+        self.assertEqual(test_image.dtype, np.int32)
+        self.assertEqual(test_image[2][2], -9999)
+
+    def test_get_no_data_1(self):
+        self.assertEqual(get_no_data('percentage', -9999.0), 255)
+        self.assertEqual(get_no_data('percentage', None), 255)
+        self.assertEqual(get_no_data('percentage', 200), 200)
+        self.assertEqual(get_no_data('seconds', -9999.0), -9999.0)
+        self.assertEqual(get_no_data('radiation', -9999.0), -9999.0)
+
     def test_create_dem_1(self):
         width = 22
         height = 22
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import unittest
+import numpy as np
+
+import solar_zonal as sz
+
+logging.basicConfig(filename='solar_zonal_test.log', format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s', datefmt="%Y-%m-%d %H:%M:%S", filemode='w', level=logging.DEBUG)
+
+class TestZonal(unittest.TestCase):
+
+    def setUp(self):
+        self.output_path = './tests/results'
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+    def test_zonal_statistics_1(self):
+        no_data = -9999
+        rng = np.random.RandomState(1)
+        labels = rng.randint(0, 4, (30, 40))
+        data = rng.uniform(0, 100, (30, 40))
+        data[rng.uniform(size=(30, 40)) < 0.1] = no_data
+        stats = sz.zonal_statistics(labels, data, 3, no_data)
+        for zone in range(1, 4):
+            values = data[(labels == zone) & (data != no_data)]
+            self.assertEqual(stats['count'][zone - 1], len(values))
+            self.assertAlmostEqual(stats['mean'][zone - 1], np.mean(values))
+            self.assertAlmostEqual(stats['min'][zone - 1], np.amin(values))
+            self.assertAlmostEqual(stats['max'][zone - 1], np.amax(values))
+            for percentile in sz.PERCENTILES:
+                self.assertAlmostEqual(stats['p%d' % (percentile)][zone - 1], np.percentile(values, percentile))
+
+    def test_zonal_statistics_2(self):
+        no_data = -9999
+        labels = np.array([[1, 1, 0], [3, 3, 3]])
+        data = np.array([[5, no_data, 7], [1, 2, 3]])
+        stats = sz.zonal_statistics(labels, data, 3, no_data)
+        self.assertEqual(list(stats['count']), [1, 0, 3])
+        self.assertEqual(stats['mean'][1], no_data)
+        self.assertEqual(stats['p50'][2], 2)
+        self.assertEqual(stats['max'][0], 5)
+
+    def test_write_zonal_statistics_1(self):
+        no_data = -9999
+        labels = np.array([[1, 2], [2, 2]])
+        data = np.array([[10, 20], [30, 40]])
+        stats = sz.zonal_statistics(labels, data, 2, no_data)
+        name = './tests/results/zonal_1.csv'
+        sz.write_zonal_statistics(name, ['roof', 'parcel'], [('light_secs', stats)])
+        with open(name, 'r') as zonal_file:
+            lines = zonal_file.read().splitlines()
+        self.assertEqual(lines[0], 'id,light_secs_count,light_secs_mean,light_secs_min,light_secs_max,'
+                                   'light_secs_p25,light_secs_p50,light_secs_p75')
+        self.assertEqual(lines[2], 'parcel,3,30.00,20.00,40.00,25.00,30.00,35.00')
+
+    def test_get_zone_labels_1(self):
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'id': 'a'}, 'geometry': {'type': 'Polygon', 'coordinates': [[
+                [0, 0], [4, 0], [4, -2], [0, -2], [0, 0]]]}},
+            {'type': 'Feature', 'properties': {'id': 'b'}, 'geometry': {'type': 'Polygon', 'coordinates': [[
+                [2, -4], [6, -4], [6, -6], [2, -6], [2, -4]]]}}]}
+        name = './tests/results/zones_1.geojson'
+        with open(name, 'w') as geojson_file:
+            json.dump(collection, geojson_file)
+        (ids, labels) = sz.get_zone_labels(name, (8, 8), [1.0, 0.0, 0.0, 0.0, -1.0, 0.0])
+        self.assertEqual(ids, ['a', 'b'])
+        self.assertEqual(np.count_nonzero(labels == 1), 8)
+        self.assertEqual(np.count_nonzero(labels == 2), 8)
+        self.assertEqual(labels[0][0], 1)
+        self.assertEqual(labels[5][5], 2)
+
+if __name__ == '__main__':
+    unittest.main()